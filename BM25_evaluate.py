@@ -17,8 +17,39 @@ import re
 from typing import Dict, List, Optional, Any, Tuple
 from config import debug_print, verbose_print, info_print, error_print, QUIET_MODE
 from collections import Counter
-import math
+from functools import lru_cache
+from scipy import sparse
 from read_chuck import EvaluationConfig, DataLoader, TextProcessor
+from text_similarity import (
+    calculate_text_similarity_matrix, calculate_text_similarity_matrices, calculate_text_similarity_row_maxima,
+    calculate_semantic_containment_matrix,
+    calculate_text_similarity_from_prepared, prepare_text, clear_similarity_cache
+)
+import bm25_numba
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+# 分词正则：中文单字 | 英文单词 | 数字
+_TOKEN_RE = re.compile(r'([\u4e00-\u9fff])|([a-zA-Z]+)|(\d+)')
+_BOOK_TITLE_RE = re.compile(r'《([^》]+)》')
+_ACTION_WORDS = ('分享', '推荐', '读了', '读了本', '最近读了', '书籍', '书', '读书', '阅读', '读后感')
+
+# 行数达到该值时才启用进程池（行数较少时进程启动开销大于收益）
+PARALLEL_MIN_ROWS = 16
+
+def get_process_context():
+    """
+    获取进程池使用的多进程上下文
+    优先使用forkserver：主进程中已启动的Numba并行线程池（TBB）在fork后不安全，
+    forkserver的子进程从干净的服务进程派生；不支持时（如Windows）使用平台默认方式
+    
+    Returns:
+        multiprocessing.context.BaseContext: 多进程上下文
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context()
 
 class BM25:
     """BM25算法实现"""
@@ -39,6 +70,16 @@ class BM25:
         self.idf = {}
         self.doc_len = []
         self.avgdl = 0
+        
+        # 结构化数组（SoA）表示：词表、词频稀疏矩阵、文档长度数组、IDF数组
+        self.vocab = {}
+        self.tf_csr = sparse.csr_matrix((0, 0), dtype=np.float64)
+        self.doc_len_arr = np.zeros(0, dtype=np.float64)
+        self.idf_arr = np.zeros(0, dtype=np.float64)
+        self.norm_inv = np.zeros(0, dtype=np.float64)
+        
+        # 安装了numba时默认使用JIT评分内核
+        self.use_numba = bm25_numba.NUMBA_AVAILABLE
     
     def fit(self, corpus: List[str]):
         """
@@ -54,64 +95,73 @@ class BM25:
         self.doc_len = [len(doc) for doc in self.corpus]
         self.avgdl = sum(self.doc_len) / self.corpus_size if self.corpus_size > 0 else 0
         
-        # 计算词频和文档频率
+        # 计算词频和文档频率（单次遍历，文档频率用Counter.update累加）
         self.doc_freqs = []
-        df = {}
+        df = Counter()
         
         for doc in self.corpus:
             frequencies = Counter(doc)
             self.doc_freqs.append(frequencies)
-            
-            for word in frequencies:
-                df[word] = df.get(word, 0) + 1
-        
-        # 计算IDF
-        for word, freq in df.items():
-            self.idf[word] = math.log((self.corpus_size - freq + 0.5) / (freq + 0.5))
+            df.update(frequencies.keys())
+        
+        # 计算IDF（基于文档频率数组一次性计算）
+        words = list(df.keys())
+        doc_freq_arr = np.fromiter(df.values(), dtype=np.float64, count=len(df))
+        self.idf_arr = np.log((self.corpus_size - doc_freq_arr + 0.5) / (doc_freq_arr + 0.5))
+        self.idf = dict(zip(words, self.idf_arr.tolist()))
+        
+        # 构建SoA数组：全局词表 + CSR词频矩阵 (文档数 × 词表大小)
+        self.vocab = {word: i for i, word in enumerate(words)}
+        indptr = [0]
+        indices = []
+        data = []
+        for frequencies in self.doc_freqs:
+            for word, freq in frequencies.items():
+                indices.append(self.vocab[word])
+                data.append(freq)
+            indptr.append(len(indices))
+        self.tf_csr = sparse.csr_matrix(
+            (np.asarray(data, dtype=np.float64), np.asarray(indices, dtype=np.int64), np.asarray(indptr, dtype=np.int64)),
+            shape=(self.corpus_size, len(self.vocab))
+        )
+        self.doc_len_arr = np.asarray(self.doc_len, dtype=np.float64)
+        
+        # 预计算每个文档的长度归一化倒数 1 / (k1 * (1 - b + b * doc_len / avgdl))，评分时不再做除法
+        if self.avgdl > 0:
+            self.norm_inv = 1.0 / (self.k1 * (1 - self.b + self.b * self.doc_len_arr / self.avgdl))
+        else:
+            self.norm_inv = np.full(self.corpus_size, 1.0 / (self.k1 * (1 - self.b)) if self.b < 1 else 0.0)
     
-    def _tokenize(self, text: str) -> List[str]:
+    @staticmethod
+    @lru_cache(maxsize=100_000)
+    def _tokenize(text: str) -> Tuple[str, ...]:
         """
-        支持中文的分词函数
+        支持中文的分词函数（结果按文本缓存，同一分块只分词一次；保留重复token以计算词频）
         
         Args:
             text: 输入文本
             
         Returns:
-            List[str]: 分词结果
+            Tuple[str, ...]: 分词结果
         """
         if not text:
-            return []
+            return ()
         
         # 转换为小写
         text = text.lower()
         
-        # 更细粒度的中文分词
-        # 1. 提取中文字符（包括单字）
-        chinese_chars = re.findall(r'[\u4e00-\u9fff]', text)
-        
-        # 2. 提取英文单词
-        english_words = re.findall(r'[a-zA-Z]+', text)
-        
-        # 3. 提取数字
-        numbers = re.findall(r'\d+', text)
-        
-        # 4. 提取书名（《》中的内容）
-        book_titles = re.findall(r'《([^》]+)》', text)
-        
-        # 5. 提取常见的动作词和关键词
-        keywords = []
-        action_words = ['分享', '推荐', '读了', '读了本', '最近读了', '书籍', '书', '读书', '阅读', '读后感']
-        for word in action_words:
-            if word in text:
-                keywords.append(word)
+        # 单次扫描提取中文单字、英文单词和数字（三类字符互不重叠，结果与分别findall一致）
+        # 保留重复token，使fit中的Counter得到真实词频（去重会把所有词频截断为1）
+        tokens = [match.group(match.lastindex) for match in _TOKEN_RE.finditer(text)]
         
-        # 合并所有token
-        tokens = chinese_chars + english_words + numbers + book_titles + keywords
+        # 提取书名（《》中的内容，可能与上面的token重叠，单独匹配）
+        if '《' in text:
+            tokens.extend(_BOOK_TITLE_RE.findall(text))
         
-        # 去重并过滤掉长度小于1的token
-        tokens = list(set([token for token in tokens if len(token) >= 1]))
+        # 提取常见的动作词和关键词（动作词之间互相包含，用子串判断保证都能命中）
+        tokens.extend(word for word in _ACTION_WORDS if word in text)
         
-        return tokens
+        return tuple(tokens)
     
     def score(self, query: str, doc_index: int) -> float:
         """
@@ -124,27 +174,29 @@ class BM25:
         Returns:
             float: BM25分数
         """
-        if doc_index >= len(self.corpus):
+        if doc_index >= self.corpus_size:
             return 0.0
         
-        query_tokens = self._tokenize(query)
-        doc_freqs = self.doc_freqs[doc_index]
-        doc_len = self.doc_len[doc_index]
+        return float(self.get_scores(query)[doc_index])
+    
+    def _term_contributions(self, term_ids: List[int]) -> np.ndarray:
+        """
+        计算指定词项在所有文档上的BM25贡献值
         
-        score = 0.0
-        for token in query_tokens:
-            if token in doc_freqs:
-                tf = doc_freqs[token]
-                idf = self.idf.get(token, 0)
-                
-                # BM25公式
-                numerator = tf * (self.k1 + 1)
-                denominator = tf + self.k1 * (1 - self.b + self.b * (doc_len / self.avgdl))
-                score += idf * (numerator / denominator)
+        Args:
+            term_ids: 词表中的词项索引列表
+            
+        Returns:
+            np.ndarray: 形状为(文档数, 词项数)的贡献值矩阵
+        """
+        tf = self.tf_csr[:, term_ids].toarray()
         
-        return score
+        # BM25公式: idf * tf * (k1 + 1) / (tf + norm)，其中 norm = k1 * (1 - b + b * doc_len / avgdl)
+        # 等价改写为 weight - weight / (1 + tf / norm)，weight = idf * (k1 + 1)，文档长度归一化在fit时预计算
+        weight = self.idf_arr[term_ids] * (self.k1 + 1)
+        return weight - weight / (1.0 + tf * self.norm_inv[:, None])
     
-    def get_scores(self, query: str) -> List[float]:
+    def get_scores(self, query: str) -> np.ndarray:
         """
         获取查询对所有文档的分数
         
@@ -152,9 +204,348 @@ class BM25:
             query: 查询文本
             
         Returns:
-            List[float]: 所有文档的分数
+            np.ndarray: 所有文档的分数
+        """
+        query_ids = [self.vocab[token] for token in self._tokenize(query) if token in self.vocab]
+        if not query_ids or self.corpus_size == 0:
+            return np.zeros(self.corpus_size, dtype=np.float64)
+        
+        if self.use_numba:
+            # 每个词项的权重：查询中的出现次数 * idf * (k1 + 1)
+            query_weights = np.bincount(query_ids, minlength=len(self.vocab)) * self.idf_arr * (self.k1 + 1)
+            scores = np.empty(self.corpus_size, dtype=np.float64)
+            bm25_numba.score_csr(
+                self.tf_csr.indptr, self.tf_csr.indices, self.tf_csr.data, query_weights, self.norm_inv, scores
+            )
+            return scores
+        
+        return self._term_contributions(query_ids).sum(axis=1)
+    
+    def activate_numba_scorer(self) -> bool:
+        """
+        启用Numba JIT评分内核
+        
+        Returns:
+            bool: 是否启用成功（未安装numba时返回False并继续使用NumPy实现）
+        """
+        if not bm25_numba.NUMBA_AVAILABLE:
+            info_print("⚠️  numba 未安装，BM25继续使用NumPy评分")
+            self.use_numba = False
+            return False
+        
+        self.use_numba = True
+        return True
+    
+    def get_batch_scores(self, queries: List[str]) -> np.ndarray:
+        """
+        批量获取多个查询对所有文档的分数（复用同一个已训练的索引）
+        
+        Args:
+            queries: 查询文本列表
+            
+        Returns:
+            np.ndarray: 形状为(查询数, 文档数)的分数矩阵
+        """
+        query_tokens = [self._tokenize(query) for query in queries]
+        
+        # 只保留出现在语料库中的查询词
+        term_index = {}
+        for tokens in query_tokens:
+            for token in tokens:
+                if token in self.vocab and token not in term_index:
+                    term_index[token] = len(term_index)
+        
+        if not term_index or self.corpus_size == 0:
+            return np.zeros((len(queries), self.corpus_size), dtype=np.float64)
+        
+        # 查询-词项计数矩阵 (查询数 × 词项数)
+        query_matrix = np.zeros((len(queries), len(term_index)), dtype=np.float64)
+        for qi, tokens in enumerate(query_tokens):
+            for token in tokens:
+                if token in term_index:
+                    query_matrix[qi, term_index[token]] += 1
+        
+        term_ids = [self.vocab[term] for term in term_index]
+        return query_matrix @ self._term_contributions(term_ids).T
+    
+    def get_prepared_scores(self, query_terms: Tuple[str, ...], query_counts: np.ndarray) -> np.ndarray:
+        """
+        使用预处理过的查询（prepare_query的结果）获取对所有文档的分数，跳过分词和查询词计数
+        结果与get_batch_scores([query])[0]一致
+        
+        Args:
+            query_terms: 查询中的去重词项（按首次出现顺序）
+            query_counts: 每个词项在查询中的出现次数
+            
+        Returns:
+            np.ndarray: 所有文档的分数
         """
-        return [self.score(query, i) for i in range(self.corpus_size)]
+        in_vocab = [i for i, term in enumerate(query_terms) if term in self.vocab]
+        if not in_vocab or self.corpus_size == 0:
+            return np.zeros(self.corpus_size, dtype=np.float64)
+        
+        term_ids = [self.vocab[query_terms[i]] for i in in_vocab]
+        return query_counts[in_vocab] @ self._term_contributions(term_ids).T
+
+# 单文档语料中词项的BM25权重 idf * (k1 + 1)，idf = log((1 - 1 + 0.5) / (1 + 0.5))
+_SINGLE_DOC_WEIGHT = float(np.log(0.5 / 1.5)) * (BM25().k1 + 1)
+
+@lru_cache(maxsize=256)
+def _get_fitted_bm25(chunks: Tuple[str, ...]) -> BM25:
+    """
+    获取已训练的BM25实例（按分块内容缓存，避免对相同语料重复分词和计算IDF）
+    
+    Args:
+        chunks: 分块元组
+        
+    Returns:
+        BM25: 已训练的BM25实例
+    """
+    bm25 = BM25()
+    bm25.fit(list(chunks))
+    return bm25
+
+@lru_cache(maxsize=100_000)
+def _index_chunk(chunk: str) -> Tuple[Dict[str, Tuple[float, float]], float]:
+    """
+    为单个分块建立BM25统计（分块自身作为单文档语料，与is_chunk_relevant的评分方式一致），按分块缓存
+    长度归一化项 B_c = k1 * (1 - b + b * |C| / avgdl) 只依赖分块本身，预计算其倒数后评分时每个词项只需一次除法
+    相关性过滤按去重后的词项计算（词频均记为1），-10的相关性阈值按此标定
+    
+    Args:
+        chunk: 分块内容
+        
+    Returns:
+        Tuple[Dict[str, Tuple[float, float]], float]: (词项 -> (词频, idf * (k1 + 1)), 1 / B_c)
+    """
+    bm25 = BM25()
+    bm25.fit([chunk])
+    term_stats = {
+        term: (1.0, bm25.idf[term] * (bm25.k1 + 1))
+        for term in bm25.doc_freqs[0]
+    }
+    return term_stats, float(bm25.norm_inv[0])
+
+def clear_text_caches():
+    """
+    清空进程级的文本处理缓存（BM25分词、文本预处理、单分块BM25统计、已训练的BM25索引、查询的相关参考分块）
+    缓存以文本内容为键，内容变化不会命中旧结果；需要释放内存时（如切换到另一个大数据集）调用
+    """
+    BM25._tokenize.cache_clear()
+    clear_similarity_cache()
+    _index_chunk.cache_clear()
+    _get_fitted_bm25.cache_clear()
+    relevant_reference_chunks.cache_clear()
+
+def _score_row(row_index: Any, user_input: str, retrieved_contexts: List[str], reference_contexts: List[str],
+               similarity_threshold: float, semantic_containment_threshold: float) -> Dict[str, Any]:
+    """
+    计算单行数据的Precision和Recall（纯函数，可在子进程中执行）
+    
+    Args:
+        row_index: 行索引
+        user_input: 用户问题
+        retrieved_contexts: 检索到的分块列表
+        reference_contexts: 参考分块列表
+        similarity_threshold: 相关性判断阈值
+        semantic_containment_threshold: 语义包含阈值
+        
+    Returns:
+        Dict[str, Any]: 单行评估结果（skipped为True表示缺少上下文数据）
+    """
+    if not retrieved_contexts or not reference_contexts:
+        return {'row_index': row_index, 'skipped': True}
+    
+    # 计算检索分块与参考分块的语义相似度矩阵（每个分块只分词一次，交集通过稀疏矩阵乘法批量计算）
+    similarity_array = calculate_text_similarity_matrix(
+        retrieved_contexts, reference_contexts, semantic_containment_threshold
+    )
+    # 明细中以float32二维数组保存相似度矩阵（JSON序列化时再转换为列表）
+    similarity_matrix = similarity_array.astype(np.float32)
+    
+    # 语义包含判断：基于同一批词集合的包含度矩阵
+    containment_matrix = calculate_semantic_containment_matrix(retrieved_contexts, reference_contexts)
+    is_containment_matrix = containment_matrix >= semantic_containment_threshold
+    
+    # 找出每个检索分块的最佳匹配参考分块
+    relevant_retrieved = []  # 被判定为相关的检索分块
+    irrelevant_chunks = []  # 不相关的检索分块
+    missed_chunks = []  # 未召回的参考分块
+    matched_references = set()  # 已被匹配的参考分块索引
+    total_relevance_score = 0.0  # 总相关性得分
+    
+    # 行/列方向的最大相似度及其位置（argmax取第一个最大值，与list.index一致）
+    row_max = similarity_array.max(axis=1)
+    row_arg = similarity_array.argmax(axis=1)
+    col_max = similarity_array.max(axis=0)
+    col_arg = np.where(col_max > 0, similarity_array.argmax(axis=0), -1)
+    relevant_mask = row_max > similarity_threshold
+    
+    for i, retrieved_chunk in enumerate(retrieved_contexts):
+        max_similarity = float(row_max[i])
+        best_ref_idx = int(row_arg[i])
+        
+        if relevant_mask[i]:
+            relevant_retrieved.append({
+                'retrieved_chunk': retrieved_chunk,
+                'reference_chunk': reference_contexts[best_ref_idx],
+                'relevance_score': max_similarity,
+                'row_index': row_index,
+                'retrieved_idx': i,
+                'reference_idx': best_ref_idx,
+                'user_input': user_input,
+                'is_semantic_containment': bool(is_containment_matrix[i, best_ref_idx]),
+                'semantic_containment_threshold': semantic_containment_threshold
+            })
+            # 累加相关性得分
+            total_relevance_score += max_similarity
+            matched_references.add(best_ref_idx)
+        else:
+            irrelevant_chunks.append({
+                'retrieved_chunk': retrieved_chunk,
+                'max_relevance': max_similarity,
+                'row_index': row_index,
+                'user_input': user_input,
+                'retrieved_idx': i
+            })
+    
+    # 找出未被召回的参考分块
+    # 未召回分块：reference_contexts中存在分块，在retrieved_contexts中的分块没有存在（即找不到相似度大于阈值的）
+    # 与所有检索分块的相似度都为0时，best_retrieved_idx为-1
+    for j in np.nonzero(col_max <= similarity_threshold)[0]:
+        missed_chunks.append({
+            'reference_chunk': reference_contexts[j],
+            'max_relevance': float(col_max[j]),
+            'row_index': row_index,
+            'user_input': user_input,
+            'reference_idx': int(j),
+            'best_retrieved_idx': int(col_arg[j])
+        })
+    
+    # 计算Precision和Recall
+    # Precision = 完整含有相关信息的分块数（语义得分） / retrieved_contexts分块数
+    # Recall = 完整含有相关信息的分块数（语义得分） / reference_contexts分块数
+    precision = total_relevance_score / len(retrieved_contexts)
+    recall = total_relevance_score / len(reference_contexts)
+    
+    return {
+        'row_index': row_index,
+        'skipped': False,
+        'precision': precision,
+        'recall': recall,
+        'relevant_chunks': relevant_retrieved,
+        'irrelevant_chunks': irrelevant_chunks,
+        'missed_chunks': missed_chunks,
+        'detailed_result': {
+            'row_index': row_index,
+            'user_input': user_input,
+            'precision': precision,
+            'recall': recall,
+            'retrieved_count': len(retrieved_contexts),
+            'reference_count': len(reference_contexts),
+            'relevant_count': len(relevant_retrieved),
+            'total_relevance_score': total_relevance_score,
+            'matched_reference_count': len(matched_references),
+            'relevant_chunks': relevant_retrieved,
+            'similarity_matrix': similarity_matrix
+        }
+    }
+
+def _to_jsonable(value: Any) -> Any:
+    """
+    递归地将NumPy数组和标量转换为Python原生类型
+    
+    Args:
+        value: 任意值
+        
+    Returns:
+        Any: 可JSON序列化的值
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        return {key: _to_jsonable(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(item) for item in value]
+    return value
+
+def serialize_detailed_results(detailed_results: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    将详细结果转换为可JSON序列化的形式（相似度矩阵、SoA数组等ndarray转换为列表）
+    
+    Args:
+        detailed_results: 各评估器返回的detailed_results
+        
+    Returns:
+        List[Dict[str, Any]]: 可JSON序列化的详细结果
+    """
+    return _to_jsonable(detailed_results)
+
+class RelevanceScorer:
+    """检索分块 × 参考分块的相关性评分器：分块只预处理一次，之后可多次评分"""
+    
+    def __init__(self, retrieved_chunks: List[str], reference_chunks: List[str],
+                 semantic_containment_threshold: Optional[float] = None):
+        """
+        初始化评分器并预处理所有分块
+        
+        Args:
+            retrieved_chunks: 检索分块列表
+            reference_chunks: 参考分块列表
+            semantic_containment_threshold: 语义包含阈值
+        """
+        self.retrieved_chunks = list(retrieved_chunks)
+        self.reference_chunks = list(reference_chunks)
+        self.semantic_containment_threshold = semantic_containment_threshold
+        self._retrieved_prepared = [prepare_text(chunk) for chunk in self.retrieved_chunks]
+        self._reference_prepared = [prepare_text(chunk) for chunk in self.reference_chunks]
+        self._matrix = None
+    
+    def score(self, retrieved_idx: int, reference_idx: int) -> float:
+        """
+        计算单个检索分块与单个参考分块的相关性分数
+        
+        Args:
+            retrieved_idx: 检索分块下标
+            reference_idx: 参考分块下标
+            
+        Returns:
+            float: 相关性分数 (0-1)
+        """
+        if self._matrix is not None:
+            return float(self._matrix[retrieved_idx, reference_idx])
+        return calculate_text_similarity_from_prepared(
+            self._retrieved_prepared[retrieved_idx], self._reference_prepared[reference_idx],
+            self.semantic_containment_threshold
+        )
+    
+    def matrix(self) -> np.ndarray:
+        """
+        获取完整的相关性分数矩阵（首次调用时计算并缓存）
+        
+        Returns:
+            np.ndarray: 形状为(检索分块数, 参考分块数)的相关性分数矩阵
+        """
+        if self._matrix is None:
+            self._matrix = calculate_text_similarity_matrix(
+                self.retrieved_chunks, self.reference_chunks, self.semantic_containment_threshold
+            )
+        return self._matrix
+    
+    def row_maxima(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        获取每个检索分块的最大相关性及最相关参考分块的下标（已有完整矩阵时直接取最大值，否则使用MaxScore剪枝计算）
+        
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (每个检索分块的最大相关性, 最相关参考分块的下标)；任一列表为空时均为空数组
+        """
+        if self._matrix is not None and self._matrix.size > 0:
+            return self._matrix.max(axis=1), self._matrix.argmax(axis=1)
+        return calculate_text_similarity_row_maxima(
+            [(self.retrieved_chunks, self.reference_chunks)], self.semantic_containment_threshold
+        )[0]
 
 class BM25Evaluator:
     """基于BM25的RAG评估器"""
@@ -165,6 +556,9 @@ class BM25Evaluator:
         self.text_processor = TextProcessor(config)
         self.bm25 = BM25()
         
+        # 阈值在构造时读取一次，避免在评估循环中反复读取环境变量
+        self._sim_thresh = float(os.getenv("SIMILARITY_THRESHOLD", "0.5"))
+        self._sc_thresh = float(os.getenv("SEMANTIC_CONTAINMENT_THRESHOLD", "0.9"))
         # 相关性阈值
         self.relevance_thresholds = {
             0.0000: "完全不相关",
@@ -201,10 +595,38 @@ class BM25Evaluator:
         info_print(f"✅ 成功加载 {len(df)} 行数据")
         return df
     
+    def _get_tokens(self, text: str) -> Tuple[str, frozenset, frozenset]:
+        """
+        获取文本的预处理结果（清理后文本、词集合、字符集合）
+        使用text_similarity.prepare_text的进程级LRU缓存，所有评估器（BM25/MAP/MRR/NDCG）共享，
+        不再为每个评估器实例单独保存一份无上限的缓存
+        
+        Args:
+            text: 输入文本
+            
+        Returns:
+            Tuple[str, frozenset, frozenset]: 预处理结果
+        """
+        return prepare_text(text)
+    
+    def calculate_relevance_score_from_tokens(self, rtoks: Tuple[str, frozenset, frozenset],
+                                              ctoks: Tuple[str, frozenset, frozenset]) -> float:
+        """
+        基于预处理结果计算检索分块与参考分块的相关性分数
+        
+        Args:
+            rtoks: 检索分块的预处理结果（见_get_tokens）
+            ctoks: 参考分块的预处理结果
+            
+        Returns:
+            float: 相关性分数 (0-1)
+        """
+        return calculate_text_similarity_from_prepared(rtoks, ctoks, self._sc_thresh)
+    
     def calculate_relevance_score(self, retrieved_chunk: str, reference_chunk: str) -> float:
         """
         计算检索分块与参考分块的相关性分数
-        使用智能相似度算法替代BM25，确保准确性
+        使用智能相似度算法替代BM25，确保准确性（与app.py中的calculate_text_similarity结果一致）
         
         Args:
             retrieved_chunk: 检索到的分块
@@ -216,58 +638,106 @@ class BM25Evaluator:
         if not retrieved_chunk or not reference_chunk:
             return 0.0
         
-        # 使用智能相似度算法（与Ragas评估明细保持一致）
-        from app import calculate_text_similarity
-        similarity = calculate_text_similarity(retrieved_chunk, reference_chunk)
-        
-        return similarity
+        return self.calculate_relevance_score_from_tokens(
+            self._get_tokens(retrieved_chunk), self._get_tokens(reference_chunk)
+        )
     
-    def _check_semantic_containment(self, retrieved_chunk: str, reference_chunk: str, threshold: float) -> bool:
+    def make_scorer(self, retrieved_chunks: List[str], reference_chunks: List[str]) -> RelevanceScorer:
         """
-        检查是否是语义包含情况
+        创建"预处理一次、多次评分"的相关性评分器（与calculate_relevance_score使用相同的语义包含阈值）
         
         Args:
-            retrieved_chunk: 检索到的分块
-            reference_chunk: 参考分块
-            threshold: 语义包含阈值
+            retrieved_chunks: 检索分块列表
+            reference_chunks: 参考分块列表
             
         Returns:
-            bool: 是否是语义包含
+            RelevanceScorer: 相关性评分器
         """
-        if not retrieved_chunk or not reference_chunk:
-            return False
-        
-        # 文本预处理
-        import re
+        return RelevanceScorer(retrieved_chunks, reference_chunks, self._sc_thresh)
+    
+    def calculate_relevance_matrix(self, retrieved_chunks: List[str], reference_chunks: List[str]) -> np.ndarray:
+        """
+        批量计算检索分块与参考分块的相关性分数矩阵
+        所有分块只预处理一次，词/字符重叠通过稀疏指示矩阵乘法一次性计算，结果与逐对调用calculate_relevance_score一致
         
-        def clean_text(text):
-            # 移除标点符号和特殊字符，保留中文、英文、数字
-            cleaned = re.sub(r'[^\w\s\u4e00-\u9fff]', ' ', text)
-            # 移除多余空格
-            cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-            return cleaned.lower()
+        Args:
+            retrieved_chunks: 检索分块列表（矩阵的行）
+            reference_chunks: 参考分块列表（矩阵的列）
+            
+        Returns:
+            np.ndarray: 形状为(len(retrieved_chunks), len(reference_chunks))的相关性分数矩阵
+        """
+        return calculate_text_similarity_matrix(retrieved_chunks, reference_chunks, self._sc_thresh)
+    
+    def batch_relevance(self, chunk_pairs: List[Tuple[List[str], List[str]]]) -> List[np.ndarray]:
+        """
+        批量计算多个样本的相关性分数矩阵（检索分块 × 参考分块）
+        所有样本在一次分组稀疏矩阵乘法中完成，结果与对每个样本分别调用calculate_relevance_matrix一致
         
-        clean_retrieved = clean_text(retrieved_chunk)
-        clean_reference = clean_text(reference_chunk)
+        Args:
+            chunk_pairs: (检索分块列表, 参考分块列表) 列表，每个元素对应一个样本
+            
+        Returns:
+            List[np.ndarray]: 每个样本的相关性分数矩阵
+        """
+        return calculate_text_similarity_matrices(chunk_pairs, self._sc_thresh)
+    
+    def score_maxscore(self, retrieved_chunks: List[str], reference_chunks: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        计算每个检索分块与参考分块的最大相关性及最相关参考分块的下标
+        子串搜索按分数上界从高到低进行，剩余参考分块的上界低于当前最大值时提前结束（MaxScore剪枝），
+        结果与calculate_relevance_matrix(...).max(axis=1)/argmax(axis=1)一致
         
-        # 分词
-        words_retrieved = set(clean_retrieved.split())
-        words_reference = set(clean_reference.split())
+        Args:
+            retrieved_chunks: 检索分块列表
+            reference_chunks: 参考分块列表
+            
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: (每个检索分块的最大相关性, 最相关参考分块的下标)；任一列表为空时均为空数组
+        """
+        return calculate_text_similarity_row_maxima([(retrieved_chunks, reference_chunks)], self._sc_thresh)[0]
+    
+    def _check_semantic_containment(self, rtoks: frozenset, ctoks: frozenset, threshold: float) -> bool:
+        """
+        检查是否是语义包含情况（较短词集合在较长词集合中的包含比例是否达到阈值）
         
-        if len(words_retrieved) == 0 or len(words_reference) == 0:
+        Args:
+            rtoks: 检索分块的词集合（text_similarity.get_word_set的结果，或_get_tokens结果中的词集合）
+            ctoks: 参考分块的词集合
+            threshold: 语义包含阈值
+            
+        Returns:
+            bool: 是否是语义包含
+        """
+        if not rtoks or not ctoks:
             return False
         
-        # 计算语义包含度
-        if len(words_retrieved) <= len(words_reference):
-            # retrieved_chunk是较短的，计算在reference_chunk中的包含度
-            contained_words = words_retrieved.intersection(words_reference)
-            semantic_containment = len(contained_words) / len(words_retrieved)
-        else:
-            # reference_chunk是较短的，计算在retrieved_chunk中的包含度
-            contained_words = words_reference.intersection(words_retrieved)
-            semantic_containment = len(contained_words) / len(words_reference)
+        return len(rtoks & ctoks) / min(len(rtoks), len(ctoks)) >= threshold
+    
+    def _score_rows(self, row_args: List[Tuple]) -> List[Dict[str, Any]]:
+        """
+        逐行计算评估结果，行数较多时分发到进程池并行计算
         
-        return semantic_containment >= threshold
+        Args:
+            row_args: _score_row的参数列表
+            
+        Returns:
+            List[Dict[str, Any]]: 与输入顺序一致的单行评估结果
+        """
+        max_workers = min(self.config.max_workers, os.cpu_count() or 1, len(row_args))
+        if self.config.parallel and max_workers > 1 and len(row_args) >= PARALLEL_MIN_ROWS:
+            try:
+                with ProcessPoolExecutor(max_workers=max_workers, mp_context=get_process_context()) as executor:
+                    futures = [executor.submit(_score_row, *args) for args in row_args]
+                    positions = {future: position for position, future in enumerate(futures)}
+                    row_results = [None] * len(futures)
+                    for future in as_completed(futures):
+                        row_results[positions[future]] = future.result()
+                return row_results
+            except (OSError, BrokenProcessPool) as e:
+                info_print(f"⚠️  进程池不可用，改为串行计算: {e}")
+        
+        return [_score_row(*args) for args in row_args]
     
     def evaluate_precision_recall(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
@@ -285,7 +755,7 @@ class BM25Evaluator:
         info_print("  • Precision = 完整含有相关信息的分块数（语义得分） / retrieved_contexts分块数")
         info_print("  • Recall = 完整含有相关信息的分块数（语义得分） / reference_contexts分块数")
         info_print("  • 完整含有相关信息的分块数 = 所有相关分块的语义相似度得分之和")
-        similarity_threshold = float(os.getenv("SIMILARITY_THRESHOLD", "0.5"))
+        similarity_threshold = self._sim_thresh
         info_print(f"  • 相关性判断: 检索分块与参考分块的语义相似度 > {similarity_threshold}")
         info_print()
         
@@ -298,118 +768,48 @@ class BM25Evaluator:
             'detailed_results': []
         }
         
-        for idx, row in df.iterrows():
-            info_print(f"处理第 {idx + 1}/{len(df)} 行...")
+        # 一次性取出所需列，避免iterrows逐行构造Series
+        row_indices = df.index.tolist()
+        user_input_values = df['user_input'].to_numpy(dtype=object)
+        user_input_notna = df['user_input'].notna().to_numpy()
+        retrieved_values = df['retrieved_contexts'].to_numpy(dtype=object)
+        reference_values = df['reference_contexts'].to_numpy(dtype=object)
+        row_args = [
+            (
+                row_indices[pos],
+                str(user_input_values[pos]) if user_input_notna[pos] else "",
+                retrieved_values[pos],
+                reference_values[pos],
+                similarity_threshold,
+                self._sc_thresh
+            )
+            for pos in range(len(df))
+        ]
+        
+        for row_result in self._score_rows(row_args):
+            idx = row_result['row_index']
+            # 静默模式下在调用处直接跳过逐行日志，避免格式化字符串的开销
+            if not QUIET_MODE:
+                info_print(f"处理第 {idx + 1}/{len(df)} 行...")
             
-            user_input = str(row['user_input']) if pd.notna(row['user_input']) else ""
-            retrieved_contexts = row['retrieved_contexts']
-            reference_contexts = row['reference_contexts']
-            
-            if not retrieved_contexts or not reference_contexts:
-                info_print(f"  跳过行 {idx + 1}: 缺少上下文数据")
+            if row_result['skipped']:
+                if not QUIET_MODE:
+                    info_print(f"  跳过行 {idx + 1}: 缺少上下文数据")
                 continue
             
-            # 计算检索分块与参考分块的语义相似度矩阵
-            similarity_matrix = []
-            for retrieved_chunk in retrieved_contexts:
-                chunk_similarities = []
-                for reference_chunk in reference_contexts:
-                    similarity = self.calculate_relevance_score(retrieved_chunk, reference_chunk)
-                    chunk_similarities.append(similarity)
-                similarity_matrix.append(chunk_similarities)
-            
-            # 找出每个检索分块的最佳匹配参考分块
-            relevant_retrieved = []  # 被判定为相关的检索分块
-            matched_references = set()  # 已被匹配的参考分块索引
-            total_relevance_score = 0.0  # 总相关性得分
-            
-            for i, retrieved_chunk in enumerate(retrieved_contexts):
-                max_similarity = max(similarity_matrix[i]) if similarity_matrix[i] else 0
-                best_ref_idx = similarity_matrix[i].index(max_similarity) if similarity_matrix[i] else -1
-                
-                # 判断是否相关（从环境变量读取阈值）
-                similarity_threshold = float(os.getenv("SIMILARITY_THRESHOLD", "0.5"))
-                if max_similarity > similarity_threshold:
-                    # 检查是否是语义包含情况
-                    semantic_containment_threshold = float(os.getenv("SEMANTIC_CONTAINMENT_THRESHOLD", "0.9"))
-                    is_semantic_containment = self._check_semantic_containment(retrieved_chunk, reference_contexts[best_ref_idx], semantic_containment_threshold)
-                    
-                    relevant_chunk_info = {
-                        'retrieved_chunk': retrieved_chunk,
-                        'reference_chunk': reference_contexts[best_ref_idx],
-                        'relevance_score': max_similarity,
-                        'row_index': idx,
-                        'retrieved_idx': i,
-                        'reference_idx': best_ref_idx,
-                        'user_input': user_input,
-                        'is_semantic_containment': is_semantic_containment,
-                        'semantic_containment_threshold': semantic_containment_threshold
-                    }
-                    relevant_retrieved.append(relevant_chunk_info)
-                    # 累加相关性得分
-                    total_relevance_score += max_similarity
-                    # 添加到results['relevant_chunks']中，与irrelevant_chunks保持一致
-                    results['relevant_chunks'].append(relevant_chunk_info)
-                    matched_references.add(best_ref_idx)
-                else:
-                    # 不相关的检索分块
-                    results['irrelevant_chunks'].append({
-                        'retrieved_chunk': retrieved_chunk,
-                        'max_relevance': max_similarity,
-                        'row_index': idx,
-                        'user_input': user_input,
-                        'retrieved_idx': i
-                    })
-            
-            # 找出未被召回的参考分块
-            # 未召回分块：reference_contexts中存在分块，在retrieved_contexts中的分块没有存在（即找不到相似度大于阈值的）
-            for j, reference_chunk in enumerate(reference_contexts):
-                # 找到该参考分块与所有检索分块的最大相似度
-                max_similarity = 0
-                best_retrieved_idx = -1
-                for i in range(len(retrieved_contexts)):
-                    if similarity_matrix[i][j] > max_similarity:
-                        max_similarity = similarity_matrix[i][j]
-                        best_retrieved_idx = i
-                
-                # 如果最大相似度小于等于阈值，认为是未召回分块
-                if max_similarity <= similarity_threshold:
-                    results['missed_chunks'].append({
-                        'reference_chunk': reference_chunk,
-                        'max_relevance': max_similarity,
-                        'row_index': idx,
-                        'user_input': user_input,
-                        'reference_idx': j,
-                        'best_retrieved_idx': best_retrieved_idx
-                    })
-            
-            # 计算Precision和Recall
-            # Precision = 完整含有相关信息的分块数（语义得分） / retrieved_contexts分块数
-            # Recall = 完整含有相关信息的分块数（语义得分） / reference_contexts分块数
-            precision = total_relevance_score / len(retrieved_contexts) if retrieved_contexts else 0
-            recall = total_relevance_score / len(reference_contexts) if reference_contexts else 0
-            
-            results['precision_scores'].append(precision)
-            results['recall_scores'].append(recall)
+            results['relevant_chunks'].extend(row_result['relevant_chunks'])
+            results['irrelevant_chunks'].extend(row_result['irrelevant_chunks'])
+            results['missed_chunks'].extend(row_result['missed_chunks'])
+            results['precision_scores'].append(row_result['precision'])
+            results['recall_scores'].append(row_result['recall'])
             
-            # 详细结果
-            results['detailed_results'].append({
-                'row_index': idx,
-                'user_input': user_input,
-                'precision': precision,
-                'recall': recall,
-                'retrieved_count': len(retrieved_contexts),
-                'reference_count': len(reference_contexts),
-                'relevant_count': len(relevant_retrieved),
-                'total_relevance_score': total_relevance_score,
-                'matched_reference_count': len(matched_references),
-                'relevant_chunks': relevant_retrieved,
-                'similarity_matrix': similarity_matrix
-            })
+            detailed_result = row_result['detailed_result']
+            results['detailed_results'].append(detailed_result)
             
-            info_print(f"  检索分块: {len(retrieved_contexts)}个, 参考分块: {len(reference_contexts)}个")
-            info_print(f"  含有相关信息的分块: {len(relevant_retrieved)}个, 总语义得分: {total_relevance_score:.4f}, 召回分块: {len(matched_references)}个")
-            info_print(f"  Precision: {precision:.4f}, Recall: {recall:.4f}")
+            if not QUIET_MODE:
+                info_print(f"  检索分块: {detailed_result['retrieved_count']}个, 参考分块: {detailed_result['reference_count']}个")
+                info_print(f"  含有相关信息的分块: {detailed_result['relevant_count']}个, 总语义得分: {detailed_result['total_relevance_score']:.4f}, 召回分块: {detailed_result['matched_reference_count']}个")
+                info_print(f"  Precision: {row_result['precision']:.4f}, Recall: {row_result['recall']:.4f}")
         
         # 计算平均指标
         results['avg_precision'] = np.mean(results['precision_scores']) if results['precision_scores'] else 0
@@ -434,30 +834,19 @@ class BM25Evaluator:
         info_print("📊 分块信息详细分析")
         info_print("=" * 80)
         
-        # 按样本组织数据
+        # 按样本组织数据：依次归入不含有相关信息的分块、未召回分块，样本按首次出现的顺序排列
         sample_data = {}
-        
-        # 组织不含有相关信息的分块
-        for chunk_info in results['irrelevant_chunks']:
-            row_idx = chunk_info['row_index']
-            if row_idx not in sample_data:
-                sample_data[row_idx] = {
-                    'user_input': chunk_info['user_input'],
-                    'irrelevant_chunks': [],
-                    'missed_chunks': []
-                }
-            sample_data[row_idx]['irrelevant_chunks'].append(chunk_info)
-        
-        # 组织未召回分块
-        for chunk_info in results['missed_chunks']:
-            row_idx = chunk_info['row_index']
-            if row_idx not in sample_data:
-                sample_data[row_idx] = {
-                    'user_input': chunk_info['user_input'],
-                    'irrelevant_chunks': [],
-                    'missed_chunks': []
-                }
-            sample_data[row_idx]['missed_chunks'].append(chunk_info)
+        for kind in ('irrelevant_chunks', 'missed_chunks'):
+            for chunk_info in results[kind]:
+                row_idx = chunk_info['row_index']
+                sample = sample_data.get(row_idx)
+                if sample is None:
+                    sample = sample_data[row_idx] = {
+                        'user_input': chunk_info['user_input'],
+                        'irrelevant_chunks': [],
+                        'missed_chunks': []
+                    }
+                sample[kind].append(chunk_info)
         
         # 按样本打印
         for sample_idx, (row_idx, data) in enumerate(sample_data.items(), 1):
@@ -503,8 +892,7 @@ class BM25Evaluator:
         info_print("📋 评估指标定义:")
         info_print("  • Precision = 完整含有相关信息的分块数 / retrieved_contexts分块数")
         info_print("  • Recall = 完整含有相关信息的分块数 / reference_contexts分块数")
-        similarity_threshold = float(os.getenv("SIMILARITY_THRESHOLD", "0.5"))
-        info_print(f"  • 相关性判断: 检索分块与参考分块的语义相似度 > {similarity_threshold}")
+        info_print(f"  • 相关性判断: 检索分块与参考分块的语义相似度 > {self._sim_thresh}")
         info_print()
         
         info_print("📊 评估结果:")
@@ -554,11 +942,11 @@ class BM25Evaluator:
         else:
             return self.relevance_thresholds[0.0000]
     
-
-
-
-
-
+    
+    
+    
+    
+    
     
     def print_evaluation_summary(self, results: Dict[str, Any]):
         """
@@ -644,22 +1032,92 @@ def find_relevant_chunks(query: str, chunks: List[str], max_chunks: int = 10, th
     if not chunks or not query:
         return []
     
-    # 创建BM25实例
-    bm25 = BM25()
-    bm25.fit(chunks)
+    # 获取已训练的BM25实例（相同分块列表复用缓存的索引）
+    bm25 = _get_fitted_bm25(tuple(chunks))
     
     # 计算所有分块的BM25分数
-    scores = bm25.get_scores(query)
-    
-    # 创建(分块, 分数)对并排序
-    chunk_scores = [(chunks[i], scores[i]) for i in range(len(chunks))]
-    chunk_scores.sort(key=lambda x: x[1], reverse=True)
+    scores = bm25.get_batch_scores([query])[0]
     
     # 过滤掉低于阈值的分块
-    relevant_chunks = [(chunk, score) for chunk, score in chunk_scores if score > threshold]
+    candidate_idxs = np.nonzero(scores > threshold)[0]
+    candidate_scores = scores[candidate_idxs]
+    
+    # 候选较多时先用partition在O(N)内找到第max_chunks大的分数，只保留不低于它的分块（含并列）
+    if 0 < max_chunks < len(candidate_idxs):
+        kth = len(candidate_idxs) - max_chunks
+        kth_score = np.partition(candidate_scores, kth)[kth]
+        keep = candidate_scores >= kth_score
+        candidate_idxs = candidate_idxs[keep]
+        candidate_scores = candidate_scores[keep]
+    
+    # 按分数降序排序（稳定排序，分数相同时保持原顺序），返回前max_chunks个最相关的分块
+    top_idxs = candidate_idxs[np.argsort(-candidate_scores, kind='stable')][:max_chunks]
+    return [(chunks[i], float(scores[i])) for i in top_idxs]
+
+def prepare_query(query: str) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    预处理查询：分词并统计每个词项的出现次数
+    同一查询与多个分块逐一比较时只需预处理一次（IDF取决于分块语料，在评分时按分块查找）
     
-    # 返回前max_chunks个最相关的分块
-    return relevant_chunks[:max_chunks]
+    Args:
+        query: 查询文本
+        
+    Returns:
+        Tuple[Tuple[str, ...], np.ndarray]: (去重词项（按首次出现顺序）, 每个词项的出现次数)
+    """
+    term_counts = Counter(BM25._tokenize(query))
+    return tuple(term_counts.keys()), np.fromiter(term_counts.values(), dtype=np.float64, count=len(term_counts))
+
+def prepare_relevance_query(query: str) -> Tuple[Tuple[str, ...], np.ndarray]:
+    """
+    预处理相关性过滤使用的查询：分词后去重，每个词项只计一次
+    单分块BM25分数为负值，重复词项会使分数成倍降低；-10的相关性阈值按去重后的词项标定
+    
+    Args:
+        query: 查询文本
+        
+    Returns:
+        Tuple[Tuple[str, ...], np.ndarray]: (去重词项（按首次出现顺序）, 每个词项的计数（均为1）)
+    """
+    query_terms = tuple(dict.fromkeys(BM25._tokenize(query)))
+    return query_terms, np.ones(len(query_terms), dtype=np.float64)
+
+def score_with_prepared(query_terms: Tuple[str, ...], query_counts: np.ndarray, chunk: str) -> float:
+    """
+    使用预处理过的查询计算单个分块的BM25分数（结果与is_chunk_relevant返回的分数一致）
+    
+    Args:
+        query_terms: prepare_relevance_query返回的去重词项
+        query_counts: prepare_relevance_query返回的词项计数
+        chunk: 分块内容
+        
+    Returns:
+        float: BM25分数
+    """
+    # 分块的词频、词项权重和长度归一化项按分块缓存，同一分块与多个查询比较时不重复计算
+    term_stats, norm_inv = _index_chunk(chunk)
+    matched = [i for i, term in enumerate(query_terms) if term in term_stats]
+    if not matched:
+        return 0.0
+    
+    stats = np.array([term_stats[query_terms[i]] for i in matched], dtype=np.float64)
+    tf, weight = stats[:, 0], stats[:, 1]
+    return float(query_counts[matched] @ (weight - weight / (1.0 + tf * norm_inv)))
+
+def query_score_bounds(query_counts: np.ndarray) -> Tuple[float, float]:
+    """
+    计算查询对任意单个分块（分块自身作为单文档语料）的BM25分数上下界
+    单文档语料中每个词项的文档频率都为1，idf = log(0.5 / 1.5) 为负常数，记 w = idf * (k1 + 1)；
+    每个命中词项的贡献 count * (w - w / (1 + tf / B_c)) 严格位于 count * w 与 0 之间，未命中的词项贡献为0
+    
+    Args:
+        query_counts: prepare_relevance_query返回的词项计数
+        
+    Returns:
+        Tuple[float, float]: (分数下界, 分数上界)
+    """
+    total = float(query_counts.sum())
+    return total * min(_SINGLE_DOC_WEIGHT, 0.0), total * max(_SINGLE_DOC_WEIGHT, 0.0)
 
 def is_chunk_relevant(query: str, chunk: str, threshold: float = -10.0) -> Tuple[bool, float]:
     """
@@ -676,14 +1134,40 @@ def is_chunk_relevant(query: str, chunk: str, threshold: float = -10.0) -> Tuple
     if not chunk or not query:
         return False, 0.0
     
-    # 创建BM25实例
-    bm25 = BM25()
-    bm25.fit([chunk])
-    
     # 计算BM25分数
-    score = bm25.score(query, 0)
+    score = score_with_prepared(*prepare_relevance_query(query), chunk)
     
     return score > threshold, score
 
+@lru_cache(maxsize=4096)
+def relevant_reference_chunks(query: str, reference_contexts: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    获取与查询相关的参考分块（与逐个调用is_chunk_relevant(query, chunk, threshold=-10.0)的结果一致）
+    按查询和参考分块缓存，数据集中重复的查询只计算一次；各分块的BM25统计由_index_chunk按分块内容缓存，
+    不同样本共享的分块只建立一次索引
+    
+    Args:
+        query: 用户查询
+        reference_contexts: 参考分块元组
+        
+    Returns:
+        Tuple[str, ...]: 相关分块元组
+    """
+    if not query:
+        return ()
+    
+    # 查询只分词一次，逐个参考分块评分时复用
+    query_terms, query_counts = prepare_relevance_query(query)
+    
+    # 分数上下界判断：上界不超过阈值时没有分块相关；下界（留出浮点误差余量）超过阈值时所有非空分块都相关，均无需逐个评分
+    lower_bound, upper_bound = query_score_bounds(query_counts)
+    if upper_bound <= -10.0:
+        return ()
+    if lower_bound - 1e-9 > -10.0:
+        return tuple(chunk for chunk in reference_contexts if chunk)
+    
+    return tuple(chunk for chunk in reference_contexts
+                 if chunk and score_with_prepared(query_terms, query_counts, chunk) > -10.0)
+
 if __name__ == "__main__":
     main()
@@ -11,12 +11,144 @@ RAG评估指标MAP (Mean Average Precision) 实现
 """
 
 import os
+import sqlite3
 import pandas as pd
 import numpy as np
 from typing import Dict, List, Optional, Any, Tuple
 from config import debug_print, verbose_print, info_print, error_print, QUIET_MODE
 from read_chuck import EvaluationConfig, DataLoader, TextProcessor
-from BM25_evaluate import BM25Evaluator, BM25, find_relevant_chunks, is_chunk_relevant
+from BM25_evaluate import (
+    BM25Evaluator, BM25, find_relevant_chunks, is_chunk_relevant, relevant_reference_chunks,
+    PARALLEL_MIN_ROWS, get_process_context
+)
+from metrics_numba import average_precision_batch, get_fixed_length_kernel, MAX_UNROLLED_LENGTH
+from text_similarity import calculate_text_similarity_row_maxima
+from score_cache import ScoreCache, pack_arrays, unpack_arrays
+
+# 持久化评分缓存的版本号，相关性计算方式变化时递增，使旧的缓存结果失效
+SCORE_CACHE_VERSION = 2
+
+# 同一检索分块数的查询占比超过该值且查询数不少于FIXED_LENGTH_MIN_ROWS时，这些查询使用循环展开的固定长度AP内核
+FIXED_LENGTH_MIN_SHARE = 0.8
+FIXED_LENGTH_MIN_ROWS = 32
+
+
+def _to_context_list(value: Any) -> List[str]:
+    """
+    将上下文列的单元格统一转换为分块列表（None/NaN视为空列表）
+    
+    Args:
+        value: 上下文列的单元格值
+        
+    Returns:
+        List[str]: 分块列表
+    """
+    if isinstance(value, list):
+        return value
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    return list(value)
+
+
+def _score_map_rows(start: int, rows: List[Tuple[str, List[str], List[str]]],
+                    semantic_containment_threshold: float) -> Tuple[int, List[Tuple[List[str], np.ndarray, np.ndarray]]]:
+    """
+    计算一批样本中每个检索分块与相关参考分块的最大相关性（模块级函数，可在进程池中执行）
+    
+    Args:
+        start: 该批样本在全部样本中的起始位置（用于无序返回后还原顺序）
+        rows: (用户查询, 检索分块列表, 参考分块列表) 列表
+        semantic_containment_threshold: 语义包含阈值
+        
+    Returns:
+        Tuple[int, List[Tuple[List[str], np.ndarray, np.ndarray]]]: (起始位置, 每个样本的(相关分块列表, 每个检索分块的最大相关性, 最相关参考分块的下标))
+    """
+    # 获取相关分块
+    relevant_chunk_lists = [list(relevant_reference_chunks(query, tuple(reference_contexts))) if query and reference_contexts else []
+                            for query, _, reference_contexts in rows]
+    
+    # 只需要每个检索分块的最大相关性，使用MaxScore剪枝的批量计算，不构造完整的相关性矩阵
+    row_maxima = calculate_text_similarity_row_maxima([
+        (retrieved_contexts, relevant_chunks)
+        for (_, retrieved_contexts, _), relevant_chunks in zip(rows, relevant_chunk_lists)
+    ], semantic_containment_threshold)
+    
+    scored = [(relevant_chunks, max_relevances, best_ref_indices)
+              for relevant_chunks, (max_relevances, best_ref_indices) in zip(relevant_chunk_lists, row_maxima)]
+    return start, scored
+
+
+def calculation_steps_from_details(details: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    根据详细结果中的相关位置和精度数组还原AP的逐步计算过程（仅在显示时生成）
+    
+    Args:
+        details: calculate_average_precision返回的详细计算过程
+        
+    Returns:
+        List[Dict[str, Any]]: 每个相关位置的计算步骤
+    """
+    return [
+        {
+            'position': position,
+            'precision': precision,
+            'relevant_count': relevant_count,
+            'total_retrieved': position
+        }
+        for relevant_count, (position, precision) in enumerate(
+            zip(np.asarray(details['relevant_positions']).tolist(), np.asarray(details['precision_at_k']).tolist()), 1)
+    ]
+
+
+def _subsequence_indices(chunks: List[str], reference_contexts: List[str]) -> np.ndarray:
+    """
+    求相关分块在参考分块列表中的下标（相关分块是参考分块按原顺序筛选出的子序列）
+    
+    Args:
+        chunks: 相关分块列表
+        reference_contexts: 参考分块列表
+        
+    Returns:
+        np.ndarray: 每个相关分块在参考分块列表中的下标
+    """
+    indices = []
+    position = 0
+    for chunk in chunks:
+        while reference_contexts[position] != chunk:
+            position += 1
+        indices.append(position)
+        position += 1
+    return np.array(indices, dtype=np.int64)
+
+
+def _unpack_cached_scores(data: bytes, retrieved_count: int,
+                          reference_contexts: List[str]) -> Optional[Tuple[List[str], np.ndarray, np.ndarray]]:
+    """
+    解码持久化缓存中的样本评分结果，数组长度或下标与样本不一致时视为无效
+    
+    Args:
+        data: pack_arrays生成的缓存值
+        retrieved_count: 样本的检索分块数
+        reference_contexts: 样本的参考分块列表
+        
+    Returns:
+        Optional[Tuple[List[str], np.ndarray, np.ndarray]]: (相关分块列表, 每个检索分块的最大相关性, 最相关参考分块的下标)，
+        缓存值无效时返回None
+    """
+    try:
+        relevant_indices, max_relevances, best_ref_indices = unpack_arrays(data, [np.int64, np.float64, np.int64])
+    except ValueError:
+        return None
+    if len(max_relevances) != retrieved_count or len(best_ref_indices) != retrieved_count:
+        return None
+    if len(relevant_indices) and (relevant_indices.min() < 0 or relevant_indices.max() >= len(reference_contexts)):
+        return None
+    return [reference_contexts[j] for j in relevant_indices.tolist()], max_relevances, best_ref_indices
+
+
+def _score_map_rows_star(args: Tuple) -> Tuple[int, List[Tuple[List[str], np.ndarray, np.ndarray]]]:
+    """_score_map_rows的单参数版本，供Pool.imap_unordered使用"""
+    return _score_map_rows(*args)
 
 
 class MAPEvaluator:
@@ -34,6 +166,13 @@ class MAPEvaluator:
         self.text_processor = TextProcessor(config)
         self.bm25_evaluator = BM25Evaluator(config)
         
+        # 分块驻留池：相同内容的分块只保存一份，详细结果中以整数ID引用
+        self._chunk_pool: Dict[str, int] = {}
+        self._chunk_texts: List[str] = []
+        
+        # 持久化评分缓存（按需打开）
+        self._score_cache: Optional[ScoreCache] = None
+        
         # 相关性阈值
         self.relevance_threshold = float(os.getenv("SIMILARITY_THRESHOLD", "0.5"))
         
@@ -55,6 +194,10 @@ class MAPEvaluator:
             error_print("❌ 数据加载失败")
             return None
         
+        # 上下文列在加载时统一转换为列表，评估循环中不再逐行做类型判断
+        for column in ('retrieved_contexts', 'reference_contexts'):
+            df[column] = df[column].map(_to_context_list)
+        
         info_print(f"✅ 成功加载 {len(df)} 个RAG样本")
         return df
     
@@ -72,14 +215,7 @@ class MAPEvaluator:
         if not query or not reference_contexts:
             return []
         
-        relevant_chunks = []
-        for chunk in reference_contexts:
-            # 使用BM25算法判断相关性
-            is_relevant, score = is_chunk_relevant(query, chunk, threshold=-10.0)  # 使用较低的BM25阈值
-            if is_relevant:
-                relevant_chunks.append(chunk)
-        
-        return relevant_chunks
+        return list(relevant_reference_chunks(query, tuple(reference_contexts)))
     
     def get_ranked_chunks_for_query(self, query: str, retrieved_contexts: List[str]) -> List[Tuple[str, float]]:
         """
@@ -105,10 +241,105 @@ class MAPEvaluator:
         
         return ranked_chunks
     
-    def calculate_average_precision(self, query: str, retrieved_contexts: List[str], 
-                                  reference_contexts: List[str]) -> Tuple[float, Dict[str, Any]]:
+    def _get_score_cache(self) -> Optional[ScoreCache]:
         """
-        计算单个查询的平均精度(AP)
+        获取持久化评分缓存（未配置score_cache_path时返回None）
+        命名空间包含缓存版本、BM25参数和语义包含阈值，这些参数变化时自动使用新的缓存
+        
+        Returns:
+            Optional[ScoreCache]: 评分缓存
+        """
+        if self._score_cache is None and self.config.score_cache_path:
+            bm25 = BM25()
+            namespace = (f"map_rows:v{SCORE_CACHE_VERSION}:k1={bm25.k1}:b={bm25.b}:"
+                         f"sc={self.bm25_evaluator._sc_thresh}")
+            try:
+                self._score_cache = ScoreCache(self.config.score_cache_path, namespace)
+            except sqlite3.Error as e:
+                error_print(f"❌ 评分缓存打开失败，不使用缓存: {e}")
+                self.config.score_cache_path = ""
+        return self._score_cache
+    
+    def _score_retrieved_chunks_batch(self, rows: List[Tuple[str, List[str], List[str]]]) -> List[Tuple[List[str], np.ndarray, np.ndarray]]:
+        """
+        批量计算多个样本中每个检索分块与相关参考分块的最大相关性
+        配置了score_cache_path时先从持久化缓存读取，只计算未命中的样本并写回缓存
+        
+        Args:
+            rows: (用户查询, 检索分块列表, 参考分块列表) 列表
+            
+        Returns:
+            List[Tuple[List[str], np.ndarray, np.ndarray]]: 每个样本的(相关分块列表, 每个检索分块的最大相关性, 最相关参考分块的下标)
+        """
+        cache = self._get_score_cache()
+        if cache is None:
+            return self._compute_retrieved_chunks_batch(rows)
+        
+        # 每个分块单独作为键的一部分（make_key对每部分加长度前缀），并加入分块数，不同的分块切分不会得到相同的键
+        keys = [ScoreCache.make_key(query, str(len(retrieved_contexts)), *retrieved_contexts,
+                                    str(len(reference_contexts)), *reference_contexts)
+                for query, retrieved_contexts, reference_contexts in rows]
+        try:
+            cached = cache.get_many(keys)
+        except sqlite3.Error as e:
+            error_print(f"❌ 评分缓存读取失败: {e}")
+            cached = {}
+        
+        # 读取命中的缓存结果，与样本不一致的缓存值按未命中处理（重新计算并覆盖）
+        scored = [None] * len(rows)
+        for i, key in enumerate(keys):
+            if key in cached:
+                scored[i] = _unpack_cached_scores(cached[key], len(rows[i][1]), rows[i][2])
+        
+        miss_positions = [i for i in range(len(rows)) if scored[i] is None]
+        computed = self._compute_retrieved_chunks_batch([rows[i] for i in miss_positions]) if miss_positions else []
+        
+        new_items = []
+        for i, (relevant_chunks, max_relevances, best_ref_indices) in zip(miss_positions, computed):
+            scored[i] = (relevant_chunks, max_relevances, best_ref_indices)
+            relevant_indices = _subsequence_indices(relevant_chunks, rows[i][2])
+            new_items.append((keys[i], pack_arrays(relevant_indices, max_relevances, best_ref_indices)))
+        try:
+            cache.put_many(new_items)
+        except sqlite3.Error as e:
+            error_print(f"❌ 评分缓存写入失败: {e}")
+        
+        info_print(f"💾 评分缓存: 命中 {len(rows) - len(miss_positions)} / {len(rows)} 个样本")
+        return scored
+    
+    def _compute_retrieved_chunks_batch(self, rows: List[Tuple[str, List[str], List[str]]]) -> List[Tuple[List[str], np.ndarray, np.ndarray]]:
+        """
+        批量计算多个样本中每个检索分块与相关参考分块的最大相关性（不使用缓存）
+        样本较多且config.parallel开启时，按 chunksize = max(1, N // (进程数 + 2)) 分批提交到进程池，
+        每批内的相关性矩阵通过一次分组稀疏矩阵乘法计算；否则在当前进程中一次性批量计算
+        
+        Args:
+            rows: (用户查询, 检索分块列表, 参考分块列表) 列表
+            
+        Returns:
+            List[Tuple[List[str], np.ndarray, np.ndarray]]: 每个样本的(相关分块列表, 每个检索分块的最大相关性, 最相关参考分块的下标)
+        """
+        sc_thresh = self.bm25_evaluator._sc_thresh
+        processes = min(self.config.max_workers, os.cpu_count() or 1, len(rows))
+        if self.config.parallel and processes > 1 and len(rows) >= PARALLEL_MIN_ROWS:
+            chunksize = max(1, len(rows) // (processes + 2))
+            tasks = [(start, rows[start:start + chunksize], sc_thresh) for start in range(0, len(rows), chunksize)]
+            try:
+                scored = [None] * len(rows)
+                with get_process_context().Pool(processes) as pool:
+                    # 无序迭代：先完成的批次先写回，进程池同时预取计算后续批次
+                    for start, batch_scored in pool.imap_unordered(_score_map_rows_star, tasks):
+                        scored[start:start + len(batch_scored)] = batch_scored
+                return scored
+            except OSError as e:
+                info_print(f"⚠️  进程池不可用，改为串行计算: {e}")
+        
+        return _score_map_rows(0, rows, sc_thresh)[1]
+    
+    def _score_retrieved_chunks(self, query: str, retrieved_contexts: List[str],
+                                reference_contexts: List[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        计算每个检索分块与相关参考分块的最大相关性
         
         Args:
             query: 用户查询
@@ -116,98 +347,232 @@ class MAPEvaluator:
             reference_contexts: 参考分块列表
             
         Returns:
-            Tuple[float, Dict[str, Any]]: (平均精度, 详细计算过程)
+            Tuple[List[str], np.ndarray, np.ndarray]: (相关分块列表, 每个检索分块的最大相关性, 最相关参考分块的下标)
         """
         # 获取相关分块
         relevant_chunks = self.get_relevant_chunks_for_query(query, reference_contexts)
         
+        if not relevant_chunks or not retrieved_contexts:
+            return relevant_chunks, np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64)
+        
+        # 检索分块和相关分块只预处理一次，再计算每个检索分块的最大相关性
+        scorer = self.bm25_evaluator.make_scorer(retrieved_contexts, relevant_chunks)
+        max_relevances, best_ref_indices = scorer.row_maxima()
+        return relevant_chunks, max_relevances, best_ref_indices
+    
+    def _intern(self, chunk: str) -> int:
+        """
+        获取分块在驻留池中的整数ID（首次出现时加入驻留池）
+        
+        Args:
+            chunk: 分块内容
+            
+        Returns:
+            int: 分块ID
+        """
+        chunk_id = self._chunk_pool.get(chunk)
+        if chunk_id is None:
+            chunk_id = len(self._chunk_texts)
+            self._chunk_pool[chunk] = chunk_id
+            self._chunk_texts.append(chunk)
+        return chunk_id
+    
+    def _intern_all(self, chunks: List[str]) -> np.ndarray:
+        """
+        批量获取分块ID
+        
+        Args:
+            chunks: 分块列表
+            
+        Returns:
+            np.ndarray: 分块ID数组（int32）
+        """
+        return np.fromiter((self._intern(chunk) for chunk in chunks), dtype=np.int32, count=len(chunks))
+    
+    def get_chunk(self, chunk_id: int) -> str:
+        """
+        根据分块ID取回分块内容
+        
+        Args:
+            chunk_id: 分块ID（-1表示没有对应分块）
+            
+        Returns:
+            str: 分块内容，ID为-1时返回空字符串
+        """
+        return self._chunk_texts[chunk_id] if chunk_id >= 0 else ""
+    
+    @staticmethod
+    def _empty_chunk_relevance_scores() -> Dict[str, np.ndarray]:
+        """
+        空的分块相关性数组（SoA）
+        
+        Returns:
+            Dict[str, np.ndarray]: positions/relevance/is_relevant/best_ref_idx/retrieved_id/best_ref_id 六个空数组
+        """
+        return {
+            'positions': np.zeros(0, dtype=np.int32),
+            'relevance': np.zeros(0, dtype=np.float32),
+            'is_relevant': np.zeros(0, dtype=np.bool_),
+            'best_ref_idx': np.zeros(0, dtype=np.int32),
+            'retrieved_id': np.zeros(0, dtype=np.int32),
+            'best_ref_id': np.zeros(0, dtype=np.int32)
+        }
+    
+    def _empty_details(self, relevant_chunks: List[str], total_retrieved: int,
+                       collect_details: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        AP为0且没有相关检索分块时的详细计算过程
+        
+        Args:
+            relevant_chunks: 相关分块列表
+            total_retrieved: 检索分块数
+            collect_details: 是否保存分块相关性数组，None表示使用config.collect_details
+            
+        Returns:
+            Dict[str, Any]: 详细计算过程
+        """
+        details = {
+            'relevant_chunks': relevant_chunks,
+            'precision_at_k': np.zeros(0, dtype=np.float64),
+            'relevant_positions': np.zeros(0, dtype=np.int32),
+            'total_relevant': 0,
+            'num_relevant_refs': len(relevant_chunks),
+            'num_relevant_retrieved': 0,
+            'total_retrieved': total_retrieved
+        }
+        if self.config.collect_details if collect_details is None else collect_details:
+            details['chunk_relevance_scores'] = self._empty_chunk_relevance_scores()
+        return details
+    
+    def _compute_average_precisions(self, max_relevances: List[np.ndarray]) -> np.ndarray:
+        """
+        批量计算多个查询的平均精度（安装numba时按查询并行执行JIT内核）
+        数据集检索分块数基本固定（如top-k检索）时，该长度的查询使用循环展开的固定长度内核，其余查询使用通用内核
+        
+        Args:
+            max_relevances: 每个查询的检索分块最大相关性数组
+            
+        Returns:
+            np.ndarray: 每个查询的AP
+        """
+        threshold = float(self.relevance_threshold)
+        lengths = np.array([len(values) for values in max_relevances], dtype=np.int64)
+        ap_out = np.zeros(len(max_relevances), dtype=np.float64)
+        
+        generic_rows = range(len(max_relevances))
+        if len(lengths) >= FIXED_LENGTH_MIN_ROWS:
+            counts = np.bincount(lengths)
+            fixed_length = int(np.argmax(counts))
+            if 0 < fixed_length <= MAX_UNROLLED_LENGTH and counts[fixed_length] > FIXED_LENGTH_MIN_SHARE * len(lengths):
+                fixed_rows = np.flatnonzero(lengths == fixed_length)
+                fixed_relevance = np.concatenate([max_relevances[i] for i in fixed_rows.tolist()]).astype(np.float64)
+                fixed_out = np.zeros(len(fixed_rows), dtype=np.float64)
+                get_fixed_length_kernel(fixed_length)(fixed_relevance, threshold, fixed_out)
+                ap_out[fixed_rows] = fixed_out
+                generic_rows = np.flatnonzero(lengths != fixed_length).tolist()
+        
+        if len(generic_rows):
+            generic_relevances = [max_relevances[i] for i in generic_rows]
+            offsets = np.zeros(len(generic_relevances) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum(lengths[generic_rows])
+            flat_relevance = np.concatenate(generic_relevances).astype(np.float64)
+            generic_out = np.zeros(len(generic_relevances), dtype=np.float64)
+            average_precision_batch(flat_relevance, offsets, threshold, generic_out)
+            ap_out[generic_rows] = generic_out
+        return ap_out
+    
+    def _build_ap_details(self, query: str, retrieved_contexts: List[str], relevant_chunks: List[str],
+                          max_relevances: np.ndarray, best_ref_indices: np.ndarray, average_precision: float,
+                          collect_details: Optional[bool] = None) -> Tuple[float, Dict[str, Any]]:
+        """
+        根据相关性与AP内核的输出整理平均精度的详细计算过程
+        
+        Args:
+            query: 用户查询
+            retrieved_contexts: 检索分块列表
+            relevant_chunks: 相关分块列表
+            max_relevances: 每个检索分块的最大相关性
+            best_ref_indices: 每个检索分块最相关参考分块的下标
+            average_precision: 平均精度
+            collect_details: 是否保存分块相关性数组，None表示使用config.collect_details
+            
+        Returns:
+            Tuple[float, Dict[str, Any]]: (平均精度, 详细计算过程)
+        """
+        # 相关分块替换为驻留池中的同一对象，重复出现的参考分块不再各自占用内存
+        relevant_ids = self._intern_all(relevant_chunks)
+        relevant_chunks = [self._chunk_texts[chunk_id] for chunk_id in relevant_ids.tolist()]
+        
+        if collect_details is None:
+            collect_details = self.config.collect_details
+        
         if not relevant_chunks:
             # 如果没有相关分块，返回0
             debug_print(f"  查询: {query[:50]}... - 无相关分块")
-            return 0.0, {
-                'relevant_chunks': [],
-                'precision_at_k': [],
-                'relevant_positions': [],
-                'calculation_steps': [],
-                'chunk_relevance_scores': [],
-                'total_relevant': 0,
-                'total_retrieved': len(retrieved_contexts) if retrieved_contexts else 0
-            }
+            return 0.0, self._empty_details([], len(retrieved_contexts) if retrieved_contexts else 0, collect_details)
         
         if not retrieved_contexts:
             # 如果没有检索分块，返回0
             debug_print(f"  查询: {query[:50]}... - 无检索分块")
-            return 0.0, {
-                'relevant_chunks': relevant_chunks,
-                'precision_at_k': [],
-                'relevant_positions': [],
-                'calculation_steps': [],
-                'chunk_relevance_scores': [],
-                'total_relevant': 0,
-                'total_retrieved': 0
-            }
+            return 0.0, self._empty_details(relevant_chunks, 0, collect_details)
         
-        # 计算每个检索分块与相关分块的相关性
-        chunk_relevance_scores = []
-        for i, retrieved_chunk in enumerate(retrieved_contexts):
-            max_relevance = 0.0
-            best_ref_chunk = ""
-            for ref_chunk in relevant_chunks:
-                relevance = self.bm25_evaluator.calculate_relevance_score(retrieved_chunk, ref_chunk)
-                if relevance > max_relevance:
-                    max_relevance = relevance
-                    best_ref_chunk = ref_chunk
-            
-            # 位置 = 总长度 - 原始index（倒序）
-            position = len(retrieved_contexts) - i
-            
-            chunk_relevance_scores.append({
-                'position': position,
-                'chunk': retrieved_chunk,
-                'relevance_score': max_relevance,
-                'is_relevant': max_relevance > self.relevance_threshold,
-                'best_ref_chunk': best_ref_chunk
-            })
+        positions = len(retrieved_contexts) - np.arange(len(retrieved_contexts), dtype=np.int32)  # 位置 = 总长度 - 原始index（倒序）
+        is_relevant = max_relevances > self.relevance_threshold
         
-        # 计算平均精度
-        relevant_count = 0
-        precision_sum = 0.0
-        precision_at_k = []
-        relevant_positions = []
-        calculation_steps = []
-        
-        for i, chunk_info in enumerate(chunk_relevance_scores):
-            if chunk_info['is_relevant']:
-                relevant_count += 1
-                # 使用倒序位置计算精度
-                position = chunk_info['position']
-                precision_at_i = relevant_count / position
-                precision_sum += precision_at_i
-                precision_at_k.append(precision_at_i)
-                relevant_positions.append(position)
-                
-                calculation_steps.append({
-                    'position': position,
-                    'precision': precision_at_i,
-                    'relevant_count': relevant_count,
-                    'total_retrieved': position
-                })
+        # 第k个相关分块处的相关分块数就是k，精度@位置 = k / 位置（与AP内核中的计算一致）
+        # 直接保存为连续的NumPy数组，计算过程在显示时由calculation_steps_from_details还原
+        relevant_positions = positions[is_relevant]
+        precision_at_k = np.arange(1, len(relevant_positions) + 1) / relevant_positions
         
-        # 计算平均精度
-        if relevant_count > 0:
-            average_precision = precision_sum / relevant_count
-        else:
-            average_precision = 0.0
-        
-        return average_precision, {
+        details = {
             'relevant_chunks': relevant_chunks,
             'precision_at_k': precision_at_k,
             'relevant_positions': relevant_positions,
-            'calculation_steps': calculation_steps,
-            'chunk_relevance_scores': chunk_relevance_scores,
-            'total_relevant': relevant_count,
+            'total_relevant': len(relevant_positions),
+            'num_relevant_refs': len(relevant_chunks),  # 与查询相关的参考分块数
+            'num_relevant_retrieved': len(relevant_positions),  # 被判定为相关的检索分块数
             'total_retrieved': len(retrieved_contexts)
         }
+        
+        if collect_details:
+            # 分块相关性以结构化数组（SoA）保存，每个字段一个数组
+            # 与所有相关分块的相关性都为0时，没有最相关的参考分块（记为-1）
+            best_ref_idx = np.where(max_relevances > 0, best_ref_indices, -1).astype(np.int32)
+            details['chunk_relevance_scores'] = {
+                'positions': positions,
+                'relevance': max_relevances.astype(np.float32),
+                'is_relevant': is_relevant,
+                'best_ref_idx': best_ref_idx,
+                # 检索分块与最相关参考分块在驻留池中的ID，显示时通过get_chunk取回内容
+                'retrieved_id': self._intern_all(retrieved_contexts),
+                'best_ref_id': np.where(best_ref_idx >= 0, relevant_ids[np.maximum(best_ref_idx, 0)], -1).astype(np.int32)
+            }
+        
+        return float(average_precision), details
+    
+    def calculate_average_precision(self, query: str, retrieved_contexts: List[str], 
+                                  reference_contexts: List[str],
+                                  collect_details: Optional[bool] = None) -> Tuple[float, Dict[str, Any]]:
+        """
+        计算单个查询的平均精度(AP)
+        
+        Args:
+            query: 用户查询
+            retrieved_contexts: 检索分块列表
+            reference_contexts: 参考分块列表
+            collect_details: 是否保存分块相关性数组，None表示使用config.collect_details
+            
+        Returns:
+            Tuple[float, Dict[str, Any]]: (平均精度, 详细计算过程)
+        """
+        relevant_chunks, max_relevances, best_ref_indices = self._score_retrieved_chunks(
+            query, retrieved_contexts, reference_contexts
+        )
+        ap_out = self._compute_average_precisions([max_relevances])
+        return self._build_ap_details(
+            query, retrieved_contexts, relevant_chunks, max_relevances, best_ref_indices,
+            ap_out[0], collect_details
+        )
     
     def evaluate_map(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
@@ -235,21 +600,36 @@ class MAPEvaluator:
             'queries_without_relevant_chunks': 0
         }
         
-        # 计算所有样本的MAP
-        for idx, row in df.iterrows():
-            # 安全获取字符串值
-            user_input_val = row.get('user_input', '')
-            user_input = str(user_input_val) if user_input_val is not None and not pd.isna(user_input_val) else ""
-            
-            # 确保类型转换：从pandas Series转换为List[str]
-            retrieved_contexts_raw = row['retrieved_contexts']
-            reference_contexts_raw = row['reference_contexts']
-            
-            retrieved_contexts = retrieved_contexts_raw if isinstance(retrieved_contexts_raw, list) else list(retrieved_contexts_raw) if retrieved_contexts_raw is not None else []
-            reference_contexts = reference_contexts_raw if isinstance(reference_contexts_raw, list) else list(reference_contexts_raw) if reference_contexts_raw is not None else []
-            
+        # 第一遍：计算每个样本检索分块的最大相关性
+        scored_rows = []
+        # 按列取出数据（上下文列已在load_and_process_data中转换为列表），避免iterrows逐行构造Series
+        user_inputs = [str(value) if notna else "" for value, notna in
+                       zip(df['user_input'].to_numpy(dtype=object), df['user_input'].notna().to_numpy())]
+        for idx, user_input, retrieved_contexts, reference_contexts in zip(
+            df.index, user_inputs, df['retrieved_contexts'].to_numpy(dtype=object), df['reference_contexts'].to_numpy(dtype=object)
+        ):
             # 安全检查：处理空值和NaN
             if not retrieved_contexts or not reference_contexts or len(retrieved_contexts) == 0 or len(reference_contexts) == 0:
+                scored_rows.append((idx, user_input, retrieved_contexts, reference_contexts, None))
+                continue
+            
+            scored_rows.append((idx, user_input, retrieved_contexts, reference_contexts, True))
+        
+        # 所有非空样本的相关性矩阵一次性批量计算
+        valid_rows = [(user_input, retrieved_contexts, reference_contexts)
+                      for _, user_input, retrieved_contexts, reference_contexts, valid in scored_rows if valid]
+        batch_scored = iter(self._score_retrieved_chunks_batch(valid_rows))
+        scored_rows = [(idx, user_input, retrieved_contexts, reference_contexts, next(batch_scored) if valid else None)
+                       for idx, user_input, retrieved_contexts, reference_contexts, valid in scored_rows]
+        
+        # 所有样本的AP在一次批量内核调用中计算
+        batch_relevances = [scored[1] for *_, scored in scored_rows if scored is not None]
+        ap_out = self._compute_average_precisions(batch_relevances)
+        
+        # 第二遍：按原顺序整理结果
+        batch_pos = 0
+        for idx, user_input, retrieved_contexts, reference_contexts, scored in scored_rows:
+            if scored is None:
                 # 对于空检索结果，平均精度为0
                 results['average_precisions'].append(0.0)
                 results['total_queries'] += 1
@@ -261,26 +641,16 @@ class MAPEvaluator:
                     'retrieved_count': len(retrieved_contexts) if retrieved_contexts else 0,
                     'reference_count': len(reference_contexts) if reference_contexts else 0,
                     'relevant_chunks_count': 0,
-                    'calculation_details': {
-                        'relevant_chunks': [],
-                        'precision_at_k': [],
-                        'relevant_positions': [],
-                        'calculation_steps': [],
-                        'chunk_relevance_scores': [],
-                        'total_relevant': 0,
-                        'total_retrieved': len(retrieved_contexts) if retrieved_contexts else 0
-                    }
+                    'calculation_details': self._empty_details([], len(retrieved_contexts) if retrieved_contexts else 0)
                 })
                 continue
             
-            # 确保类型转换：从pandas Series转换为List[str]
-            retrieved_contexts_list = retrieved_contexts if isinstance(retrieved_contexts, list) else list(retrieved_contexts) if retrieved_contexts is not None else []
-            reference_contexts_list = reference_contexts if isinstance(reference_contexts, list) else list(reference_contexts) if reference_contexts is not None else []
-            
-            # 计算平均精度
-            average_precision, calculation_details = self.calculate_average_precision(
-                user_input, retrieved_contexts_list, reference_contexts_list
+            relevant_chunks, max_relevances, best_ref_indices = scored
+            average_precision, calculation_details = self._build_ap_details(
+                user_input, retrieved_contexts, relevant_chunks, max_relevances, best_ref_indices,
+                ap_out[batch_pos]
             )
+            batch_pos += 1
             
             results['average_precisions'].append(average_precision)
             results['total_queries'] += 1
@@ -297,46 +667,48 @@ class MAPEvaluator:
                 'average_precision': average_precision,
                 'retrieved_count': len(retrieved_contexts),
                 'reference_count': len(reference_contexts),
-                'relevant_chunks_count': len(self.get_relevant_chunks_for_query(user_input, reference_contexts)),
+                'relevant_chunks_count': calculation_details['num_relevant_refs'],
                 'calculation_details': calculation_details
             })
         
-        # 按样本分组显示结果
-        info_print("\n" + "=" * 80)
-        info_print("📊 样本MAP评估结果")
-        info_print("=" * 80)
-        
-        for result in results['detailed_results']:
-            sample_idx = result['row_index'] + 1
-            user_input = result['user_input']
-            average_precision = result['average_precision']
-            retrieved_count = result['retrieved_count']
-            reference_count = result['reference_count']
-            relevant_count = result['relevant_chunks_count']
-            details = result['calculation_details']
+        # 按样本分组显示结果（静默模式下整个显示过程直接跳过，不做字符串格式化）
+        if not QUIET_MODE:
+            info_print("\n" + "=" * 80)
+            info_print("📊 样本MAP评估结果")
+            info_print("=" * 80)
+        
+            for result in results['detailed_results']:
+                sample_idx = result['row_index'] + 1
+                user_input = result['user_input']
+                average_precision = result['average_precision']
+                retrieved_count = result['retrieved_count']
+                reference_count = result['reference_count']
+                relevant_count = result['relevant_chunks_count']
+                details = result['calculation_details']
             
-            info_print(f"\n📋 样本 {sample_idx}:")
-            info_print(f"  查询: {user_input}")
-            info_print(f"  检索分块数: {retrieved_count}个, 参考分块数: {reference_count}个")
-            info_print(f"  相关分块数: {relevant_count}个")
+                info_print(f"\n📋 样本 {sample_idx}:")
+                info_print(f"  查询: {user_input}")
+                info_print(f"  检索分块数: {retrieved_count}个, 参考分块数: {reference_count}个")
+                info_print(f"  相关分块数: {relevant_count}个")
             
-            if average_precision > 0:
-                info_print(f"  📊 AP得分: {average_precision:.4f}")
+                if average_precision > 0:
+                    info_print(f"  📊 AP得分: {average_precision:.4f}")
                 
-                # 显示计算过程
-                if details['calculation_steps']:
-                    info_print(f"  📈 计算过程:")
-                    for step in details['calculation_steps']:
-                        info_print(f"    位置{step['position']}: 精度@{step['total_retrieved']} = {step['precision']:.4f} "
-                                 f"(相关分块数: {step['relevant_count']}/{step['total_retrieved']})")
+                    # 显示计算过程
+                    calculation_steps = calculation_steps_from_details(details)
+                    if calculation_steps:
+                        info_print(f"  📈 计算过程:")
+                        for step in calculation_steps:
+                            info_print(f"    位置{step['position']}: 精度@{step['total_retrieved']} = {step['precision']:.4f} "
+                                     f"(相关分块数: {step['relevant_count']}/{step['total_retrieved']})")
                 
-                # 显示相关分块位置
-                if details['relevant_positions']:
-                    info_print(f"  🎯 相关分块位置: {details['relevant_positions']}")
-                    info_print(f"  📊 精度@k序列: {[f'{p:.4f}' for p in details['precision_at_k']]}")
-            else:
-                info_print(f"  ❌ 无相关分块")
-                info_print(f"  📊 AP得分: 0.0000")
+                    # 显示相关分块位置
+                    if len(details['relevant_positions']):
+                        info_print(f"  🎯 相关分块位置: {details['relevant_positions'].tolist()}")
+                        info_print(f"  📊 精度@k序列: {[f'{p:.4f}' for p in details['precision_at_k']]}")
+                else:
+                    info_print(f"  ❌ 无相关分块")
+                    info_print(f"  📊 AP得分: 0.0000")
         
         # 计算MAP
         if results['average_precisions']:
@@ -424,19 +796,24 @@ class MAPEvaluator:
             info_print(f"     相关分块数: {result['relevant_chunks_count']}个")
             info_print()
     
-    def print_detailed_chunk_analysis(self, df: pd.DataFrame, max_samples: int = 3):
+    def print_detailed_chunk_analysis(self, df: pd.DataFrame, max_samples: int = 3,
+                                      results: Optional[Dict[str, Any]] = None):
         """
         打印详细的分块分析
         
         Args:
             df: 数据DataFrame
             max_samples: 最大显示样本数
+            results: evaluate_map的评估结果（可选，传入时直接复用其中的计算过程，不再重新计算AP）
         """
         info_print("\n" + "=" * 80)
         info_print("🔍 详细分块分析")
         info_print("=" * 80)
         
-        for idx, row in df.head(max_samples).iterrows():
+        # evaluate_map为每一行生成一条详细结果，顺序与df一致
+        detailed_results = results['detailed_results'] if results else []
+        
+        for pos, (idx, row) in enumerate(df.head(max_samples).iterrows()):
             # 安全的索引转换
             sample_num = idx if isinstance(idx, int) else len(df.head(max_samples)) - list(df.head(max_samples).index).index(idx) if idx in df.head(max_samples).index else 1
             info_print(f"\n📋 样本 {sample_num + 1}:")
@@ -445,37 +822,41 @@ class MAPEvaluator:
             user_input_val = row.get('user_input', '')
             user_input = str(user_input_val) if user_input_val is not None and not pd.isna(user_input_val) else ""
             
-            # 确保类型转换：从pandas Series转换为List[str]
-            retrieved_contexts_raw = row['retrieved_contexts']
-            reference_contexts_raw = row['reference_contexts']
-            
-            retrieved_contexts = retrieved_contexts_raw if isinstance(retrieved_contexts_raw, list) else list(retrieved_contexts_raw) if retrieved_contexts_raw is not None else []
-            reference_contexts = reference_contexts_raw if isinstance(reference_contexts_raw, list) else list(reference_contexts_raw) if reference_contexts_raw is not None else []
+            # 上下文列已在load_and_process_data中转换为列表
+            retrieved_contexts = row['retrieved_contexts']
+            reference_contexts = row['reference_contexts']
             
             info_print(f"查询: {user_input}")
             info_print(f"检索分块数: {len(retrieved_contexts)}")
             info_print(f"参考分块数: {len(reference_contexts)}")
             
-            # 计算平均精度和详细过程
-            average_precision, details = self.calculate_average_precision(
-                user_input, retrieved_contexts, reference_contexts
-            )
+            # 平均精度和详细过程：优先复用evaluate_map的结果（未收集分块相关性数组时重新计算）
+            if pos < len(detailed_results) and 'chunk_relevance_scores' in detailed_results[pos]['calculation_details']:
+                average_precision = detailed_results[pos]['average_precision']
+                details = detailed_results[pos]['calculation_details']
+            else:
+                average_precision, details = self.calculate_average_precision(
+                    user_input, retrieved_contexts, reference_contexts, collect_details=True
+                )
             
             info_print(f"\n📊 分块相关性分析:")
-            if 'chunk_relevance_scores' in details and details['chunk_relevance_scores']:
-                for i, chunk_info in enumerate(details['chunk_relevance_scores']):
-                    status = "✅ 相关" if chunk_info['is_relevant'] else "❌ 不相关"
-                    info_print(f"  位置{chunk_info['position']}: {status} (相关性: {chunk_info['relevance_score']:.4f})")
-                    info_print(f"     检索分块: {chunk_info['chunk'][:100]}...")
-                    if chunk_info['is_relevant']:
-                        info_print(f"     最相关参考分块: {chunk_info['best_ref_chunk'][:80]}...")
+            chunk_scores = details['chunk_relevance_scores']
+            if len(chunk_scores['positions']) > 0:
+                for i in range(len(chunk_scores['positions'])):
+                    status = "✅ 相关" if chunk_scores['is_relevant'][i] else "❌ 不相关"
+                    info_print(f"  位置{chunk_scores['positions'][i]}: {status} (相关性: {chunk_scores['relevance'][i]:.4f})")
+                    info_print(f"     检索分块: {self.get_chunk(chunk_scores['retrieved_id'][i])[:100]}...")
+                    if chunk_scores['is_relevant'][i]:
+                        best_ref_chunk = self.get_chunk(chunk_scores['best_ref_id'][i])
+                        info_print(f"     最相关参考分块: {best_ref_chunk[:80]}...")
                     info_print()
             else:
                 info_print("  ❌ 无相关分块或检索分块数据")
             
             info_print(f"📊 平均精度计算:")
-            if details['calculation_steps']:
-                for step in details['calculation_steps']:
+            calculation_steps = calculation_steps_from_details(details)
+            if calculation_steps:
+                for step in calculation_steps:
                     info_print(f"  位置{step['position']}: 精度@{step['total_retrieved']} = {step['precision']:.4f}")
                 info_print(f"  AP = {average_precision:.4f}")
             else:
@@ -506,8 +887,9 @@ class MAPEvaluator:
             self.print_detailed_analysis(results)
             self.print_sample_analysis(results)
             
-            # 4. 打印详细的分块分析
-            self.print_detailed_chunk_analysis(df, max_samples=3)
+            # 4. 打印详细的分块分析（静默模式下跳过）
+            if not QUIET_MODE:
+                self.print_detailed_chunk_analysis(df, max_samples=3, results=results)
             
             return results
             
@@ -13,9 +13,134 @@ import os
 import pandas as pd
 import numpy as np
 from typing import Dict, List, Optional, Any, Tuple
-from config import debug_print, verbose_print, info_print, error_print, QUIET_MODE
+from config import debug_print, verbose_print, info_print, error_print, QUIET_MODE, DEBUG_MODE
 from read_chuck import EvaluationConfig, DataLoader, TextProcessor
-from BM25_evaluate import BM25Evaluator, BM25, find_relevant_chunks, is_chunk_relevant
+from BM25_evaluate import (
+    BM25Evaluator, BM25, find_relevant_chunks, is_chunk_relevant, relevant_reference_chunks, PARALLEL_MIN_ROWS, get_process_context
+)
+from text_similarity import calculate_text_similarity_matrix
+from metrics_numba import last_relevant_row
+
+
+def _reciprocal_rank_from_relevant(retrieved_contexts: List[str], relevant_chunks: List[str],
+                                   relevance_threshold: float, semantic_containment_threshold: float) -> float:
+    """
+    根据相关分块计算倒数排名（模块级函数，可在进程池中执行）
+    
+    Args:
+        retrieved_contexts: 检索分块列表
+        relevant_chunks: 相关分块列表
+        relevance_threshold: 相关性阈值
+        semantic_containment_threshold: 语义包含阈值
+        
+    Returns:
+        float: 倒数排名分数
+    """
+    if not relevant_chunks or not retrieved_contexts:
+        return 0.0
+    
+    # 位置基于原始index的倒序（位置 = 总长度 - 原始index），index最大的相关分块位置最靠前
+    # 与某个相关分块完全相同的检索分块（自身相似度超过阈值时）一定相关，位置最靠前的这样的分块给出了结果的下界，
+    # 只需检查它之后的检索分块，无需计算它之前（位置更靠后）的分块的相关性
+    relevant_set = set(relevant_chunks)
+    exact_row = next((i for i in range(len(retrieved_contexts) - 1, -1, -1) if retrieved_contexts[i] in relevant_set), -1)
+    if exact_row >= 0:
+        exact_chunk = retrieved_contexts[exact_row]
+        self_relevance = calculate_text_similarity_matrix([exact_chunk], [exact_chunk], semantic_containment_threshold)
+        if not self_relevance[0, 0] > relevance_threshold:
+            exact_row = -1
+    
+    # 从最后一个检索分块开始向前查找，找到第一个相关分块即可结束，不再计算其余分块的相关性
+    # 每次批量计算一段检索分块 × 相关分块的相关性（结果与逐对调用calculate_relevance_score一致），段长度按1, 2, 4...倍增
+    # 重复的检索分块只评分一次：段内去重后评分再按下标映射回各行；已评分过的分块都不相关（否则已提前结束），直接跳过
+    end = len(retrieved_contexts)
+    stop = exact_row + 1
+    block_size = 1
+    scored_chunks = set()
+    while end > stop:
+        start = max(stop, end - block_size)
+        unique_ids = {}
+        row_ids = []
+        for offset, chunk in enumerate(retrieved_contexts[start:end]):
+            if chunk not in scored_chunks:
+                row_ids.append((offset, unique_ids.setdefault(chunk, len(unique_ids))))
+        if unique_ids:
+            relevance_matrix = calculate_text_similarity_matrix(
+                list(unique_ids), relevant_chunks, semantic_containment_threshold
+            )
+            offsets, ids = (np.array(values, dtype=np.int64) for values in zip(*row_ids))
+            last_row = last_relevant_row(relevance_matrix[ids], relevance_threshold)
+            if last_row >= 0:
+                best_position = len(retrieved_contexts) - (start + int(offsets[last_row]))
+                return 1.0 / best_position
+            scored_chunks.update(unique_ids)
+        end = start
+        block_size *= 2
+    
+    if exact_row >= 0:
+        return 1.0 / (len(retrieved_contexts) - exact_row)
+    
+    # 如果没有找到相关分块，返回0
+    return 0.0
+
+
+def _score_mrr_rows(start: int, rows: List[Tuple[str, List[str], List[str]]], relevance_threshold: float,
+                    semantic_containment_threshold: float) -> Tuple[int, List[Tuple[int, float]]]:
+    """
+    计算一批样本的相关分块数和倒数排名（模块级函数，可在进程池中执行）
+    
+    Args:
+        start: 该批样本在全部样本中的起始位置（用于无序返回后还原顺序）
+        rows: (用户查询, 检索分块列表, 参考分块列表) 列表
+        relevance_threshold: 相关性阈值
+        semantic_containment_threshold: 语义包含阈值
+        
+    Returns:
+        Tuple[int, List[Tuple[int, float]]]: (起始位置, 每个样本的(相关分块数, 倒数排名))
+    """
+    scored = []
+    for query, retrieved_contexts, reference_contexts in rows:
+        relevant_chunks = list(relevant_reference_chunks(query, tuple(reference_contexts))) if reference_contexts else []
+        reciprocal_rank = _reciprocal_rank_from_relevant(
+            retrieved_contexts, relevant_chunks, relevance_threshold, semantic_containment_threshold
+        )
+        scored.append((len(relevant_chunks), reciprocal_rank))
+    return start, scored
+
+
+def _score_mrr_rows_star(args: Tuple) -> Tuple[int, List[Tuple[int, float]]]:
+    """_score_mrr_rows的单参数版本，供Pool.imap_unordered使用"""
+    return _score_mrr_rows(*args)
+
+
+def _top_bottom_indices(values: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    选出按值降序稳定排序（值相同时保持原顺序）后的前k个和后k个元素的下标，结果与完整排序后取首尾k个一致
+    使用np.partition找到第k大/第k小的值，只对边界两侧的少量元素排序
+    
+    Args:
+        values: 数值数组
+        k: 选取个数
+        
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (前k个下标, 后k个下标)，均按降序稳定排序的顺序排列
+    """
+    if len(values) <= k:
+        order = np.argsort(-values, kind='stable')
+        return order, order
+    
+    # 前k个：大于第k大值的元素按降序排列，再按原顺序补足等于第k大值的元素
+    kth_largest = np.partition(values, len(values) - k)[len(values) - k]
+    above = np.flatnonzero(values > kth_largest)
+    above = above[np.argsort(-values[above], kind='stable')]
+    top = np.concatenate([above, np.flatnonzero(values == kth_largest)[:k - len(above)]])
+    
+    # 后k个：等于第k小值的元素取原顺序中最靠后的几个，再接上小于第k小值的元素（按降序排列）
+    kth_smallest = np.partition(values, k - 1)[k - 1]
+    below = np.flatnonzero(values < kth_smallest)
+    below = below[np.argsort(-values[below], kind='stable')]
+    bottom = np.concatenate([np.flatnonzero(values == kth_smallest)[len(below) - k:], below])
+    return top, bottom
 
 
 class MRREvaluator:
@@ -71,14 +196,7 @@ class MRREvaluator:
         if not query or not reference_contexts:
             return []
         
-        relevant_chunks = []
-        for chunk in reference_contexts:
-            # 使用BM25算法判断相关性
-            is_relevant, score = is_chunk_relevant(query, chunk, threshold=-10.0)  # 使用较低的BM25阈值
-            if is_relevant:
-                relevant_chunks.append(chunk)
-        
-        return relevant_chunks
+        return list(relevant_reference_chunks(query, tuple(reference_contexts)))
     
     def get_ranked_chunks_for_query(self, query: str, retrieved_contexts: List[str]) -> List[Tuple[str, float]]:
         """
@@ -119,49 +237,64 @@ class MRREvaluator:
         """
         # 获取相关分块
         relevant_chunks = self.get_relevant_chunks_for_query(query, reference_contexts)
+        return self._rr_from_relevant(query, retrieved_contexts, relevant_chunks)
+    
+    def _rr_from_relevant(self, query: str, retrieved_contexts: List[str], relevant_chunks: List[str]) -> float:
+        """
+        根据已获取的相关分块计算单个查询的倒数排名
         
+        Args:
+            query: 用户查询
+            retrieved_contexts: 检索分块列表
+            relevant_chunks: 相关分块列表
+            
+        Returns:
+            float: 倒数排名分数
+        """
         if not relevant_chunks:
-            # 如果没有相关分块，返回0
-            debug_print(f"  查询: {query[:50]}... - 无相关分块")
+            # 如果没有相关分块，返回0（调试输出关闭时不格式化消息）
+            if DEBUG_MODE and not QUIET_MODE:
+                debug_print(f"  查询: {query[:50]}... - 无相关分块")
             return 0.0
         
         if not retrieved_contexts:
             # 如果没有检索分块，返回0
-            debug_print(f"  查询: {query[:50]}... - 无检索分块")
+            if DEBUG_MODE and not QUIET_MODE:
+                debug_print(f"  查询: {query[:50]}... - 无检索分块")
             return 0.0
         
-        # 计算每个检索分块的位置（基于原始index的倒序）
-        # 最后一个分块（index最大）的位置是1，第一个分块（index最小）的位置是len(retrieved_contexts)
-        chunk_positions = {}
-        for i, chunk in enumerate(retrieved_contexts):
-            # 位置 = 总长度 - 原始index
-            position = len(retrieved_contexts) - i
-            chunk_positions[chunk] = position
-        
-        # 找到第一个相关分块的位置
-        best_position = float('inf')  # 初始化一个很大的值
-        best_chunk = None
-        
-        for chunk in retrieved_contexts:
-            # 检查这个检索分块是否与任何参考分块相关
-            for ref_chunk in relevant_chunks:
-                # 使用BM25Evaluator的相关性计算方法
-                relevance_score = self.bm25_evaluator.calculate_relevance_score(chunk, ref_chunk)
-                
-                if relevance_score > self.relevance_threshold:
-                    # 找到相关分块，记录位置
-                    position = chunk_positions[chunk]
-                    if position < best_position:
-                        best_position = position
-                        best_chunk = chunk
-        
-        if best_chunk is not None:
-            # 找到第一个相关分块，返回倒数排名
-            reciprocal_rank = 1.0 / best_position
-            return reciprocal_rank
-        
-        # 如果没有找到相关分块，返回0
-        return 0.0
+        return _reciprocal_rank_from_relevant(
+            retrieved_contexts, relevant_chunks, self.relevance_threshold, self.bm25_evaluator._sc_thresh
+        )
+    
+    def _score_rows_batch(self, rows: List[Tuple[str, List[str], List[str]]]) -> List[Tuple[int, float]]:
+        """
+        批量计算多个样本的相关分块数和倒数排名
+        样本较多且config.parallel开启时，按 chunksize = max(1, N // (进程数 + 2)) 分批提交到进程池，否则在当前进程中依次计算
+        
+        Args:
+            rows: (用户查询, 检索分块列表, 参考分块列表) 列表
+            
+        Returns:
+            List[Tuple[int, float]]: 每个样本的(相关分块数, 倒数排名)
+        """
+        sc_thresh = self.bm25_evaluator._sc_thresh
+        processes = min(self.config.max_workers, os.cpu_count() or 1, len(rows))
+        if self.config.parallel and processes > 1 and len(rows) >= PARALLEL_MIN_ROWS:
+            chunksize = max(1, len(rows) // (processes + 2))
+            tasks = [(start, rows[start:start + chunksize], self.relevance_threshold, sc_thresh)
+                     for start in range(0, len(rows), chunksize)]
+            try:
+                scored = [None] * len(rows)
+                with get_process_context().Pool(processes) as pool:
+                    # 无序迭代：先完成的批次先写回，进程池同时预取计算后续批次
+                    for start, batch_scored in pool.imap_unordered(_score_mrr_rows_star, tasks):
+                        scored[start:start + len(batch_scored)] = batch_scored
+                return scored
+            except OSError as e:
+                info_print(f"⚠️  进程池不可用，改为串行计算: {e}")
+        
+        return _score_mrr_rows(0, rows, self.relevance_threshold, sc_thresh)[1]
     
     def evaluate_mrr(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
@@ -180,26 +313,26 @@ class MRREvaluator:
         info_print(f"  • 相关性判断: 检索分块与参考分块的语义相似度 > {self.relevance_threshold}")
         info_print()
         
-        results = {
-            'reciprocal_ranks': [],
-            'detailed_results': [],
-            'total_queries': 0,
-            'queries_with_relevant_chunks': 0,
-            'queries_without_relevant_chunks': 0
-        }
-        
         # 先计算所有样本的MRR，不打印详细信息
-        for idx, row in df.iterrows():
-            user_input = str(row['user_input']) if pd.notna(row['user_input']) else ""
-            retrieved_contexts = row['retrieved_contexts']
-            reference_contexts = row['reference_contexts']
-            
+        # 按列取出数据再逐行遍历，避免iterrows为每行构造Series的开销
+        user_inputs = [str(value) if notna else "" for value, notna in
+                       zip(df['user_input'].to_numpy(dtype=object), df['user_input'].notna().to_numpy())]
+        rows = list(zip(df.index, user_inputs, df['retrieved_contexts'].to_numpy(dtype=object),
+                        df['reference_contexts'].to_numpy(dtype=object)))
+        
+        # 各样本相互独立，非空样本一次性批量计算（样本较多时使用进程池）
+        valid_rows = [(user_input, retrieved_contexts, reference_contexts)
+                      for _, user_input, retrieved_contexts, reference_contexts in rows
+                      if retrieved_contexts and reference_contexts]
+        batch_scored = iter(self._score_rows_batch(valid_rows))
+        
+        # 倒数排名写入预分配的数组（空样本保持为0），统计量在循环结束后由数组一次算出
+        reciprocal_ranks = np.zeros(len(rows), dtype=np.float64)
+        detailed_results = []
+        for pos, (idx, user_input, retrieved_contexts, reference_contexts) in enumerate(rows):
             if not retrieved_contexts or not reference_contexts:
                 # 对于空检索结果，倒数排名为0
-                results['reciprocal_ranks'].append(0.0)
-                results['total_queries'] += 1
-                results['queries_without_relevant_chunks'] += 1
-                results['detailed_results'].append({
+                detailed_results.append({
                     'row_index': idx,
                     'user_input': user_input,
                     'reciprocal_rank': 0.0,
@@ -210,60 +343,60 @@ class MRREvaluator:
                 })
                 continue
             
-            # 计算倒数排名
-            reciprocal_rank = self.calculate_reciprocal_rank(
-                user_input, retrieved_contexts, reference_contexts
-            )
-            
-            results['reciprocal_ranks'].append(reciprocal_rank)
-            results['total_queries'] += 1
+            relevant_chunks_count, reciprocal_rank = next(batch_scored)
+            reciprocal_ranks[pos] = reciprocal_rank
             
             # 计算第一个相关分块的位置
-            first_relevant_position = None
-            if reciprocal_rank > 0:
-                first_relevant_position = int(1 / reciprocal_rank)
-                results['queries_with_relevant_chunks'] += 1
-            else:
-                results['queries_without_relevant_chunks'] += 1
+            first_relevant_position = int(1 / reciprocal_rank) if reciprocal_rank > 0 else None
             
-            # 详细结果
-            results['detailed_results'].append({
+            # 详细结果（保持字典列表，作为接口返回的数据格式）
+            detailed_results.append({
                 'row_index': idx,
                 'user_input': user_input,
                 'reciprocal_rank': reciprocal_rank,
                 'retrieved_count': len(retrieved_contexts),
                 'reference_count': len(reference_contexts),
-                'relevant_chunks_count': len(self.get_relevant_chunks_for_query(user_input, reference_contexts)),
+                'relevant_chunks_count': relevant_chunks_count,
                 'first_relevant_position': first_relevant_position
             })
         
-        # 按样本分组显示结果
-        info_print("\n" + "=" * 80)
-        info_print("📊 样本MRR评估结果")
-        info_print("=" * 80)
+        queries_with_relevant_chunks = int(np.count_nonzero(reciprocal_ranks > 0))
+        results = {
+            'reciprocal_ranks': reciprocal_ranks,
+            'detailed_results': detailed_results,
+            'total_queries': len(rows),
+            'queries_with_relevant_chunks': queries_with_relevant_chunks,
+            'queries_without_relevant_chunks': len(rows) - queries_with_relevant_chunks
+        }
         
-        for result in results['detailed_results']:
-            sample_idx = result['row_index'] + 1
-            user_input = result['user_input']
-            reciprocal_rank = result['reciprocal_rank']
-            first_position = result['first_relevant_position']
-            retrieved_count = result['retrieved_count']
-            reference_count = result['reference_count']
+        # 按样本分组显示结果（静默模式下跳过格式化；输出先写入缓冲区，最后一次性输出）
+        if not QUIET_MODE:
+            lines = ["\n" + "=" * 80, "📊 样本MRR评估结果", "=" * 80]
             
-            info_print(f"\n📋 样本 {sample_idx}:")
-            info_print(f"  查询: {user_input}")
-            info_print(f"  检索分块数: {retrieved_count}个, 参考分块数: {reference_count}个")
+            for result in results['detailed_results']:
+                sample_idx = result['row_index'] + 1
+                user_input = result['user_input']
+                reciprocal_rank = result['reciprocal_rank']
+                first_position = result['first_relevant_position']
+                retrieved_count = result['retrieved_count']
+                reference_count = result['reference_count']
+                
+                lines.append(f"\n📋 样本 {sample_idx}:")
+                lines.append(f"  查询: {user_input}")
+                lines.append(f"  检索分块数: {retrieved_count}个, 参考分块数: {reference_count}个")
+                
+                if first_position is not None:
+                    lines.append(f"  📍 第一个相关分块位置: {first_position}")
+                    lines.append(f"  📊 MRR得分: {reciprocal_rank:.4f}")
+                else:
+                    lines.append(f"  ❌ 无相关分块")
+                    lines.append(f"  📊 MRR得分: 0.0000")
             
-            if first_position is not None:
-                info_print(f"  📍 第一个相关分块位置: {first_position}")
-                info_print(f"  📊 MRR得分: {reciprocal_rank:.4f}")
-            else:
-                info_print(f"  ❌ 无相关分块")
-                info_print(f"  📊 MRR得分: 0.0000")
+            info_print("\n".join(lines))
         
         # 计算MRR
-        if results['reciprocal_ranks']:
-            results['mrr'] = np.mean(results['reciprocal_ranks'])
+        if len(results['reciprocal_ranks']) > 0:
+            results['mrr'] = results['reciprocal_ranks'].mean()
         else:
             results['mrr'] = 0.0
         
@@ -282,6 +415,9 @@ class MRREvaluator:
         Args:
             results: MRR评估结果
         """
+        if QUIET_MODE:
+            return
+        
         info_print("\n" + "=" * 80)
         info_print("📊 MRR详细分析")
         info_print("=" * 80)
@@ -303,22 +439,22 @@ class MRREvaluator:
             coverage = results['queries_with_relevant_chunks'] / results['total_queries']
             info_print(f"5. 相关分块覆盖率: {coverage:.4f} ({coverage*100:.1f}%)")
         
-        # 倒数排名分布统计
-        reciprocal_ranks = results['reciprocal_ranks']
-        if reciprocal_ranks:
+        # 倒数排名分布统计（各项统计复用同一个NumPy数组）
+        reciprocal_ranks = np.asarray(results['reciprocal_ranks'], dtype=np.float64)
+        if len(reciprocal_ranks) > 0:
             info_print(f"\n📊 倒数排名分布:")
-            info_print(f"  • 平均倒数排名: {np.mean(reciprocal_ranks):.4f}")
-            info_print(f"  • 最高倒数排名: {np.max(reciprocal_ranks):.4f}")
-            info_print(f"  • 最低倒数排名: {np.min(reciprocal_ranks):.4f}")
-            info_print(f"  • 标准差: {np.std(reciprocal_ranks):.4f}")
+            info_print(f"  • 平均倒数排名: {reciprocal_ranks.mean():.4f}")
+            info_print(f"  • 最高倒数排名: {reciprocal_ranks.max():.4f}")
+            info_print(f"  • 最低倒数排名: {reciprocal_ranks.min():.4f}")
+            info_print(f"  • 标准差: {reciprocal_ranks.std():.4f}")
             
             # 排名位置分布
-            rank_positions = [1/rr for rr in reciprocal_ranks if rr > 0]
-            if rank_positions:
+            rank_positions = 1.0 / reciprocal_ranks[reciprocal_ranks > 0]
+            if len(rank_positions) > 0:
                 info_print(f"\n📊 相关分块排名位置分布:")
-                info_print(f"  • 平均排名位置: {np.mean(rank_positions):.2f}")
-                info_print(f"  • 最佳排名位置: {int(np.min(rank_positions))}")
-                info_print(f"  • 最差排名位置: {int(np.max(rank_positions))}")
+                info_print(f"  • 平均排名位置: {rank_positions.mean():.2f}")
+                info_print(f"  • 最佳排名位置: {int(rank_positions.min())}")
+                info_print(f"  • 最差排名位置: {int(rank_positions.max())}")
     
     def print_sample_analysis(self, results: Dict[str, Any]):
         """
@@ -327,48 +463,43 @@ class MRREvaluator:
         Args:
             results: MRR评估结果
         """
-        info_print("\n" + "=" * 80)
-        info_print("📊 样本级别MRR分析")
-        info_print("=" * 80)
+        if QUIET_MODE:
+            return
         
-        # 按倒数排名排序
-        sorted_results = sorted(
-            results['detailed_results'], 
-            key=lambda x: x['reciprocal_rank'], 
-            reverse=True
+        # 只选出倒数排名最高和最低的各5个样本（部分选择，不对全部样本排序）
+        detailed_results = results['detailed_results']
+        top_indices, bottom_indices = _top_bottom_indices(
+            np.array([result['reciprocal_rank'] for result in detailed_results], dtype=np.float64), 5
         )
         
-        info_print("🔝 表现最好的样本 (前5个):")
-        for i, result in enumerate(sorted_results[:5], 1):
-            rank_pos = int(1/result['reciprocal_rank']) if result['reciprocal_rank'] > 0 else "无相关分块"
-            info_print(f"  {i}. 行 {result['row_index'] + 1}: 倒数排名 {result['reciprocal_rank']:.4f} (排名位置: {rank_pos})")
-            info_print(f"     查询: {result['user_input'][:100]}...")
-            info_print(f"     检索分块: {result['retrieved_count']}个, 参考分块: {result['reference_count']}个")
-            info_print(f"     相关分块数: {result['relevant_chunks_count']}个")
-            info_print()
-        
-        info_print("🔻 表现最差的样本 (后5个):")
-        for i, result in enumerate(sorted_results[-5:], 1):
-            rank_pos = int(1/result['reciprocal_rank']) if result['reciprocal_rank'] > 0 else "无相关分块"
-            info_print(f"  {i}. 行 {result['row_index'] + 1}: 倒数排名 {result['reciprocal_rank']:.4f} (排名位置: {rank_pos})")
-            info_print(f"     查询: {result['user_input'][:100]}...")
-            info_print(f"     检索分块: {result['retrieved_count']}个, 参考分块: {result['reference_count']}个")
-            info_print(f"     相关分块数: {result['relevant_chunks_count']}个")
-            info_print()
+        # 输出先写入缓冲区，最后一次性输出
+        lines = ["\n" + "=" * 80, "📊 样本级别MRR分析", "=" * 80]
+        for title, indices in (("🔝 表现最好的样本 (前5个):", top_indices), ("🔻 表现最差的样本 (后5个):", bottom_indices)):
+            lines.append(title)
+            for i, result in enumerate((detailed_results[j] for j in indices.tolist()), 1):
+                rank_pos = int(1/result['reciprocal_rank']) if result['reciprocal_rank'] > 0 else "无相关分块"
+                lines.append(f"  {i}. 行 {result['row_index'] + 1}: 倒数排名 {result['reciprocal_rank']:.4f} (排名位置: {rank_pos})")
+                lines.append(f"     查询: {result['user_input'][:100]}...")
+                lines.append(f"     检索分块: {result['retrieved_count']}个, 参考分块: {result['reference_count']}个")
+                lines.append(f"     相关分块数: {result['relevant_chunks_count']}个")
+                lines.append("")
+        info_print("\n".join(lines))
     
-    def print_detailed_chunk_ranking(self, df: pd.DataFrame, max_samples: int = 3):
+    def print_detailed_chunk_ranking(self, df: pd.DataFrame, max_samples: int = 3, results: Optional[Dict[str, Any]] = None):
         """
         打印详细的分块排序分析
         
         Args:
             df: 数据DataFrame
             max_samples: 最大显示样本数
+            results: evaluate_mrr的评估结果（提供时直接复用其中的倒数排名，不再重新计算）
         """
         info_print("\n" + "=" * 80)
         info_print("🔍 详细分块排序分析")
         info_print("=" * 80)
         
-        for idx, row in df.head(max_samples).iterrows():
+        detailed_results = results['detailed_results'] if results else []
+        for pos, (idx, row) in enumerate(df.head(max_samples).iterrows()):
             info_print(f"\n📋 样本 {idx + 1}:")
             user_input = str(row['user_input']) if pd.notna(row['user_input']) else ""
             retrieved_contexts = row['retrieved_contexts']
@@ -378,31 +509,44 @@ class MRREvaluator:
             info_print(f"检索分块数: {len(retrieved_contexts)}")
             info_print(f"参考分块数: {len(reference_contexts)}")
             
+            # 检索分块 × 参考分块的相关性矩阵只计算一次，最大相关性和倒数排名都从该矩阵得到
+            scorer = self.bm25_evaluator.make_scorer(retrieved_contexts, reference_contexts)
+            relevance_matrix = scorer.matrix()
+            max_relevances, best_ref_indices = scorer.row_maxima()
+            if len(max_relevances) == 0:
+                max_relevances = np.zeros(len(retrieved_contexts), dtype=np.float64)
+                best_ref_indices = np.zeros(len(retrieved_contexts), dtype=np.int64)
+            
+            # 相关性判断对整列一次完成
+            is_relevant = max_relevances > self.relevance_threshold
+            
             # 显示分块位置信息（基于原始index的倒序）
             info_print(f"\n📊 分块位置信息 (基于原始index倒序):")
-            for i, chunk in enumerate(retrieved_contexts):
+            for i, (chunk, max_relevance, best_ref_idx, chunk_is_relevant) in enumerate(
+                zip(retrieved_contexts, max_relevances.tolist(), best_ref_indices.tolist(), is_relevant.tolist())
+            ):
                 position = len(retrieved_contexts) - i
                 info_print(f"  分块{i} (原始index): 位置{position}")
                 info_print(f"     内容: {chunk[:100]}...")
                 
-                # 检查与参考分块的相关性
-                max_relevance = 0.0
-                best_ref_chunk = ""
-                for ref_chunk in reference_contexts:
-                    relevance = self.bm25_evaluator.calculate_relevance_score(chunk, ref_chunk)
-                    if relevance > max_relevance:
-                        max_relevance = relevance
-                        best_ref_chunk = ref_chunk
+                # 与所有参考分块的相关性都为0时，没有最相关的参考分块
+                best_ref_chunk = reference_contexts[best_ref_idx] if max_relevance > 0 else ""
                 
-                if max_relevance > self.relevance_threshold:
+                if chunk_is_relevant:
                     info_print(f"     ✅ 相关性: {max_relevance:.4f} (相关)")
                     info_print(f"     🎯 最相关参考分块: {best_ref_chunk[:80]}...")
                 else:
                     info_print(f"     ❌ 相关性: {max_relevance:.4f} (不相关)")
                 info_print()
             
-            # 计算倒数排名
-            reciprocal_rank = self.calculate_reciprocal_rank(user_input, retrieved_contexts, reference_contexts)
+            # 倒数排名：优先复用评估结果，否则取相关分块对应的矩阵列计算（与calculate_reciprocal_rank一致）
+            if pos < len(detailed_results):
+                reciprocal_rank = detailed_results[pos]['reciprocal_rank']
+            else:
+                relevant_set = set(self.get_relevant_chunks_for_query(user_input, reference_contexts))
+                relevant_columns = [j for j, chunk in enumerate(reference_contexts) if chunk in relevant_set]
+                last_row = last_relevant_row(relevance_matrix[:, relevant_columns], self.relevance_threshold) if relevant_columns else -1
+                reciprocal_rank = 1.0 / (len(retrieved_contexts) - last_row) if last_row >= 0 else 0.0
             if reciprocal_rank > 0:
                 rank_position = int(1 / reciprocal_rank)
                 info_print(f"📍 第一个相关分块位置: {rank_position}")
@@ -435,8 +579,9 @@ class MRREvaluator:
             self.print_detailed_analysis(results)
             self.print_sample_analysis(results)
             
-            # 4. 打印详细的分块排序分析
-            self.print_detailed_chunk_ranking(df, max_samples=3)
+            # 4. 打印详细的分块排序分析（静默模式下跳过，不再为显示计算相关性矩阵）
+            if not QUIET_MODE:
+                self.print_detailed_chunk_ranking(df, max_samples=3, results=results)
             
             return results
             
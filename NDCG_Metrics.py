@@ -11,12 +11,112 @@ RAG评估指标NDCG (Normalized Discounted Cumulative Gain) 实现
 """
 
 import os
+import heapq
+import sqlite3
 import pandas as pd
 import numpy as np
 from typing import Dict, List, Optional, Any, Tuple
 from config import debug_print, verbose_print, info_print, error_print, QUIET_MODE
 from read_chuck import EvaluationConfig, DataLoader, TextProcessor
-from BM25_evaluate import BM25Evaluator, BM25, find_relevant_chunks, is_chunk_relevant
+from BM25_evaluate import (
+    BM25Evaluator, BM25, RelevanceScorer, find_relevant_chunks, is_chunk_relevant, relevant_reference_chunks,
+    PARALLEL_MIN_ROWS, get_process_context
+)
+from text_similarity import calculate_text_similarity_matrix
+from score_cache import ScoreCache, pack_arrays, unpack_arrays
+from metrics_numba import NUMBA_AVAILABLE, dcg_batch
+
+# 持久化评分缓存的格式版本（缓存内容的计算方式变化时递增，旧缓存自动失效）
+SCORE_CACHE_VERSION = 2
+
+# 折损表（所有评估器共用）：_LOG2_TABLE[k] = log2(k + 2)，即位置k + 1的折损log2(position + 1)，不够长时按需扩展
+_LOG2_TABLE = np.log2(np.arange(2, (1 << 14) + 2, dtype=np.float64))
+
+
+def _log2_table(max_position: int) -> np.ndarray:
+    """
+    获取至少覆盖位置1..max_position的折损表（不够长时扩展为两倍长度）
+    
+    Args:
+        max_position: 需要的最大位置
+        
+    Returns:
+        np.ndarray: 折损表
+    """
+    global _LOG2_TABLE
+    if max_position > len(_LOG2_TABLE):
+        _LOG2_TABLE = np.log2(np.arange(2, 2 * max_position + 2, dtype=np.float64))
+    return _LOG2_TABLE
+
+
+def _binary_relevance_scores(retrieved_contexts: List[str], reference_contexts: List[str],
+                             relevance_threshold: float, semantic_containment_threshold: float) -> np.ndarray:
+    """
+    计算检索分块的二进制相关性（模块级函数，可在进程池中执行）
+    
+    Args:
+        retrieved_contexts: 检索分块列表（非空）
+        reference_contexts: 参考分块列表（非空）
+        relevance_threshold: 相关性阈值
+        semantic_containment_threshold: 语义包含阈值
+        
+    Returns:
+        np.ndarray: 每个检索分块的相关性（0或1）
+    """
+    binary_relevance = np.zeros(len(retrieved_contexts), dtype=np.float64)
+    
+    # 与某个参考分块完全相同的检索分块：最大相关性不低于自身相似度，自身相似度超过阈值时一定相关，无需与所有参考分块评分
+    reference_set = set(reference_contexts)
+    exact_chunks = list(dict.fromkeys(chunk for chunk in retrieved_contexts if chunk in reference_set))
+    if exact_chunks:
+        self_relevance = np.diagonal(calculate_text_similarity_matrix(exact_chunks, exact_chunks, semantic_containment_threshold))
+        exact_relevant = {chunk for chunk, score in zip(exact_chunks, self_relevance) if score > relevance_threshold}
+    else:
+        exact_relevant = set()
+    
+    rest_rows = []
+    for i, chunk in enumerate(retrieved_contexts):
+        if chunk in exact_relevant:
+            binary_relevance[i] = 1.0
+        else:
+            rest_rows.append(i)
+    
+    if rest_rows:
+        # 其余检索分块和参考分块只预处理一次，再批量计算每个检索分块的最大相关性（与逐对调用calculate_relevance_score一致）
+        rest_chunks = [retrieved_contexts[i] for i in rest_rows]
+        max_relevances, _ = RelevanceScorer(rest_chunks, reference_contexts, semantic_containment_threshold).row_maxima()
+        # 将相关性分数转换为二进制相关性（0或1）
+        binary_relevance[rest_rows] = np.where(max_relevances > relevance_threshold, 1.0, 0.0)
+    
+    return binary_relevance
+
+
+def _score_ndcg_rows(start: int, rows: List[Tuple[List[str], List[str]]], relevance_threshold: float,
+                     semantic_containment_threshold: float) -> Tuple[int, List[List[float]]]:
+    """
+    计算一批样本的相关性分数（模块级函数，可在进程池中执行）
+    
+    Args:
+        start: 该批样本在全部样本中的起始位置（用于无序返回后还原顺序）
+        rows: (检索分块列表, 参考分块列表) 列表，均非空
+        relevance_threshold: 相关性阈值
+        semantic_containment_threshold: 语义包含阈值
+        
+    Returns:
+        Tuple[int, List[List[float]]]: (起始位置, 每个样本的相关性分数列表)
+    """
+    scored = [
+        _binary_relevance_scores(
+            retrieved_contexts, reference_contexts, relevance_threshold, semantic_containment_threshold
+        ).tolist()
+        for retrieved_contexts, reference_contexts in rows
+    ]
+    return start, scored
+
+
+def _score_ndcg_rows_star(args: Tuple) -> Tuple[int, List[List[float]]]:
+    """_score_ndcg_rows的单参数版本，供Pool.imap_unordered使用"""
+    return _score_ndcg_rows(*args)
 
 
 class NDCGEvaluator:
@@ -37,6 +137,9 @@ class NDCGEvaluator:
         # 相关性阈值
         self.relevance_threshold = float(os.getenv("SIMILARITY_THRESHOLD", "0.5"))
         
+        # 持久化评分缓存（配置了score_cache_path时首次使用时打开）
+        self._score_cache = None
+        
         info_print("🔧 NDCG评估器初始化完成")
         info_print(f"📊 相关性阈值: {self.relevance_threshold}")
     
@@ -72,14 +175,8 @@ class NDCGEvaluator:
         if not query or not reference_contexts:
             return []
         
-        relevant_chunks = []
-        for chunk in reference_contexts:
-            # 使用BM25算法判断相关性
-            is_relevant, score = is_chunk_relevant(query, chunk, threshold=-10.0)  # 使用较低的BM25阈值
-            if is_relevant:
-                relevant_chunks.append(chunk)
-        
-        return relevant_chunks
+        # 使用BM25算法判断相关性（查询只预处理一次，同一查询和参考分块的结果在进程内缓存）
+        return list(relevant_reference_chunks(query, tuple(reference_contexts)))
     
     def get_ranked_chunks_for_query(self, query: str, retrieved_contexts: List[str]) -> List[Tuple[str, float]]:
         """
@@ -121,20 +218,51 @@ class NDCGEvaluator:
         if not retrieved_contexts or not reference_contexts:
             return []
         
-        relevance_scores = []
-        for retrieved_chunk in retrieved_contexts:
-            max_relevance = 0.0
-            for ref_chunk in reference_contexts:
-                # 使用BM25Evaluator的相关性计算方法
-                relevance = self.bm25_evaluator.calculate_relevance_score(retrieved_chunk, ref_chunk)
-                if relevance > max_relevance:
-                    max_relevance = relevance
+        return _binary_relevance_scores(
+            retrieved_contexts, reference_contexts, self.relevance_threshold, self.bm25_evaluator._sc_thresh
+        ).tolist()
+    
+    def _discounts(self, positions: np.ndarray) -> np.ndarray:
+        """
+        查表获取位置对应的折损 log2(position + 1)
+        
+        Args:
+            positions: 位置数组（从1开始）
             
-            # 将相关性分数转换为二进制相关性（0或1）
-            binary_relevance = 1.0 if max_relevance > self.relevance_threshold else 0.0
-            relevance_scores.append(binary_relevance)
+        Returns:
+            np.ndarray: 折损数组
+        """
+        max_position = int(positions.max()) if len(positions) > 0 else 0
+        return _log2_table(max_position)[positions - 1]
+    
+    def _dcg_terms(self, relevance_scores: List[float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        计算每个检索分块的增益、折损和DCG贡献（倒序位置：index=0→位置n, index=n-1→位置1）
+        
+        Args:
+            relevance_scores: 相关性分数列表
+            
+        Returns:
+            Tuple[np.ndarray, np.ndarray, np.ndarray]: (增益 2^relevance - 1, 折损 log2(position + 1), DCG贡献)
+        """
+        relevance = np.asarray(relevance_scores, dtype=np.float64)
+        positions = len(relevance) - np.arange(len(relevance))
+        gains = np.exp2(relevance) - 1.0
+        discounts = self._discounts(positions)
+        return gains, discounts, gains / discounts
+    
+    @staticmethod
+    def _sequential_sum(values: np.ndarray) -> float:
+        """
+        按顺序逐项累加（与逐项相加的循环结果完全一致；np.sum使用成对求和，末位可能不同）
         
-        return relevance_scores
+        Args:
+            values: 数值数组
+            
+        Returns:
+            float: 累加结果
+        """
+        return float(np.cumsum(values)[-1]) if len(values) > 0 else 0.0
     
     def calculate_dcg(self, relevance_scores: List[float]) -> float:
         """
@@ -147,18 +275,11 @@ class NDCGEvaluator:
         Returns:
             float: DCG值
         """
-        if not relevance_scores:
+        if len(relevance_scores) == 0:
             return 0.0
         
-        dcg = 0.0
-        for i, relevance in enumerate(relevance_scores):
-            # 倒序位置计算：index=0→位置3, index=1→位置2, index=2→位置1
-            # 但NDCG评估仍然遵循"相关分块越靠前得分越高"的原则
-            position = len(relevance_scores) - i
-            # DCG公式: DCG = Σ(2^relevance - 1) / log2(position + 1)
-            dcg += (2**relevance - 1) / np.log2(position + 1)
-        
-        return dcg
+        # DCG公式: DCG = Σ(2^relevance - 1) / log2(position + 1)，对所有位置一次性计算
+        return self._sequential_sum(self._dcg_terms(relevance_scores)[2])
     
     def calculate_idcg(self, relevance_scores: List[float]) -> float:
         """
@@ -170,23 +291,17 @@ class NDCGEvaluator:
         Returns:
             float: IDCG值
         """
-        if not relevance_scores:
+        if len(relevance_scores) == 0:
             return 0.0
         
-        # 将相关性分数按降序排列（理想排序）
-        ideal_scores = sorted(relevance_scores, reverse=True)
-        
-        # 计算理想排序的DCG，使用正向位置
-        idcg = 0.0
-        for i, relevance in enumerate(ideal_scores):
-            position = i + 1  # 理想排序中，位置就是i+1
-            # DCG公式: DCG = Σ(2^relevance - 1) / log2(position + 1)
-            idcg += (2**relevance - 1) / np.log2(position + 1)
-        
-        return idcg
+        # 将相关性分数按降序排列（理想排序），理想排序中位置就是i+1
+        ideal_scores = np.sort(np.asarray(relevance_scores, dtype=np.float64))[::-1]
+        discounts = self._discounts(np.arange(1, len(ideal_scores) + 1))
+        return self._sequential_sum((np.exp2(ideal_scores) - 1.0) / discounts)
     
     def calculate_ndcg(self, query: str, retrieved_contexts: List[str], 
-                      reference_contexts: List[str]) -> Tuple[float, Dict[str, Any]]:
+                      reference_contexts: List[str],
+                      relevance_scores: Optional[List[float]] = None) -> Tuple[float, Dict[str, Any]]:
         """
         计算单个查询的NDCG
         
@@ -194,6 +309,7 @@ class NDCGEvaluator:
             query: 用户查询
             retrieved_contexts: 检索分块列表
             reference_contexts: 参考分块列表
+            relevance_scores: 已计算好的相关性分数（批量计算时传入），为None时在此计算
             
         Returns:
             Tuple[float, Dict[str, Any]]: (NDCG值, 详细计算过程)
@@ -208,37 +324,66 @@ class NDCGEvaluator:
             }
         
         # 计算相关性分数
-        relevance_scores = self.calculate_relevance_scores(query, retrieved_contexts, reference_contexts)
-        
-        # 计算DCG
-        dcg = self.calculate_dcg(relevance_scores)
-        
-        # 计算IDCG
-        idcg = self.calculate_idcg(relevance_scores)
+        if relevance_scores is None:
+            relevance_scores = self.calculate_relevance_scores(query, retrieved_contexts, reference_contexts)
+        
+        relevance = np.asarray(relevance_scores, dtype=np.float64)
+        if not relevance.any():
+            # 没有相关分块：增益和DCG贡献均为0，DCG、IDCG和NDCG为0，无需累加和排序
+            discounts = self._discounts(len(relevance) - np.arange(len(relevance)))
+            zeros = np.zeros(len(relevance), dtype=np.float64)
+            return self._ndcg_details(retrieved_contexts, relevance_scores, zeros, discounts, zeros, 0.0, 0.0, 0)
+        
+        # 增益、折损和DCG贡献只计算一次，DCG、IDCG和计算步骤共用
+        gains, discounts, contributions = self._dcg_terms(relevance_scores)
+        dcg = self._sequential_sum(contributions)
+        
+        # 计算IDCG：增益随相关性单调递增，理想排序的增益即增益降序排列；理想位置1..n的折损即倒序位置折损的逆序
+        idcg = self._sequential_sum(np.sort(gains)[::-1] / discounts[::-1])
+        
+        relevant_chunks = int(relevance.sum())
+        return self._ndcg_details(retrieved_contexts, relevance_scores, gains, discounts, contributions, dcg, idcg,
+                                  relevant_chunks)
+    
+    def _ndcg_details(self, retrieved_contexts: List[str], relevance_scores: List[float], gains: np.ndarray,
+                      discounts: np.ndarray, contributions: np.ndarray, dcg: float,
+                      idcg: float, relevant_chunks: int) -> Tuple[float, Dict[str, Any]]:
+        """
+        由DCG、IDCG和逐位置的增益、折损、DCG贡献生成NDCG及详细计算过程
         
+        Args:
+            retrieved_contexts: 检索分块列表
+            relevance_scores: 相关性分数列表
+            gains: 每个检索分块的增益
+            discounts: 每个检索分块的折损
+            contributions: 每个检索分块的DCG贡献
+            dcg: DCG值
+            idcg: IDCG值
+            relevant_chunks: 相关分块数（相关性分数之和）
+            
+        Returns:
+            Tuple[float, Dict[str, Any]]: (NDCG值, 详细计算过程)
+        """
         # 计算NDCG
         if idcg > 0:
             ndcg = dcg / idcg
         else:
             ndcg = 0.0
         
-        # 生成计算步骤
-        calculation_steps = []
-        for i, (chunk, relevance) in enumerate(zip(retrieved_contexts, relevance_scores)):
-            # 倒序位置计算：index=0→位置3, index=1→位置2, index=2→位置1
-            position = len(retrieved_contexts) - i
-            gain = 2**relevance - 1
-            discount = np.log2(position + 1)
-            dcg_contribution = gain / discount
-            
-            calculation_steps.append({
-                'position': position,
+        # 生成计算步骤（倒序位置：index=0→位置n, index=n-1→位置1），只用于显示，静默模式下不生成
+        calculation_steps = None if QUIET_MODE else [
+            {
+                'position': len(retrieved_contexts) - i,
                 'chunk': chunk,
                 'relevance': relevance,
                 'gain': gain,
                 'discount': discount,
                 'dcg_contribution': dcg_contribution
-            })
+            }
+            for i, (chunk, relevance, gain, discount, dcg_contribution) in enumerate(
+                zip(retrieved_contexts, relevance_scores, gains.tolist(), discounts.tolist(), contributions.tolist())
+            )
+        ]
         
         return ndcg, {
             'relevance_scores': relevance_scores,
@@ -247,9 +392,177 @@ class NDCGEvaluator:
             'ndcg': ndcg,
             'calculation_steps': calculation_steps,
             'total_chunks': len(retrieved_contexts),
-            'relevant_chunks': sum(relevance_scores)
+            'relevant_chunks': relevant_chunks
         }
     
+    def _ndcg_batch(self, relevance_lists: List[List[float]]) -> Tuple[np.ndarray, ...]:
+        """
+        批量计算多个样本的增益、折损、DCG贡献、DCG和IDCG，每个样本的结果与单独计算（calculate_ndcg）完全一致
+        逐位置的数组按样本拼接为一维数组，第j个样本的数据为 [offsets[j], offsets[j + 1]) 区间
+        
+        Args:
+            relevance_lists: 每个样本的相关性分数列表（均非空）
+            
+        Returns:
+            Tuple[np.ndarray, ...]: (增益, 折损, DCG贡献, DCG数组, IDCG数组, 相关分块数数组, offsets)
+        """
+        lengths = np.fromiter((len(scores) for scores in relevance_lists), dtype=np.int64, count=len(relevance_lists))
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        relevance = np.concatenate(relevance_lists) if relevance_lists else np.zeros(0, dtype=np.float64)
+        
+        max_length = int(lengths.max()) if len(lengths) > 0 else 0
+        
+        # 倒序位置（index=0→位置n, index=n-1→位置1）
+        positions = np.repeat(lengths, lengths) - (np.arange(offsets[-1]) - np.repeat(offsets[:-1], lengths))
+        gains = np.exp2(relevance) - 1.0
+        discounts = self._discounts(positions)
+        # 每个样本的相关分块数（相关性分数之和，样本均非空）
+        relevant_counts = np.add.reduceat(relevance, offsets[:-1]) if len(lengths) > 0 else np.zeros(0)
+        
+        if NUMBA_AVAILABLE:
+            # 按样本并行，直接在拼接数组上计算，不补齐
+            contributions = np.empty_like(gains)
+            dcg = np.empty(len(lengths), dtype=np.float64)
+            idcg = np.empty(len(lengths), dtype=np.float64)
+            dcg_batch(gains, discounts, _log2_table(max_length), offsets, contributions, dcg, idcg)
+            return gains, discounts, contributions, dcg, idcg, relevant_counts, offsets
+        
+        # 未安装numba时：各样本左对齐补齐为 样本数 × 最大分块数 的矩阵一次计算，补齐位置的增益和DCG贡献为0
+        contributions = gains / discounts
+        mask = np.arange(max_length) < lengths[:, None]
+        padded_contributions = np.zeros(mask.shape, dtype=np.float64)
+        padded_contributions[mask] = contributions
+        dcg = self._sequential_row_sums(padded_contributions, lengths)
+        
+        # 理想排序：每行增益降序排列（补齐位置排在最后），理想位置1..n的折损
+        padded_gains = np.full(mask.shape, np.inf)
+        padded_gains[mask] = -gains
+        ideal_gains = -np.sort(padded_gains, axis=1)
+        ideal_contributions = np.where(mask, ideal_gains / _log2_table(max_length)[:max_length], 0.0)
+        idcg = self._sequential_row_sums(ideal_contributions, lengths)
+        
+        return gains, discounts, contributions, dcg, idcg, relevant_counts, offsets
+    
+    @staticmethod
+    def _sequential_row_sums(values: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """
+        按行顺序逐项累加每行的前lengths[i]项（与_sequential_sum对每行分别累加的结果完全一致）
+        
+        Args:
+            values: 数值矩阵
+            lengths: 每行参与累加的项数（均大于0）
+            
+        Returns:
+            np.ndarray: 每行的累加结果
+        """
+        if values.size == 0:
+            return np.zeros(len(lengths), dtype=np.float64)
+        return np.cumsum(values, axis=1)[np.arange(len(lengths)), lengths - 1]
+    
+    def _get_score_cache(self) -> Optional[ScoreCache]:
+        """
+        获取持久化评分缓存（未配置score_cache_path时返回None）
+        命名空间包含缓存版本、相关性阈值和语义包含阈值，这些参数变化时自动使用新的缓存
+        
+        Returns:
+            Optional[ScoreCache]: 评分缓存
+        """
+        if self._score_cache is None and self.config.score_cache_path:
+            namespace = (f"ndcg_rows:v{SCORE_CACHE_VERSION}:thr={self.relevance_threshold}:"
+                         f"sc={self.bm25_evaluator._sc_thresh}")
+            try:
+                self._score_cache = ScoreCache(self.config.score_cache_path, namespace)
+            except sqlite3.Error as e:
+                error_print(f"❌ 评分缓存打开失败，不使用缓存: {e}")
+                self.config.score_cache_path = ""
+        return self._score_cache
+    
+    def _score_rows_batch(self, rows: List[Tuple[List[str], List[str]]]) -> List[List[float]]:
+        """
+        批量计算多个样本的相关性分数
+        配置了score_cache_path时先从持久化缓存读取，只计算未命中的样本并写回缓存
+        
+        Args:
+            rows: (检索分块列表, 参考分块列表) 列表，均非空
+            
+        Returns:
+            List[List[float]]: 每个样本的相关性分数列表
+        """
+        cache = self._get_score_cache()
+        if cache is None:
+            return self._compute_rows_batch(rows)
+        
+        # 每个分块单独作为键的一部分（make_key对每部分加长度前缀），并加入分块数，不同的分块切分不会得到相同的键
+        keys = [ScoreCache.make_key(str(len(retrieved_contexts)), *retrieved_contexts,
+                                    str(len(reference_contexts)), *reference_contexts)
+                for retrieved_contexts, reference_contexts in rows]
+        try:
+            cached = cache.get_many(keys)
+        except sqlite3.Error as e:
+            error_print(f"❌ 评分缓存读取失败: {e}")
+            cached = {}
+        
+        # 读取命中的缓存结果，无法解码或长度与检索分块数不一致的缓存值按未命中处理（重新计算并覆盖）
+        scored = [None] * len(rows)
+        for i, key in enumerate(keys):
+            if key in cached:
+                try:
+                    relevance_scores = unpack_arrays(cached[key], [np.float64])[0]
+                except ValueError:
+                    continue
+                if len(relevance_scores) == len(rows[i][0]):
+                    scored[i] = relevance_scores.tolist()
+        
+        miss_positions = [i for i in range(len(rows)) if scored[i] is None]
+        computed = self._compute_rows_batch([rows[i] for i in miss_positions]) if miss_positions else []
+        
+        for i, relevance_scores in zip(miss_positions, computed):
+            scored[i] = relevance_scores
+        try:
+            cache.put_many([(keys[i], pack_arrays(np.asarray(scored[i], dtype=np.float64))) for i in miss_positions])
+        except sqlite3.Error as e:
+            error_print(f"❌ 评分缓存写入失败: {e}")
+        
+        info_print(f"💾 评分缓存: 命中 {len(rows) - len(miss_positions)} / {len(rows)} 个样本")
+        return scored
+    
+    def _compute_rows_batch(self, rows: List[Tuple[List[str], List[str]]]) -> List[List[float]]:
+        """
+        批量计算多个样本的相关性分数（不使用缓存）
+        样本较多且config.parallel开启时，按 chunksize = max(1, N // (进程数 + 2)) 分批提交到进程池，否则在当前进程中依次计算
+        分块的分词等预处理结果在每个进程内缓存（prepare_text），串行计算时整个数据集中每个不同的分块只预处理一次
+        
+        Args:
+            rows: (检索分块列表, 参考分块列表) 列表，均非空
+            
+        Returns:
+            List[List[float]]: 每个样本的相关性分数列表
+        """
+        sc_thresh = self.bm25_evaluator._sc_thresh
+        processes = min(self.config.max_workers, os.cpu_count() or 1, len(rows))
+        if self.config.parallel and processes > 1 and len(rows) >= PARALLEL_MIN_ROWS:
+            # 参考分块相同的样本排在一起再分批（按首次出现的顺序分组），同一组参考分块尽量只在一个工作进程中预处理
+            reference_groups = {}
+            order = sorted(range(len(rows)), key=lambda i: reference_groups.setdefault(tuple(rows[i][1]), len(reference_groups)))
+            ordered_rows = [rows[i] for i in order]
+            
+            chunksize = max(1, len(rows) // (processes + 2))
+            tasks = [(start, ordered_rows[start:start + chunksize], self.relevance_threshold, sc_thresh)
+                     for start in range(0, len(rows), chunksize)]
+            try:
+                scored = [None] * len(rows)
+                with get_process_context().Pool(processes) as pool:
+                    # 无序迭代：先完成的批次先写回（还原为原始顺序），进程池同时预取计算后续批次
+                    for start, batch_scored in pool.imap_unordered(_score_ndcg_rows_star, tasks):
+                        for i, relevance_scores in zip(order[start:start + len(batch_scored)], batch_scored):
+                            scored[i] = relevance_scores
+                return scored
+            except OSError as e:
+                info_print(f"⚠️  进程池不可用，改为串行计算: {e}")
+        
+        return _score_ndcg_rows(0, rows, self.relevance_threshold, sc_thresh)[1]
+    
     def evaluate_ndcg(self, df: pd.DataFrame) -> Dict[str, Any]:
         """
         计算NDCG指标
@@ -276,12 +589,24 @@ class NDCGEvaluator:
             'queries_without_relevant_chunks': 0
         }
         
+        # 按列取出数据再逐行处理，避免iterrows为每行构造Series
+        # 查询列整体转换一次：缺失值转为空字符串，其余转为字符串
+        user_inputs = df['user_input'].fillna("").astype(str).tolist()
+        rows = list(zip(df.index, user_inputs, df['retrieved_contexts'].to_numpy(dtype=object),
+                        df['reference_contexts'].to_numpy(dtype=object)))
+        
+        # 各样本的相关性计算相互独立，非空样本一次性批量计算（样本较多时使用进程池）
+        valid_rows = [(retrieved_contexts, reference_contexts)
+                      for _, _, retrieved_contexts, reference_contexts in rows
+                      if retrieved_contexts and reference_contexts]
+        relevance_lists = self._score_rows_batch(valid_rows)
+        
+        # 所有样本的DCG和IDCG一次性批量计算
+        gains, discounts, contributions, dcg_values, idcg_values, relevant_counts, offsets = self._ndcg_batch(relevance_lists)
+        valid_pos = 0
+        
         # 计算所有样本的NDCG
-        for idx, row in df.iterrows():
-            user_input = str(row['user_input']) if pd.notna(row['user_input']) else ""
-            retrieved_contexts = row['retrieved_contexts']
-            reference_contexts = row['reference_contexts']
-            
+        for idx, user_input, retrieved_contexts, reference_contexts in rows:
             if not retrieved_contexts or not reference_contexts:
                 # 对于空检索结果，NDCG为0
                 results['ndcg_scores'].append(0.0)
@@ -307,9 +632,13 @@ class NDCGEvaluator:
                 continue
             
             # 计算NDCG
-            ndcg, calculation_details = self.calculate_ndcg(
-                user_input, retrieved_contexts, reference_contexts
+            span = slice(offsets[valid_pos], offsets[valid_pos + 1])
+            ndcg, calculation_details = self._ndcg_details(
+                retrieved_contexts, relevance_lists[valid_pos], gains[span], discounts[span],
+                contributions[span], float(dcg_values[valid_pos]), float(idcg_values[valid_pos]),
+                int(relevant_counts[valid_pos])
             )
+            valid_pos += 1
             
             results['ndcg_scores'].append(ndcg)
             results['total_queries'] += 1
@@ -332,54 +661,57 @@ class NDCGEvaluator:
                 'calculation_details': calculation_details
             })
         
-        # 按样本分组显示结果
-        info_print("\n" + "=" * 80)
-        info_print("📊 样本NDCG评估结果")
-        info_print("=" * 80)
-        
-        for result in results['detailed_results']:
-            sample_idx = result['row_index'] + 1
-            user_input = result['user_input']
-            ndcg = result['ndcg']
-            dcg = result['dcg']
-            idcg = result['idcg']
-            retrieved_count = result['retrieved_count']
-            reference_count = result['reference_count']
-            relevant_count = result['relevant_chunks_count']
-            details = result['calculation_details']
+        # 按样本分组显示结果（静默模式下跳过格式化）
+        if not QUIET_MODE:
+            info_print("\n" + "=" * 80)
+            info_print("📊 样本NDCG评估结果")
+            info_print("=" * 80)
             
-            info_print(f"\n📋 样本 {sample_idx}:")
-            info_print(f"  查询: {user_input}")
-            info_print(f"  检索分块数: {retrieved_count}个, 参考分块数: {reference_count}个")
-            info_print(f"  相关分块数: {relevant_count}个")
-            
-            if ndcg > 0:
-                info_print(f"  📊 NDCG得分: {ndcg:.4f}")
-                info_print(f"  📊 DCG: {dcg:.4f}")
-                info_print(f"  📊 IDCG: {idcg:.4f}")
+            for result in results['detailed_results']:
+                sample_idx = result['row_index'] + 1
+                user_input = result['user_input']
+                ndcg = result['ndcg']
+                dcg = result['dcg']
+                idcg = result['idcg']
+                retrieved_count = result['retrieved_count']
+                reference_count = result['reference_count']
+                relevant_count = result['relevant_chunks_count']
+                details = result['calculation_details']
                 
-                # 显示计算过程
-                if details['calculation_steps']:
-                    info_print(f"  📈 计算过程:")
-                    for step in details['calculation_steps']:
-                        status = "✅ 相关" if step['relevance'] > 0 else "❌ 不相关"
-                        info_print(f"    位置{step['position']}: {status} (相关性: {step['relevance']:.0f})")
-                        info_print(f"      增益: 2^{step['relevance']:.0f} - 1 = {step['gain']:.0f}")
-                        info_print(f"      折损: log2({step['position'] + 1}) = {step['discount']:.4f}")
-                        info_print(f"      DCG贡献: {step['dcg_contribution']:.4f}")
-                        info_print(f"      分块: {step['chunk'][:100]}...")
-                        info_print()
+                info_print(f"\n📋 样本 {sample_idx}:")
+                info_print(f"  查询: {user_input}")
+                info_print(f"  检索分块数: {retrieved_count}个, 参考分块数: {reference_count}个")
+                info_print(f"  相关分块数: {relevant_count}个")
                 
-                # 显示相关性分数序列
-                relevance_scores = details['relevance_scores']
-                info_print(f"  🎯 相关性分数序列: {[f'{score:.0f}' for score in relevance_scores]}")
-            else:
-                info_print(f"  ❌ 无相关分块")
-                info_print(f"  📊 NDCG得分: 0.0000")
+                if ndcg > 0:
+                    info_print(f"  📊 NDCG得分: {ndcg:.4f}")
+                    info_print(f"  📊 DCG: {dcg:.4f}")
+                    info_print(f"  📊 IDCG: {idcg:.4f}")
+                    
+                    # 显示计算过程
+                    if details['calculation_steps']:
+                        info_print(f"  📈 计算过程:")
+                        for step in details['calculation_steps']:
+                            status = "✅ 相关" if step['relevance'] > 0 else "❌ 不相关"
+                            info_print(f"    位置{step['position']}: {status} (相关性: {step['relevance']:.0f})")
+                            info_print(f"      增益: 2^{step['relevance']:.0f} - 1 = {step['gain']:.0f}")
+                            info_print(f"      折损: log2({step['position'] + 1}) = {step['discount']:.4f}")
+                            info_print(f"      DCG贡献: {step['dcg_contribution']:.4f}")
+                            info_print(f"      分块: {step['chunk'][:100]}...")
+                            info_print()
+                    
+                    # 显示相关性分数序列
+                    relevance_scores = details['relevance_scores']
+                    info_print(f"  🎯 相关性分数序列: {[f'{score:.0f}' for score in relevance_scores]}")
+                else:
+                    info_print(f"  ❌ 无相关分块")
+                    info_print(f"  📊 NDCG得分: 0.0000")
         
         # 计算平均NDCG
-        if results['ndcg_scores']:
-            results['avg_ndcg'] = np.mean(results['ndcg_scores'])
+        # NDCG分数只转换一次为数组，平均值和分析统计共用
+        results['ndcg_scores'] = np.asarray(results['ndcg_scores'], dtype=np.float64)
+        if len(results['ndcg_scores']) > 0:
+            results['avg_ndcg'] = results['ndcg_scores'].mean()
         else:
             results['avg_ndcg'] = 0.0
         
@@ -398,6 +730,9 @@ class NDCGEvaluator:
         Args:
             results: NDCG评估结果
         """
+        if QUIET_MODE:
+            return
+        
         info_print("\n" + "=" * 80)
         info_print("📊 NDCG详细分析")
         info_print("=" * 80)
@@ -422,13 +757,13 @@ class NDCGEvaluator:
             info_print(f"5. 相关分块覆盖率: {coverage:.4f} ({coverage*100:.1f}%)")
         
         # NDCG分布统计
-        ndcg_scores = results['ndcg_scores']
-        if ndcg_scores:
+        ndcg_scores = np.asarray(results['ndcg_scores'], dtype=np.float64)
+        if len(ndcg_scores) > 0:
             info_print(f"\n📊 NDCG分布:")
-            info_print(f"  • 平均NDCG: {np.mean(ndcg_scores):.4f}")
-            info_print(f"  • 最高NDCG: {np.max(ndcg_scores):.4f}")
-            info_print(f"  • 最低NDCG: {np.min(ndcg_scores):.4f}")
-            info_print(f"  • 标准差: {np.std(ndcg_scores):.4f}")
+            info_print(f"  • 平均NDCG: {ndcg_scores.mean():.4f}")
+            info_print(f"  • 最高NDCG: {ndcg_scores.max():.4f}")
+            info_print(f"  • 最低NDCG: {ndcg_scores.min():.4f}")
+            info_print(f"  • 标准差: {ndcg_scores.std():.4f}")
     
     def print_sample_analysis(self, results: Dict[str, Any]):
         """
@@ -437,6 +772,9 @@ class NDCGEvaluator:
         Args:
             results: NDCG评估结果
         """
+        if QUIET_MODE:
+            return
+        
         info_print("\n" + "=" * 80)
         info_print("📊 样本级别NDCG分析")
         info_print("=" * 80)
@@ -450,7 +788,7 @@ class NDCGEvaluator:
             info_print(f"  DCG: {result['dcg']:.4f}, IDCG: {result['idcg']:.4f}, NDCG: {result['ndcg']:.4f}")
             
             # 显示分块计算过程
-            if 'calculation_details' in result and 'calculation_steps' in result['calculation_details']:
+            if 'calculation_details' in result and result['calculation_details'].get('calculation_steps') is not None:
                 info_print(f"\n  📊 分块计算过程:")
                 calculation_steps = result['calculation_details']['calculation_steps']
                 for step in calculation_steps:
@@ -467,21 +805,20 @@ class NDCGEvaluator:
             
             info_print(f"  {'='*60}")
         
-        # 按NDCG排序显示统计信息
-        sorted_results = sorted(
-            results['detailed_results'], 
-            key=lambda x: x['ndcg'], 
-            reverse=True
-        )
+        # 只选出NDCG最高和最低的各3个样本（有界堆，不对全部样本排序），顺序与按NDCG降序稳定排序后取首尾一致：
+        # 最低的3个在倒序序列中取最小值，再反转为降序
+        detailed_results = results['detailed_results']
+        top_results = heapq.nlargest(3, detailed_results, key=lambda x: x['ndcg'])
+        bottom_results = heapq.nsmallest(3, reversed(detailed_results), key=lambda x: x['ndcg'])[::-1]
         
         info_print(f"\n🔝 表现最好的样本 (前3个):")
-        for i, result in enumerate(sorted_results[:3], 1):
+        for i, result in enumerate(top_results, 1):
             info_print(f"  {i}. 行 {result['row_index'] + 1}: NDCG {result['ndcg']:.4f}")
             info_print(f"     查询: {result['user_input'][:100]}...")
             info_print(f"     相关分块数: {result['relevant_chunks_count']}个")
         
         info_print(f"\n🔻 表现最差的样本 (后3个):")
-        for i, result in enumerate(sorted_results[-3:], 1):
+        for i, result in enumerate(bottom_results, 1):
             info_print(f"  {i}. 行 {result['row_index'] + 1}: NDCG {result['ndcg']:.4f}")
             info_print(f"     查询: {result['user_input'][:100]}...")
             info_print(f"     相关分块数: {result['relevant_chunks_count']}个")
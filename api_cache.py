@@ -3,49 +3,127 @@ API响应缓存模块
 用于缓存历史数据查询结果，减少数据库查询次数
 提升响应速度
 """
+import os
 import time
 import hashlib
-import json
-from typing import Dict, Any, Optional, Callable
+import pickle
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Any, Optional, Callable, Tuple
 from functools import wraps
-from config import info_print, debug_print
+from config import info_print, debug_print, error_print
+
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+# 可直接用repr序列化的参数类型（repr结果确定且能区分类型，如1、1.0、True、'1'）
+_SIMPLE_KEY_TYPES = (str, int, float, bool, type(None))
+
+def _hash_key_bytes(data: bytes) -> bytes:
+    """
+    计算缓存键摘要（安装xxhash时使用xxh3_128，否则使用BLAKE2b）
+    
+    Args:
+        data: 序列化后的参数
+        
+    Returns:
+        bytes: 16字节摘要
+    """
+    if XXHASH_AVAILABLE:
+        return xxhash.xxh3_128_digest(data)
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def _canonical_key_data(value: Any) -> Any:
+    """
+    将参数转换为与插入顺序无关的规范形式：dict按键值对排序、set按元素排序，
+    内容相同的参数（如键顺序不同的dict）生成相同的缓存键；容器类型保留在结果中，list与tuple不会混淆
+    
+    Args:
+        value: 参数
+        
+    Returns:
+        Any: 规范形式（可用pickle序列化）
+    """
+    if isinstance(value, dict):
+        items = [(_canonical_key_data(k), _canonical_key_data(v)) for k, v in value.items()]
+        return (dict, tuple(sorted(items, key=repr)))
+    if isinstance(value, (set, frozenset)):
+        return (type(value), tuple(sorted((_canonical_key_data(v) for v in value), key=repr)))
+    if isinstance(value, (list, tuple)):
+        return (type(value), tuple(_canonical_key_data(v) for v in value))
+    return value
+
+# 分片数量（必须是2的幂，按 hash(key) & (_SHARD_COUNT - 1) 选择分片）
+_SHARD_COUNT = 16
+
+@dataclass
+class _CacheShard:
+    """缓存分片：各分片独立加锁，并发访问不同分片时互不阻塞"""
+    # 缓存键 -> (过期时间, 数据)，按写入顺序排列；所有缓存项TTL相同，写入顺序即过期顺序
+    entries: "OrderedDict[bytes, Tuple[float, Any]]" = field(default_factory=OrderedDict)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    hit_count: int = 0
+    miss_count: int = 0
 
 class APICache:
-    """API响应缓存类"""
+    """API响应缓存类（线程安全，按缓存键分片加锁）"""
     
-    def __init__(self, ttl: int = 300):
+    def __init__(self, ttl: int = 300, maxsize: int = 1024):
         """
         初始化缓存
         
         Args:
             ttl: 缓存过期时间（秒），默认5分钟
+            maxsize: 最大缓存项数（所有分片合计），超出时淘汰最早写入的缓存项
         """
-        self.cache: Dict[str, Dict[str, Any]] = {}
         self.ttl = ttl
-        self.hit_count = 0
-        self.miss_count = 0
+        self.maxsize = maxsize
+        self._shards = [_CacheShard() for _ in range(_SHARD_COUNT)]
+    
+    def __len__(self) -> int:
+        """当前缓存项数量（包含尚未清除的过期项）"""
+        return sum(len(shard.entries) for shard in self._shards)
+    
+    @property
+    def hit_count(self) -> int:
+        """命中次数（各分片之和）"""
+        return sum(shard.hit_count for shard in self._shards)
+    
+    @property
+    def miss_count(self) -> int:
+        """未命中次数（各分片之和）"""
+        return sum(shard.miss_count for shard in self._shards)
+    
+    def _shard_for(self, key: bytes) -> _CacheShard:
+        """根据缓存键选择分片"""
+        return self._shards[hash(key) & (_SHARD_COUNT - 1)]
     
-    def _generate_key(self, *args, **kwargs) -> str:
+    def make_key(self, *args, **kwargs) -> bytes:
         """
-        生成缓存键
+        根据参数生成缓存键（用于get/set，相同的参数总是生成相同的键）
         
         Args:
             *args: 位置参数
             **kwargs: 关键字参数
             
         Returns:
-            str: 缓存键
+            bytes: 缓存键（16字节摘要）
         """
-        # 将参数序列化为字符串
-        key_data = {
-            'args': args,
-            'kwargs': sorted(kwargs.items())
-        }
-        key_str = json.dumps(key_data, sort_keys=True)
-        # 使用MD5生成短键
-        return hashlib.md5(key_str.encode()).hexdigest()
+        key_data = (args, tuple(sorted(kwargs.items())))
+        # 参数都是字符串/数字时直接使用repr，其余情况转换为规范形式后使用pickle序列化（与dict插入顺序无关）
+        if all(isinstance(value, _SIMPLE_KEY_TYPES) for value in args) and \
+                all(isinstance(value, _SIMPLE_KEY_TYPES) for value in kwargs.values()):
+            key_bytes = repr(key_data).encode()
+        else:
+            key_bytes = pickle.dumps(_canonical_key_data(key_data), protocol=5)
+        return _hash_key_bytes(key_bytes)
     
-    def get(self, key: str) -> Optional[Any]:
+    def get(self, key: bytes) -> Optional[Any]:
         """
         从缓存中获取数据
         
@@ -55,26 +133,53 @@ class APICache:
         Returns:
             Optional[Any]: 缓存的数据，如果不存在或已过期则返回None
         """
-        if key not in self.cache:
-            self.miss_count += 1
-            debug_print(f"🔍 缓存未命中: {key}")
-            return None
-        
-        cache_entry = self.cache[key]
+        shard = self._shard_for(key)
+        with shard.lock:
+            cache_entry = shard.entries.get(key)
+            if cache_entry is None:
+                shard.miss_count += 1
+                debug_print(f"🔍 缓存未命中: {key}")
+                return None
+            
+            expires_at, data = cache_entry
+            
+            # 检查是否过期（使用单调时钟，不受系统时间调整影响）
+            if time.monotonic() > expires_at:
+                # 缓存已过期，删除
+                del shard.entries[key]
+                shard.miss_count += 1
+                debug_print(f"⏰ 缓存已过期: {key}")
+                return None
+            
+            shard.hit_count += 1
+        debug_print(f"✅ 缓存命中: {key}")
+        return data
+    
+    def _evict_oldest(self) -> bool:
+        """
+        淘汰所有分片中最早写入的缓存项（所有缓存项TTL相同，过期时间最早即写入最早）
         
-        # 检查是否过期
-        if time.time() - cache_entry['timestamp'] > self.ttl:
-            # 缓存已过期，删除
-            del self.cache[key]
-            self.miss_count += 1
-            debug_print(f"⏰ 缓存已过期: {key}")
-            return None
+        Returns:
+            bool: 是否淘汰了缓存项
+        """
+        oldest_shard = None
+        oldest_expires_at = None
+        for shard in self._shards:
+            with shard.lock:
+                if shard.entries:
+                    expires_at, _ = next(iter(shard.entries.values()))
+                    if oldest_expires_at is None or expires_at < oldest_expires_at:
+                        oldest_shard = shard
+                        oldest_expires_at = expires_at
         
-        self.hit_count += 1
-        debug_print(f"✅ 缓存命中: {key}")
-        return cache_entry['data']
+        if oldest_shard is None:
+            return False
+        with oldest_shard.lock:
+            if oldest_shard.entries:
+                oldest_shard.entries.popitem(last=False)
+        return True
     
-    def set(self, key: str, data: Any) -> None:
+    def set(self, key: bytes, data: Any) -> None:
         """
         设置缓存数据
         
@@ -82,40 +187,49 @@ class APICache:
             key: 缓存键
             data: 要缓存的数据
         """
-        self.cache[key] = {
-            'data': data,
-            'timestamp': time.time()
-        }
+        shard = self._shard_for(key)
+        with shard.lock:
+            shard.entries[key] = (time.monotonic() + self.ttl, data)
+            shard.entries.move_to_end(key)
+        
+        # 超出容量（所有分片合计）时淘汰最早写入的缓存项，实际容量不受缓存键分布影响
+        while len(self) > self.maxsize and self._evict_oldest():
+            pass
         debug_print(f"💾 缓存已保存: {key}")
     
     def clear(self) -> None:
         """清空所有缓存"""
-        count = len(self.cache)
-        self.cache.clear()
-        self.hit_count = 0
-        self.miss_count = 0
+        count = 0
+        for shard in self._shards:
+            with shard.lock:
+                count += len(shard.entries)
+                shard.entries.clear()
+                shard.hit_count = 0
+                shard.miss_count = 0
         info_print(f"🗑️  已清空 {count} 个缓存项")
     
     def clear_expired(self) -> int:
         """
-        清除过期的缓存项
+        清除过期的缓存项（每个分片从最早写入的缓存项开始，遇到未过期的即停止）
         
         Returns:
             int: 清除的缓存项数量
         """
-        current_time = time.time()
-        expired_keys = [
-            key for key, entry in self.cache.items()
-            if current_time - entry['timestamp'] > self.ttl
-        ]
-        
-        for key in expired_keys:
-            del self.cache[key]
+        current_time = time.monotonic()
+        expired_count = 0
+        for shard in self._shards:
+            with shard.lock:
+                while shard.entries:
+                    expires_at, _ = next(iter(shard.entries.values()))
+                    if current_time <= expires_at:
+                        break
+                    shard.entries.popitem(last=False)
+                    expired_count += 1
         
-        if expired_keys:
-            info_print(f"🗑️  已清除 {len(expired_keys)} 个过期缓存项")
+        if expired_count:
+            info_print(f"🗑️  已清除 {expired_count} 个过期缓存项")
         
-        return len(expired_keys)
+        return expired_count
     
     def get_stats(self) -> Dict[str, Any]:
         """
@@ -124,22 +238,192 @@ class APICache:
         Returns:
             Dict: 缓存统计信息
         """
-        total_requests = self.hit_count + self.miss_count
-        hit_rate = (self.hit_count / total_requests * 100) if total_requests > 0 else 0
+        hit_count = self.hit_count
+        miss_count = self.miss_count
+        total_requests = hit_count + miss_count
+        hit_rate = (hit_count / total_requests * 100) if total_requests > 0 else 0
         
         return {
-            'size': len(self.cache),
-            'hit_count': self.hit_count,
-            'miss_count': self.miss_count,
+            'size': len(self),
+            'hit_count': hit_count,
+            'miss_count': miss_count,
             'total_requests': total_requests,
             'hit_rate': f"{hit_rate:.2f}%",
-            'ttl': self.ttl
+            'ttl': self.ttl,
+            'maxsize': self.maxsize
         }
 
+class PersistentAPICache(APICache):
+    """
+    持久化API缓存（SQLite），进程重启后仍然有效
+    数据库在首次使用时打开（所在目录不存在时自动创建）；过期时间使用系统时间（单调时钟不能跨进程比较）
+    注意：缓存值用pickle序列化，读取时会反序列化，数据库文件属于可信输入，只能由本服务写入，
+    不要将路径指向来源不明的文件
+    """
+    
+    def __init__(self, db_path: str, ttl: int = 600):
+        """
+        初始化缓存
+        
+        Args:
+            db_path: SQLite数据库文件路径
+            ttl: 缓存过期时间（秒），默认10分钟
+        """
+        self.db_path = db_path
+        self.ttl = ttl
+        self.maxsize = None
+        self._hit_count = 0
+        self._miss_count = 0
+        self._lock = threading.Lock()
+        self._conn = None
+    
+    @property
+    def hit_count(self) -> int:
+        """命中次数"""
+        return self._hit_count
+    
+    @property
+    def miss_count(self) -> int:
+        """未命中次数"""
+        return self._miss_count
+    
+    def _connection(self) -> sqlite3.Connection:
+        """获取数据库连接（首次使用时打开并建表，调用方需持有锁）"""
+        if self._conn is None:
+            db_dir = os.path.dirname(self.db_path)
+            if db_dir:
+                os.makedirs(db_dir, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS api_cache ("
+                "key BLOB PRIMARY KEY, value BLOB NOT NULL, expires_at REAL NOT NULL) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS api_cache_expires_at ON api_cache (expires_at)")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+    
+    def __len__(self) -> int:
+        """当前缓存项数量（包含尚未清除的过期项）"""
+        try:
+            with self._lock:
+                return self._connection().execute("SELECT COUNT(*) FROM api_cache").fetchone()[0]
+        except (sqlite3.Error, OSError) as e:
+            error_print(f"❌ 持久化缓存读取失败: {e}")
+            return 0
+    
+    def get(self, key: bytes) -> Optional[Any]:
+        """
+        从缓存中获取数据
+        
+        Args:
+            key: 缓存键
+            
+        Returns:
+            Optional[Any]: 缓存的数据，如果不存在、已过期或读取失败则返回None
+        """
+        try:
+            with self._lock:
+                conn = self._connection()
+                row = conn.execute("SELECT value, expires_at FROM api_cache WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    self._miss_count += 1
+                    debug_print(f"🔍 缓存未命中: {key}")
+                    return None
+                
+                value, expires_at = row
+                if time.time() > expires_at:
+                    # 缓存已过期，删除
+                    conn.execute("DELETE FROM api_cache WHERE key = ?", (key,))
+                    conn.commit()
+                    self._miss_count += 1
+                    debug_print(f"⏰ 缓存已过期: {key}")
+                    return None
+                
+                self._hit_count += 1
+        except (sqlite3.Error, OSError) as e:
+            error_print(f"❌ 持久化缓存读取失败: {e}")
+            return None
+        
+        debug_print(f"✅ 缓存命中: {key}")
+        return pickle.loads(value)
+    
+    def set(self, key: bytes, data: Any) -> None:
+        """
+        设置缓存数据（无法序列化的数据不缓存）
+        
+        Args:
+            key: 缓存键
+            data: 要缓存的数据
+        """
+        try:
+            value = pickle.dumps(data, protocol=5)
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            error_print(f"❌ 缓存数据无法序列化，跳过缓存: {e}")
+            return
+        
+        try:
+            with self._lock:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO api_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, value, time.time() + self.ttl)
+                )
+                conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            error_print(f"❌ 持久化缓存写入失败: {e}")
+            return
+        debug_print(f"💾 缓存已保存: {key}")
+    
+    def clear(self) -> None:
+        """清空所有缓存"""
+        try:
+            with self._lock:
+                conn = self._connection()
+                count = conn.execute("DELETE FROM api_cache").rowcount
+                conn.commit()
+                self._hit_count = 0
+                self._miss_count = 0
+        except (sqlite3.Error, OSError) as e:
+            error_print(f"❌ 持久化缓存清空失败: {e}")
+            return
+        info_print(f"🗑️  已清空 {count} 个缓存项")
+    
+    def clear_expired(self) -> int:
+        """
+        清除过期的缓存项（按过期时间索引删除）
+        
+        Returns:
+            int: 清除的缓存项数量
+        """
+        try:
+            with self._lock:
+                conn = self._connection()
+                expired_count = conn.execute("DELETE FROM api_cache WHERE expires_at < ?", (time.time(),)).rowcount
+                conn.commit()
+        except (sqlite3.Error, OSError) as e:
+            error_print(f"❌ 持久化缓存清理失败: {e}")
+            return 0
+        
+        if expired_count:
+            info_print(f"🗑️  已清除 {expired_count} 个过期缓存项")
+        
+        return expired_count
+    
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
 # 全局缓存实例
 _history_cache = APICache(ttl=300)  # 历史数据缓存5分钟
 _stats_cache = APICache(ttl=60)     # 统计数据缓存1分钟
-_eval_cache = APICache(ttl=600)     # 评估结果缓存10分钟
+# 评估结果缓存10分钟，保存到磁盘，重复运行评估时可复用（EVAL_CACHE_PATH指定数据库文件，默认位于.cache目录，已加入.gitignore）
+_eval_cache = PersistentAPICache(os.getenv("EVAL_CACHE_PATH", os.path.join(".cache", "rag_eval.db")), ttl=600)
 
 def cache_response(cache_instance: APICache = None, ttl: Optional[int] = None):
     """
@@ -159,7 +443,7 @@ def cache_response(cache_instance: APICache = None, ttl: Optional[int] = None):
         @wraps(func)
         async def wrapper(*args, **kwargs):
             # 生成缓存键
-            cache_key = cache_instance._generate_key(func.__name__, *args, **kwargs)
+            cache_key = cache_instance.make_key(func.__name__, *args, **kwargs)
             
             # 尝试从缓存获取
             cached_data = cache_instance.get(cache_key)
@@ -197,9 +481,9 @@ def clear_all_caches() -> Dict[str, int]:
     Returns:
         Dict: 各缓存清除的项数
     """
-    history_count = len(_history_cache.cache)
-    stats_count = len(_stats_cache.cache)
-    eval_count = len(_eval_cache.cache)
+    history_count = len(_history_cache)
+    stats_count = len(_stats_cache)
+    eval_count = len(_eval_cache)
     
     _history_cache.clear()
     _stats_cache.clear()
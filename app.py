@@ -5,15 +5,22 @@ RAG评估系统Web应用
 
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse, FileResponse
+from fastapi.responses import HTMLResponse, FileResponse, JSONResponse
+from fastapi.routing import serialize_response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import asyncio
+import inspect
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import os
 import json
+import numpy as np
 import pandas as pd
-import re
-from typing import Dict, Any, List, Optional
+from typing import Callable, Dict, Any, List, Optional
 from config import debug_print, verbose_print, info_print, error_print, QUIET_MODE
 import traceback
 import tempfile
@@ -29,114 +36,106 @@ from api_cache import (
 )
 
 # 导入评估模块
-from BM25_evaluate import BM25Evaluator
+from BM25_evaluate import BM25Evaluator, serialize_detailed_results
 from rag_evaluator import MainController, RagasMetricsConfig
-from read_chuck import EvaluationConfig
+from read_chuck import EvaluationConfig, clear_dataset_cache, load_dataset_cached
 from MRR_Metrics import MRREvaluator
 from MAP_Metrics import MAPEvaluator
 from NDCG_Metrics import NDCGEvaluator
 from F1_Metrics import F1ScoreCalculator
+from text_similarity import (
+    calculate_text_similarity_from_prepared, calculate_text_similarity_matrices, clear_similarity_cache, prepare_text
+)
+
+# 语义包含阈值（进程启动时读取一次；.env的修改在重启服务后生效）
+SEMANTIC_CONTAINMENT_THRESHOLD = float(os.getenv("SEMANTIC_CONTAINMENT_THRESHOLD", "0.9"))
 
 def calculate_text_similarity(text1: str, text2: str) -> float:
     """
     计算两个文本的相似度
-    使用Jaccard相似度和字符重叠度
+    使用Jaccard相似度和字符重叠度，并对语义包含度超过阈值的文本给予包含度奖励
+    文本的清理与分词结果按文本缓存（prepare_text），同一分块与多个分块比较时只处理一次
     """
-    if not text1 or not text2:
-        return 0.0
-    
-    # 清理文本：移除标点符号，转换为小写
-    def clean_text(text):
-        # 移除标点符号和特殊字符，保留中文、英文、数字
-        cleaned = re.sub(r'[^\w\s\u4e00-\u9fff]', ' ', text)
-        # 移除多余空格
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        return cleaned.lower()
-    
-    clean_text1 = clean_text(text1)
-    clean_text2 = clean_text(text2)
+    return calculate_text_similarity_from_prepared(
+        prepare_text(text1), prepare_text(text2), SEMANTIC_CONTAINMENT_THRESHOLD
+    )
+
+def _best_similarity(similarities) -> tuple:
+    """
+    从一组相似度中找出最大值及其下标（并列时取第一个）
     
-    # 1. Jaccard相似度（基于词）
-    words1 = set(clean_text1.split())
-    words2 = set(clean_text2.split())
+    Args:
+        similarities: 相似度矩阵的一行或一列
     
-    if not words1 or not words2:
-        return 0.0
+    Returns:
+        tuple: (最大相似度, 下标)，所有相似度都不大于0时返回(0, -1)
+    """
+    best_idx = int(np.argmax(similarities))
+    best_similarity = float(similarities[best_idx])
+    if best_similarity > 0:
+        return best_similarity, best_idx
+    return 0, -1
+
+# Ragas明细每批计算相似度矩阵的样本数（限制批量预处理和稀疏矩阵乘法的峰值内存）
+_DETAIL_BLOCK_SIZE = 1000
+
+def _classify_sample_chunks(retrieved_contexts, reference_contexts, similarity_matrix: np.ndarray,
+                            similarity_threshold: float) -> tuple:
+    """
+    根据样本的相似度矩阵划分相关分块、不相关分块和未召回分块
     
-    intersection = len(words1.intersection(words2))
-    union = len(words1.union(words2))
-    jaccard_similarity = intersection / union if union > 0 else 0.0
+    Args:
+        retrieved_contexts: 检索分块列表
+        reference_contexts: 参考分块列表
+        similarity_matrix: 检索分块 × 参考分块的相似度矩阵
+        similarity_threshold: 相似度阈值
     
-    # 2. 字符重叠度（基于字符）
-    chars1 = set(clean_text1)
-    chars2 = set(clean_text2)
-    char_intersection = len(chars1.intersection(chars2))
-    char_union = len(chars1.union(chars2))
-    char_similarity = char_intersection / char_union if char_union > 0 else 0.0
+    Returns:
+        tuple: (相关分块, 不相关分块, 未召回分块)
+    """
+    relevant_chunks = []
+    irrelevant_chunks = []
+    missed_chunks = []
     
-    # 3. 子字符串匹配度
-    substring_similarity = 0.0
-    if len(clean_text1) > 10 and len(clean_text2) > 10:
-        # 检查较短的文本是否包含在较长的文本中
-        shorter, longer = (clean_text1, clean_text2) if len(clean_text1) < len(clean_text2) else (clean_text2, clean_text1)
-        if shorter in longer:
-            substring_similarity = len(shorter) / len(longer)
+    # 分析相关和不相关分块
+    for i, retrieved_chunk in enumerate(retrieved_contexts):
+        max_similarity, best_ref_idx = _best_similarity(similarity_matrix[i])
+        
+        # 如果相似度足够高，认为相关
+        if max_similarity > similarity_threshold:
+            relevant_chunks.append({
+                'retrieved_chunk': retrieved_chunk,
+                'reference_chunk': reference_contexts[best_ref_idx] if best_ref_idx >= 0 else "",
+                'retrieved_idx': i,
+                'reference_idx': best_ref_idx,
+                'relevance_score': max_similarity
+            })
         else:
-            # 检查部分匹配
-            max_match = 0
-            for i in range(len(shorter) - 5):  # 至少5个字符的匹配
-                for j in range(i + 5, len(shorter) + 1):
-                    substring = shorter[i:j]
-                    if substring in longer:
-                        max_match = max(max_match, len(substring))
-            substring_similarity = max_match / len(longer) if longer else 0.0
-    
-    # 综合相似度：加权平均
-    final_similarity = (
-        jaccard_similarity * 0.4 +      # 词级别相似度权重40%
-        char_similarity * 0.3 +         # 字符级别相似度权重30%
-        substring_similarity * 0.3      # 子字符串匹配度权重30%
-    )
-    
-    # 优化：如果短文本完全包含在长文本中，给予更高的相似度
-    # 这是为了处理"检索分块包含标准答案分块"的场景
-    if len(clean_text1) > len(clean_text2):
-        # text1是长文本，text2是短文本
-        if clean_text2 in clean_text1:
-            # 短文本完全包含在长文本中，给予包含度奖励
-            # 使用更高的相似度分数，确保能通过阈值
-            containment_similarity = 0.8  # 固定给予0.8的相似度
-            final_similarity = max(final_similarity, containment_similarity)
-    elif len(clean_text2) > len(clean_text1):
-        # text2是长文本，text1是短文本
-        if clean_text1 in clean_text2:
-            # 短文本完全包含在长文本中，给予包含度奖励
-            # 使用更高的相似度分数，确保能通过阈值
-            containment_similarity = 0.8  # 固定给予0.8的相似度
-            final_similarity = max(final_similarity, containment_similarity)
+            irrelevant_chunks.append({
+                'retrieved_chunk': retrieved_chunk,
+                'retrieved_idx': i,
+                'max_relevance': max_similarity
+            })
     
-    # 新增：检查语义包含度是否超过阈值（完整包含检测）
-    semantic_containment_threshold = float(os.getenv("SEMANTIC_CONTAINMENT_THRESHOLD", "0.9"))
+    # 分析未召回分块
+    # 未召回分块 = reference_contexts中存在的分块，而retrieved_contexts中不存在的分块
+    matched_references = {chunk['reference_idx'] for chunk in relevant_chunks}
     
-    # 计算语义包含度（基于词级别的重叠）
-    if len(words1) > 0 and len(words2) > 0:
-        # 计算较短文本的词在较长文本中的包含度
-        if len(words1) <= len(words2):
-            # words1是较短的，计算words1在words2中的包含度
-            contained_words = words1.intersection(words2)
-            semantic_containment = len(contained_words) / len(words1)
-        else:
-            # words2是较短的，计算words2在words1中的包含度
-            contained_words = words2.intersection(words1)
-            semantic_containment = len(contained_words) / len(words2)
-        
-        # 如果语义包含度超过阈值，给予高相似度分数
-        if semantic_containment >= semantic_containment_threshold:
-            # 使用包含度作为相似度分数，确保能通过阈值
-            containment_similarity = min(semantic_containment, 0.95)  # 最高0.95，避免完全匹配
-            final_similarity = max(final_similarity, containment_similarity)
+    for j, ref_chunk in enumerate(reference_contexts):
+        if j not in matched_references:
+            # 找到该参考分块与所有检索分块的最大相似度
+            max_similarity, best_retrieved_idx = _best_similarity(similarity_matrix[:, j])
+            
+            # 如果相似度低于阈值，认为是未召回的分块
+            if max_similarity < similarity_threshold:
+                missed_chunks.append({
+                    'reference_chunk': ref_chunk,
+                    'reference_idx': j,
+                    'best_retrieved_idx': best_retrieved_idx,
+                    'max_relevance': max_similarity
+                })
     
-    return min(final_similarity, 1.0)
+    return relevant_chunks, irrelevant_chunks, missed_chunks
 
 # 导入数据库模块
 from database.db_service import DatabaseService
@@ -144,7 +143,26 @@ from database.db_config import create_tables, test_connection
 db = DatabaseService()
 init_database = create_tables
 
-app = FastAPI(title="RAG评估系统", description="BM25和Ragas评估系统Web界面")
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+class OrjsonResponse(JSONResponse):
+    """使用orjson序列化的JSON响应（C实现，比json.dumps快；NaN/Infinity输出为null）"""
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+# 新版FastAPI在接口声明response_model时直接由Pydantic（Rust实现）序列化为JSON字节，
+# 设置自定义响应类会关闭这一快速路径；只有旧版FastAPI（经json.dumps序列化）才改用orjson
+_PYDANTIC_JSON_FAST_PATH = 'dump_json' in inspect.signature(serialize_response).parameters
+_response_options = (
+    {'default_response_class': OrjsonResponse} if ORJSON_AVAILABLE and not _PYDANTIC_JSON_FAST_PATH else {}
+)
+
+app = FastAPI(title="RAG评估系统", description="BM25和Ragas评估系统Web界面", **_response_options)
 
 # 添加CORS中间件
 app.add_middleware(
@@ -159,16 +177,149 @@ app.add_middleware(
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # 添加构建数据集页面的直接路由
+@lru_cache(maxsize=4)
+def _load_static_html(path: str, mtime_ns: int) -> str:
+    """
+    读取静态HTML页面（按路径和修改时间缓存，文件更新后自动重新读取）
+    
+    Args:
+        path: 文件路径
+        mtime_ns: 文件修改时间（纳秒），仅用作缓存键
+        
+    Returns:
+        str: 页面内容（换行符统一为\n）
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    try:
+        content = data.decode("utf-8")
+    except UnicodeDecodeError:
+        # 如果UTF-8解码失败，尝试GBK（两者都失败时抛出UnicodeDecodeError）
+        content = data.decode("gbk")
+    return content.replace("\r\n", "\n").replace("\r", "\n")
+
+def _read_static_html(path: str) -> str:
+    """
+    读取静态HTML页面，未修改时直接返回缓存内容
+    
+    Args:
+        path: 文件路径
+        
+    Returns:
+        str: 页面内容
+    """
+    return _load_static_html(path, os.stat(path).st_mtime_ns)
+
 @app.get("/standardDataset_build.html")
 async def build_dataset_page():
     """构建数据集页面"""
-    with open("static/standardDataset_build.html", "r", encoding="utf-8") as f:
-        content = f.read()
-    return HTMLResponse(content=content)
+    return HTMLResponse(content=_read_static_html("static/standardDataset_build.html"))
+
+# 评估结果存储：(评估器, 数据集文件) -> (过期时间, 评估结果)，按写入顺序排列，过期或超出容量后淘汰最早写入的结果，
+# 不同数据集的评估互不覆盖，Ragas原始结果等大对象不会无限制地驻留内存
+_RESULTS_TTL = 3600
+_RESULTS_MAXSIZE = 16
+_results_store: "OrderedDict[tuple, tuple]" = OrderedDict()
+_results_lock = threading.Lock()
+# 各评估器最近一次评估使用的数据集文件（详情、保存等接口读取最近一次的结果）
+_latest_dataset: Dict[str, str] = {}
+
+def _store_results(evaluator: str, dataset_file: str, results: Any) -> None:
+    """
+    保存评估结果
+    
+    Args:
+        evaluator: 评估器名称（如bm25、ragas）
+        dataset_file: 数据集文件名
+        results: 评估结果（为None时不保存）
+    """
+    if results is None:
+        return
+    key = (evaluator, dataset_file)
+    with _results_lock:
+        _results_store[key] = (time.monotonic() + _RESULTS_TTL, results)
+        _results_store.move_to_end(key)
+        # 超出容量时淘汰最早写入的结果
+        while len(_results_store) > _RESULTS_MAXSIZE:
+            _results_store.popitem(last=False)
+        _latest_dataset[evaluator] = dataset_file
+
+def _get_results(evaluator: str, dataset_file: Optional[str] = None) -> Optional[Any]:
+    """
+    获取评估结果
+    
+    Args:
+        evaluator: 评估器名称
+        dataset_file: 数据集文件名，为空时取该评估器最近一次评估的数据集
+        
+    Returns:
+        Optional[Any]: 评估结果，未评估或已过期时返回None
+    """
+    with _results_lock:
+        if dataset_file is None:
+            dataset_file = _latest_dataset.get(evaluator)
+            if dataset_file is None:
+                return None
+        key = (evaluator, dataset_file)
+        entry = _results_store.get(key)
+        if entry is None:
+            return None
+        expires_at, results = entry
+        if time.monotonic() > expires_at:
+            # 结果已过期，删除
+            del _results_store[key]
+            return None
+        return results
+
+def _group_bm25_details(bm25_results: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    将BM25评估的分块结果按样本（行索引）分组，生成详情接口的数据
+    
+    Args:
+        bm25_results: BM25评估结果
+        
+    Returns:
+        List[Dict[str, Any]]: 每个样本的相关、不相关、未召回分块
+    """
+    # 依次归入不相关分块、未召回分块、相关分块，样本按首次出现的顺序排列
+    sample_analysis = {}
+    for kind in ('irrelevant_chunks', 'missed_chunks', 'relevant_chunks'):
+        for chunk_info in bm25_results.get(kind, []):
+            row_idx = chunk_info['row_index']
+            sample = sample_analysis.get(row_idx)
+            if sample is None:
+                sample = sample_analysis[row_idx] = {
+                    'user_input': chunk_info['user_input'],
+                    'irrelevant_chunks': [],
+                    'missed_chunks': [],
+                    'relevant_chunks': []
+                }
+            sample[kind].append(chunk_info)
+    
+    return [
+        {
+            'sample_id': sample_idx,
+            'row_index': row_idx + 1,
+            'user_input': data['user_input'],
+            'relevant_chunks': data['relevant_chunks'],
+            'irrelevant_chunks': data['irrelevant_chunks'],
+            'missed_chunks': data['missed_chunks']
+        }
+        for sample_idx, (row_idx, data) in enumerate(sample_analysis.items(), 1)
+    ]
 
-# 全局变量存储评估结果
-bm25_results = None
-ragas_results = {}
+def _store_bm25_results(dataset_file: str, results: Dict[str, Any]) -> None:
+    """
+    保存BM25评估结果，同时预先生成按样本分组的详情数据（详情接口直接读取）
+    
+    Args:
+        dataset_file: 数据集文件名
+        results: BM25评估结果（为None时不保存）
+    """
+    if results is None:
+        return
+    _store_results("bm25_details", dataset_file, _group_bm25_details(results))
+    _store_results("bm25", dataset_file, results)
 
 class EvaluationRequest(BaseModel):
     """评估请求模型"""
@@ -209,16 +360,10 @@ class SaveEvaluationResponse(BaseModel):
 async def read_root():
     """主页面"""
     try:
-        with open("static/index.html", "r", encoding="utf-8") as f:
-            return HTMLResponse(content=f.read())
+        return HTMLResponse(content=_read_static_html("static/index.html"))
     except UnicodeDecodeError:
-        # 如果UTF-8解码失败，尝试其他编码
-        try:
-            with open("static/index.html", "r", encoding="gbk") as f:
-                return HTMLResponse(content=f.read())
-        except:
-            # 如果都失败，返回简单的HTML页面
-            return HTMLResponse(content="""
+        # UTF-8和GBK解码都失败，返回简单的HTML页面
+        return HTMLResponse(content="""
             <!DOCTYPE html>
             <html>
             <head>
@@ -233,24 +378,108 @@ async def read_root():
             </html>
             """)
 
-@app.post("/api/mrr/evaluate", response_model=EvaluationResponse)
-async def run_mrr_evaluation(request: Optional[EvaluationRequest] = None):
-    """运行MRR评估"""
+# 本地评估（BM25/MRR/MAP/NDCG）是同步的CPU计算，在线程池中执行，避免阻塞事件循环；
+# 各评估器内部已按样本使用进程池并行，评估之间串行执行（单个工作线程），避免同时启动多个进程池
+_evaluation_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="evaluate")
+
+def _dataset_file(request: Optional[EvaluationRequest]) -> str:
+    """
+    获取请求中的数据集文件名
+    
+    Args:
+        request: 评估请求
+        
+    Returns:
+        str: 数据集文件名
+    """
+    return "standardDataset.xlsx" if request is None else request.dataset_file
+
+async def _run_in_executor(func, *args):
+    """
+    在评估线程池中执行同步函数
+    
+    Args:
+        func: 同步函数
+        *args: 函数参数
+        
+    Returns:
+        函数返回值
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_evaluation_executor, func, *args)
+
+def _evaluation_cache_key(metric: str, dataset_file: str) -> Optional[bytes]:
+    """
+    生成评估结果的缓存键：数据集文件修改或替换后（修改时间/大小变化）自动失效，
+    相关性阈值也参与缓存键，调整阈值后重新评估
+    
+    Args:
+        metric: 评估指标名称
+        dataset_file: 数据集文件名
+        
+    Returns:
+        Optional[bytes]: 缓存键，数据集文件不存在时返回None（不使用缓存）
+    """
+    excel_file_path = f"standardDataset/{dataset_file}"
     try:
-        # 获取数据集文件路径
-        dataset_file = "standardDataset.xlsx" if request is None else request.dataset_file
-        excel_file_path = f"standardDataset/{dataset_file}"
+        stat = os.stat(excel_file_path)
+    except OSError:
+        return None
+    return get_eval_cache().make_key(
+        "evaluate", metric, os.path.abspath(excel_file_path), stat.st_mtime_ns, stat.st_size,
+        os.getenv("SIMILARITY_THRESHOLD", "0.5"), os.getenv("SEMANTIC_CONTAINMENT_THRESHOLD", "0.9")
+    )
+
+def _cached_evaluation(metric: str, dataset_file: str, evaluate: Callable[[str], EvaluationResponse]) -> EvaluationResponse:
+    """
+    运行评估，同一数据集未修改时直接返回缓存的评估结果（只缓存成功的结果）
+    
+    Args:
+        metric: 评估指标名称
+        dataset_file: 数据集文件名
+        evaluate: 评估函数
         
-        # 设置环境变量
-        os.environ["EXCEL_FILE_PATH"] = excel_file_path
-        os.environ.setdefault("SIMILARITY_THRESHOLD", "0.5")
+    Returns:
+        EvaluationResponse: 评估结果
+    """
+    cache = get_eval_cache()
+    cache_key = _evaluation_cache_key(metric, dataset_file)
+    if cache_key is not None:
+        cached = cache.get(cache_key)
+        # BM25详情、保存接口读取保存的BM25评估结果，命中缓存时一并恢复（缓存中没有BM25结果时重新评估）
+        if cached is not None and (metric != "bm25" or cached[1] is not None):
+            response, results = cached
+            if metric == "bm25":
+                _store_bm25_results(dataset_file, results)
+            info_print(f"⚡ 使用缓存的{metric.upper()}评估结果: {dataset_file}")
+            return response
+    
+    response = evaluate(dataset_file)
+    results = _get_results("bm25", dataset_file) if metric == "bm25" else None
+    # 没有取到BM25评估结果时不缓存，避免命中缓存后详情、保存接口读不到结果
+    if cache_key is not None and response.success and (metric != "bm25" or results is not None):
+        cache.set(cache_key, (response, results))
+    return response
+
+def _evaluate_mrr(dataset_file: str) -> EvaluationResponse:
+    """
+    运行MRR评估（同步执行，由接口提交到线程池，避免阻塞事件循环）
+    
+    Args:
+        dataset_file: standardDataset目录下的数据集文件名
+        
+    Returns:
+        EvaluationResponse: 评估结果
+    """
+    try:
+        excel_file_path = f"standardDataset/{dataset_file}"
         
-        # 创建最小化配置
+        # 创建最小化配置（数据集路径通过配置传入，不修改进程级环境变量）
         from read_chuck import EvaluationConfig
         config = EvaluationConfig(
             api_key="dummy",
             api_base="dummy",
-            excel_file_path=os.getenv("EXCEL_FILE_PATH", "standardDataset/standardDataset.xlsx")
+            excel_file_path=excel_file_path
         )
         
         # 创建MRR评估器并运行评估
@@ -287,24 +516,30 @@ async def run_mrr_evaluation(request: Optional[EvaluationRequest] = None):
             message=error_msg
         )
 
-@app.post("/api/map/evaluate", response_model=EvaluationResponse)
-async def run_map_evaluation(request: Optional[EvaluationRequest] = None):
-    """运行MAP评估"""
+@app.post("/api/mrr/evaluate", response_model=EvaluationResponse)
+async def run_mrr_evaluation(request: Optional[EvaluationRequest] = None):
+    """运行MRR评估"""
+    return await _run_in_executor(_cached_evaluation, "mrr", _dataset_file(request), _evaluate_mrr)
+
+def _evaluate_map(dataset_file: str) -> EvaluationResponse:
+    """
+    运行MAP评估（同步执行，由接口提交到线程池，避免阻塞事件循环）
+    
+    Args:
+        dataset_file: standardDataset目录下的数据集文件名
+        
+    Returns:
+        EvaluationResponse: 评估结果
+    """
     try:
-        # 获取数据集文件路径
-        dataset_file = "standardDataset.xlsx" if request is None else request.dataset_file
         excel_file_path = f"standardDataset/{dataset_file}"
         
-        # 设置环境变量
-        os.environ["EXCEL_FILE_PATH"] = excel_file_path
-        os.environ.setdefault("SIMILARITY_THRESHOLD", "0.5")
-        
-        # 创建最小化配置
+        # 创建最小化配置（数据集路径通过配置传入，不修改进程级环境变量）
         from read_chuck import EvaluationConfig
         config = EvaluationConfig(
             api_key="dummy",
             api_base="dummy",
-            excel_file_path=os.getenv("EXCEL_FILE_PATH", "standardDataset/standardDataset.xlsx")
+            excel_file_path=excel_file_path
         )
         
         # 创建MAP评估器并运行评估
@@ -323,7 +558,7 @@ async def run_map_evaluation(request: Optional[EvaluationRequest] = None):
             "total_queries": results.get("total_queries", 0),
             "queries_with_relevant_chunks": results.get("queries_with_relevant_chunks", 0),
             "queries_without_relevant_chunks": results.get("queries_without_relevant_chunks", 0),
-            "detailed_results": results.get("detailed_results", [])
+            "detailed_results": serialize_detailed_results(results.get("detailed_results", []))
         }
         
         return EvaluationResponse(
@@ -341,24 +576,30 @@ async def run_map_evaluation(request: Optional[EvaluationRequest] = None):
             message=error_msg
         )
 
-@app.post("/api/ndcg/evaluate", response_model=EvaluationResponse)
-async def run_ndcg_evaluation(request: Optional[EvaluationRequest] = None):
-    """运行NDCG评估"""
+@app.post("/api/map/evaluate", response_model=EvaluationResponse)
+async def run_map_evaluation(request: Optional[EvaluationRequest] = None):
+    """运行MAP评估"""
+    return await _run_in_executor(_cached_evaluation, "map", _dataset_file(request), _evaluate_map)
+
+def _evaluate_ndcg(dataset_file: str) -> EvaluationResponse:
+    """
+    运行NDCG评估（同步执行，由接口提交到线程池，避免阻塞事件循环）
+    
+    Args:
+        dataset_file: standardDataset目录下的数据集文件名
+        
+    Returns:
+        EvaluationResponse: 评估结果
+    """
     try:
-        # 获取数据集文件路径
-        dataset_file = "standardDataset.xlsx" if request is None else request.dataset_file
         excel_file_path = f"standardDataset/{dataset_file}"
         
-        # 设置环境变量
-        os.environ["EXCEL_FILE_PATH"] = excel_file_path
-        os.environ.setdefault("SIMILARITY_THRESHOLD", "0.5")
-        
-        # 创建最小化配置
+        # 创建最小化配置（数据集路径通过配置传入，不修改进程级环境变量）
         from read_chuck import EvaluationConfig
         config = EvaluationConfig(
             api_key="dummy",
             api_base="dummy",
-            excel_file_path=os.getenv("EXCEL_FILE_PATH", "standardDataset/standardDataset.xlsx")
+            excel_file_path=excel_file_path
         )
         
         # 创建NDCG评估器并运行评估
@@ -395,14 +636,22 @@ async def run_ndcg_evaluation(request: Optional[EvaluationRequest] = None):
             message=error_msg
         )
 
-@app.post("/api/bm25/evaluate", response_model=EvaluationResponse)
-async def run_bm25_evaluation(request: Optional[EvaluationRequest] = None):
-    """运行BM25评估"""
-    global bm25_results
+@app.post("/api/ndcg/evaluate", response_model=EvaluationResponse)
+async def run_ndcg_evaluation(request: Optional[EvaluationRequest] = None):
+    """运行NDCG评估"""
+    return await _run_in_executor(_cached_evaluation, "ndcg", _dataset_file(request), _evaluate_ndcg)
+
+def _evaluate_bm25(dataset_file: str) -> EvaluationResponse:
+    """
+    运行BM25评估（同步执行，由接口提交到线程池，避免阻塞事件循环）
     
+    Args:
+        dataset_file: standardDataset目录下的数据集文件名
+        
+    Returns:
+        EvaluationResponse: 评估结果
+    """
     try:
-        # 获取数据集文件路径
-        dataset_file = "standardDataset.xlsx" if request is None else request.dataset_file
         excel_file_path = f"standardDataset/{dataset_file}"
         
         # 创建配置
@@ -437,15 +686,15 @@ async def run_bm25_evaluation(request: Optional[EvaluationRequest] = None):
             "irrelevant_chunks": len(results.get("irrelevant_chunks", [])),
             "missed_chunks": len(results.get("missed_chunks", [])),
             "relevant_chunks": len(results.get("relevant_chunks", [])),
-            "detailed_results": results.get("detailed_results", []),
+            "detailed_results": serialize_detailed_results(results.get("detailed_results", [])),
             "total_samples": len(results.get("precision_scores", [])),
             "precision_scores": results.get("precision_scores", []),
             "recall_scores": results.get("recall_scores", []),
             "f1_scores": f1_results.get("f1_scores", [])
         }
         
-        bm25_results = results
-        info_print(f"🔍 调试: 设置bm25_results全局变量，包含{len(results.get('detailed_results', []))}个详细结果")
+        _store_bm25_results(dataset_file, results)
+        info_print(f"🔍 调试: 保存BM25评估结果，包含{len(results.get('detailed_results', []))}个详细结果")
         
         return EvaluationResponse(
             success=True,
@@ -462,6 +711,52 @@ async def run_bm25_evaluation(request: Optional[EvaluationRequest] = None):
             message=error_msg
         )
 
+@app.post("/api/bm25/evaluate", response_model=EvaluationResponse)
+async def run_bm25_evaluation(request: Optional[EvaluationRequest] = None):
+    """运行BM25评估"""
+    return await _run_in_executor(_cached_evaluation, "bm25", _dataset_file(request), _evaluate_bm25)
+
+@app.post("/api/all/evaluate", response_model=EvaluationResponse)
+async def run_all_evaluation(request: Optional[EvaluationRequest] = None):
+    """依次运行BM25、MRR、MAP、NDCG评估（数据集只解析一次，各评估器内部按样本并行）"""
+    dataset_file = _dataset_file(request)
+    excel_file_path = f"standardDataset/{dataset_file}"
+    
+    # 先解析一次数据集，各评估器随后从缓存中读取同一份数据
+    if os.path.exists(excel_file_path):
+        columns = EvaluationConfig(api_key="dummy", api_base="dummy").required_columns
+        try:
+            await _run_in_executor(load_dataset_cached, excel_file_path, columns)
+        except Exception as e:
+            # 读取失败时由各评估器各自报告错误
+            error_print(f"预加载数据集失败: {e}")
+    
+    metrics = {
+        "bm25": _evaluate_bm25,
+        "mrr": _evaluate_mrr,
+        "map": _evaluate_map,
+        "ndcg": _evaluate_ndcg,
+    }
+    # 逐个运行：每个评估器都会启动自己的进程池，同时运行会使工作进程数成倍增加
+    responses = []
+    for name, func in metrics.items():
+        responses.append(await _run_in_executor(_cached_evaluation, name, dataset_file, func))
+    # 复制结果字典，避免修改缓存中的对象
+    data = {name: dict(response.data) for name, response in zip(metrics, responses)}
+    
+    # 将MRR/MAP/NDCG填入BM25汇总结果（单独调用时由前端分别获取）
+    if data["bm25"]:
+        data["bm25"]["mrr"] = data["mrr"].get("mrr", 0)
+        data["bm25"]["map"] = data["map"].get("map", 0)
+        data["bm25"]["ndcg"] = data["ndcg"].get("ndcg", 0)
+    
+    failures = [response.message for response in responses if not response.success]
+    return EvaluationResponse(
+        success=not failures,
+        message="；".join(failures) if failures else "BM25、MRR、MAP、NDCG评估完成",
+        data=data
+    )
+
 @app.get("/api/ragas/config", response_model=EvaluationResponse)
 async def get_ragas_config():
     """获取Ragas评估指标配置"""
@@ -522,8 +817,6 @@ async def save_ragas_config(request: dict):
 @app.post("/api/ragas/evaluate", response_model=EvaluationResponse)
 async def run_ragas_evaluation(request: Optional[EvaluationRequest] = None):
     """运行Ragas评估"""
-    global ragas_results
-    
     try:
         # 获取数据集文件路径
         dataset_file = "standardDataset.xlsx" if request is None else request.dataset_file
@@ -573,8 +866,7 @@ async def run_ragas_evaluation(request: Optional[EvaluationRequest] = None):
             "error_message": results.get("error_message", "")
         }
         
-        # 保存完整的评估结果到全局变量
-        global ragas_results
+        # 保存完整的评估结果
         ragas_results = {
             "context_recall": results.get("context_recall", 0),
             "context_precision": results.get("context_precision", 0),
@@ -585,6 +877,8 @@ async def run_ragas_evaluation(request: Optional[EvaluationRequest] = None):
             "answer_correctness": results.get("answer_correctness", 0),
             "answer_similarity": results.get("answer_similarity", 0),
             "raw_results": results.get("raw_results"),
+            # 每样本分数表，明细接口按样本查询分数
+            "sample_scores": build_ragas_sample_scores(results.get("raw_results")),
             "fallback_mode": results.get("fallback_mode", False),
             "error_message": results.get("error_message", ""),
             "evaluation_completed": True,  # 标记评估已完成
@@ -592,7 +886,8 @@ async def run_ragas_evaluation(request: Optional[EvaluationRequest] = None):
             "dataset_file": dataset_file  # 保存使用的数据集文件
         }
         
-        info_print(f"✅ Ragas评估结果已保存到全局变量，fallback_mode: {ragas_results.get('fallback_mode', False)}")
+        _store_results("ragas", dataset_file, ragas_results)
+        info_print(f"✅ Ragas评估结果已保存，fallback_mode: {ragas_results.get('fallback_mode', False)}")
         
         return EvaluationResponse(
             success=True,
@@ -612,119 +907,130 @@ async def run_ragas_evaluation(request: Optional[EvaluationRequest] = None):
 @app.get("/api/bm25/details", response_model=EvaluationResponse)
 async def get_bm25_details():
     """获取BM25评估详情"""
-    global bm25_results
+    # 详情数据在保存评估结果时已按样本分组
+    details = _get_results("bm25_details")
+    info_print(f"🔍 调试: BM25详情API调用，评估结果状态: {details is not None}")
     
-    info_print(f"🔍 调试: BM25详情API调用，bm25_results状态: {bm25_results is not None}")
-    if bm25_results:
-        info_print(f"🔍 调试: bm25_results包含{len(bm25_results.get('detailed_results', []))}个详细结果")
-    
-    if not bm25_results:
+    if details is None:
         return EvaluationResponse(
             success=False,
             message="请先运行BM25评估"
         )
     
-    # 格式化详细结果
-    details = []
-    sample_analysis = {}
-    
-    # 组织不相关分块
-    for chunk_info in bm25_results.get('irrelevant_chunks', []):
-        row_idx = chunk_info['row_index']
-        if row_idx not in sample_analysis:
-            sample_analysis[row_idx] = {
-                'user_input': chunk_info['user_input'],
-                'irrelevant_chunks': [],
-                'missed_chunks': [],
-                'relevant_chunks': []
-            }
-        sample_analysis[row_idx]['irrelevant_chunks'].append(chunk_info)
-    
-    # 组织未召回分块
-    for chunk_info in bm25_results.get('missed_chunks', []):
-        row_idx = chunk_info['row_index']
-        if row_idx not in sample_analysis:
-            sample_analysis[row_idx] = {
-                'user_input': chunk_info['user_input'],
-                'irrelevant_chunks': [],
-                'missed_chunks': [],
-                'relevant_chunks': []
-            }
-        sample_analysis[row_idx]['missed_chunks'].append(chunk_info)
-    
-    # 组织相关分块（与不相关分块、未召回分块保持一致）
-    for chunk_info in bm25_results.get('relevant_chunks', []):
-        row_idx = chunk_info['row_index']
-        if row_idx not in sample_analysis:
-            sample_analysis[row_idx] = {
-                'user_input': chunk_info['user_input'],
-                'irrelevant_chunks': [],
-                'missed_chunks': [],
-                'relevant_chunks': []
-            }
-        sample_analysis[row_idx]['relevant_chunks'].append(chunk_info)
-    
-    # 转换为列表格式
-    for sample_idx, (row_idx, data) in enumerate(sample_analysis.items(), 1):
-        details.append({
-            'sample_id': sample_idx,
-            'row_index': row_idx + 1,
-            'user_input': data['user_input'],
-            'relevant_chunks': data['relevant_chunks'],
-            'irrelevant_chunks': data['irrelevant_chunks'],
-            'missed_chunks': data['missed_chunks']
-        })
-    
     return EvaluationResponse(
         success=True,
         message="获取BM25详情成功",
         data={'details': details}
     )
 
+# 分块详情中展示的RAGAS指标 -> 样本分数表中的列名
+_CHUNK_SCORE_COLUMNS = {
+    'faithfulness': 'faithfulness',
+    'answer_relevancy': 'answer_relevancy',
+    'context_precision': 'context_precision',
+    'context_recall': 'context_recall',
+    'context_entity_recall': 'context_entity_recall',
+    'context_relevance': 'nv_context_relevance',
+    'answer_correctness': 'answer_correctness',
+    'answer_similarity': 'answer_similarity'
+}
+
+def build_ragas_sample_scores(raw_results) -> Optional[pd.DataFrame]:
+    """
+    将RAGAS原始结果中的每样本分数整理为分数表（每行一个样本，每列一个指标），评估完成时生成一次，
+    之后按样本查询分数只需按行号取值
+    
+    支持的原始结果格式：EvaluationResult（_scores_dict）、包含scores（DataFrame或字典列表）的字典、
+    包含traces（每个元素含scores字典）的字典
+    
+    Args:
+        raw_results: RAGAS原始评估结果
+        
+    Returns:
+        Optional[pd.DataFrame]: 样本分数表，无法获取每样本分数时返回None
+    """
+    try:
+        scores_dict = getattr(raw_results, '_scores_dict', None)
+        if scores_dict:
+            return pd.DataFrame(scores_dict)
+        
+        if not isinstance(raw_results, dict):
+            return None
+        
+        scores = raw_results.get('scores')
+        if isinstance(scores, pd.DataFrame):
+            return scores.reset_index(drop=True)
+        if isinstance(scores, list):
+            return pd.DataFrame([item if isinstance(item, dict) else {} for item in scores])
+        
+        traces = raw_results.get('traces')
+        if isinstance(traces, list):
+            return pd.DataFrame([
+                trace['scores'] if isinstance(trace, dict) and isinstance(trace.get('scores'), dict) else {}
+                for trace in traces
+            ])
+    except Exception as e:
+        info_print(f"整理RAGAS样本分数时出错: {e}")
+    return None
+
+def _ragas_raw_results_payload(ragas_results) -> Any:
+    """
+    生成明细接口返回的RAGAS原始结果：字典格式直接返回；EvaluationResult等对象
+    （含traces、DataFrame，无法直接序列化为JSON）改为返回每样本分数的字典列表
+    
+    Args:
+        ragas_results: RAGAS评估结果
+        
+    Returns:
+        Any: 可序列化为JSON的原始结果
+    """
+    raw_results = ragas_results.get('raw_results')
+    if raw_results is None or isinstance(raw_results, dict):
+        return raw_results
+    sample_scores = ragas_results.get('sample_scores')
+    if sample_scores is None:
+        return None
+    # NaN分数转换为None
+    return {'scores': sample_scores.astype(object).where(sample_scores.notna(), None).to_dict('records')}
+
+def _sample_score_row(ragas_results, sample_id) -> Optional[pd.Series]:
+    """
+    获取指定样本在分数表中的一行
+    
+    Args:
+        ragas_results: RAGAS评估结果
+        sample_id: 样本ID (1-based)
+        
+    Returns:
+        Optional[pd.Series]: 样本的各指标分数，没有分数表或样本超出范围时返回None
+    """
+    sample_scores = ragas_results.get('sample_scores')
+    # sample_id是1-based，需要转换为0-based索引
+    sample_index = sample_id - 1
+    if sample_scores is None or not 0 <= sample_index < len(sample_scores):
+        return None
+    return sample_scores.iloc[sample_index]
+
 def get_chunk_ragas_scores(ragas_results, sample_id):
     """
-    从RAGAS原始结果中获取指定样本每个分块的详细分数
+    从RAGAS样本分数表中获取指定样本每个指标的详细分数
     
     Args:
         ragas_results: RAGAS评估结果
         sample_id: 样本ID (1-based)
         
     Returns:
-        dict: 包含每个分块评分的字典
+        dict: 包含每个指标评分的字典（缺失或NaN的分数为None）
     """
     try:
-        raw_results = ragas_results.get('raw_results')
-        if not raw_results:
+        row = _sample_score_row(ragas_results, sample_id)
+        if row is None:
             return {}
         
         chunk_scores = {}
-        
-        # 从traces中获取chunk-level评分
-        if isinstance(raw_results, dict) and 'traces' in raw_results:
-            traces = raw_results['traces']
-            
-            # sample_id是1-based，需要转换为0-based索引
-            sample_index = sample_id - 1
-            
-            if isinstance(traces, list) and 0 <= sample_index < len(traces):
-                trace = traces[sample_index]
-                
-                if isinstance(trace, dict) and 'scores' in trace:
-                    scores = trace['scores']
-                    
-                    # 提取所有指标的分数
-                    if isinstance(scores, dict):
-                        chunk_scores = {
-                            'faithfulness': scores.get('faithfulness'),
-                            'answer_relevancy': scores.get('answer_relevancy'),
-                            'context_precision': scores.get('context_precision'),
-                            'context_recall': scores.get('context_recall'),
-                            'context_entity_recall': scores.get('context_entity_recall'),
-                            'context_relevance': scores.get('nv_context_relevance'),
-                            'answer_correctness': scores.get('answer_correctness'),
-                            'answer_similarity': scores.get('answer_similarity')
-                        }
-        
+        for name, column in _CHUNK_SCORE_COLUMNS.items():
+            value = row.get(column)
+            chunk_scores[name] = None if value is None or pd.isna(value) else float(value)
         return chunk_scores
         
     except Exception as e:
@@ -733,7 +1039,7 @@ def get_chunk_ragas_scores(ragas_results, sample_id):
 
 def get_sample_ragas_scores(ragas_results, sample_id):
     """
-    从RAGAS原始结果中获取指定样本的详细分数
+    从RAGAS样本分数表中获取指定样本的详细分数
     
     Args:
         ragas_results: RAGAS评估结果
@@ -743,63 +1049,17 @@ def get_sample_ragas_scores(ragas_results, sample_id):
         tuple: (precision, recall) 或 (None, None) 如果无法获取
     """
     try:
-        raw_results = ragas_results.get('raw_results')
-        if not raw_results:
+        row = _sample_score_row(ragas_results, sample_id)
+        if row is None:
             return None, None
         
-        # 处理不同的raw_results格式
-        precision = None
-        recall = None
-        
-        # 方式1: 如果是EvaluationResult对象，使用_scores_dict属性
-        if hasattr(raw_results, '_scores_dict') and raw_results._scores_dict:
-            # sample_id是1-based，需要转换为0-based索引
-            sample_index = sample_id - 1
-            
-            # 获取context_precision和context_recall的所有样本分数
-            precision_scores = raw_results._scores_dict.get('context_precision', [])
-            recall_scores = raw_results._scores_dict.get('context_recall', [])
-            
-            if (0 <= sample_index < len(precision_scores) and 
-                0 <= sample_index < len(recall_scores)):
-                
-                precision = precision_scores[sample_index]
-                recall = recall_scores[sample_index]
-        
-        # 方式2: 如果是字典格式，从scores字段中获取
-        elif isinstance(raw_results, dict) and 'scores' in raw_results:
-            scores = raw_results['scores']
-            
-            # 如果scores是DataFrame
-            if hasattr(scores, 'iloc'):
-                # sample_id是1-based，需要转换为0-based索引
-                sample_index = sample_id - 1
-                
-                if (0 <= sample_index < len(scores) and 
-                    'context_precision' in scores.columns and 
-                    'context_recall' in scores.columns):
-                    
-                    precision = scores.iloc[sample_index]['context_precision']
-                    recall = scores.iloc[sample_index]['context_recall']
-            
-            # 如果scores是列表格式（每个元素是一个字典）
-            elif isinstance(scores, list):
-                # sample_id是1-based，需要转换为0-based索引
-                sample_index = sample_id - 1
-                
-                if (0 <= sample_index < len(scores) and 
-                    isinstance(scores[sample_index], dict)):
-                    
-                    sample_scores = scores[sample_index]
-                    precision = sample_scores.get('context_precision')
-                    recall = sample_scores.get('context_recall')
+        precision = row.get('context_precision')
+        recall = row.get('context_recall')
         
         # 检查分数是否有效（不是NaN或None）
-        if (precision is not None and not (isinstance(precision, float) and str(precision) == 'nan') and
-            recall is not None and not (isinstance(recall, float) and str(recall) == 'nan')):
-            return float(precision), float(recall)
-        
-        return None, None
+        if precision is None or recall is None or pd.isna(precision) or pd.isna(recall):
+            return None, None
+        return float(precision), float(recall)
         
     except Exception as e:
         info_print(f"获取样本{sample_id}的RAGAS分数时出错: {e}")
@@ -910,7 +1170,7 @@ def generate_sample_description(user_input, precision, recall, relevant_count, i
 @app.get("/api/ragas/details", response_model=EvaluationResponse)
 async def get_ragas_details():
     """获取Ragas评估详情"""
-    global ragas_results
+    ragas_results = _get_results("ragas")
     
     # 检查是否有评估结果
     if not ragas_results or not ragas_results.get('evaluation_completed', False):
@@ -958,90 +1218,41 @@ async def get_ragas_details():
         # 处理数据
         df = text_processor.parse_context_columns(df)
         
-        # 分析每个样本的分块情况
-        details = []
-        for idx, row in df.iterrows():
-            user_input = str(row['user_input']) if pd.notna(row['user_input']) else ""
-            retrieved_contexts = row['retrieved_contexts']
-            reference_contexts = row['reference_contexts']
-            
+        # 从环境变量读取相似度阈值
+        similarity_threshold = float(os.getenv("SIMILARITY_THRESHOLD", "0.5"))
+        
+        # 收集同时有检索分块和参考分块的样本
+        samples = []
+        for idx, user_input, retrieved_contexts, reference_contexts in zip(
+            df.index, df['user_input'], df['retrieved_contexts'], df['reference_contexts']
+        ):
             if not retrieved_contexts or not reference_contexts:
                 continue
-            
-            # 使用Ragas评估结果进行相关性分析
-            relevant_chunks = []
-            irrelevant_chunks = []
-            missed_chunks = []
-            
-            # 从环境变量读取相似度阈值
-            similarity_threshold = float(os.getenv("SIMILARITY_THRESHOLD", "0.5"))
-            
-            # 分析相关和不相关分块
-            for i, retrieved_chunk in enumerate(retrieved_contexts):
-                # 使用更智能的文本相似度计算
-                is_relevant = False
-                max_similarity = 0
-                best_ref_idx = -1
-                
-                for j, ref_chunk in enumerate(reference_contexts):
-                    # 计算文本相似度
-                    similarity = calculate_text_similarity(retrieved_chunk, ref_chunk)
-                    if similarity > max_similarity:
-                        max_similarity = similarity
-                        best_ref_idx = j
-                
-                # 如果相似度足够高，认为相关
-                if max_similarity > similarity_threshold:
-                    is_relevant = True
-                    relevant_chunks.append({
-                        'retrieved_chunk': retrieved_chunk,
-                        'reference_chunk': reference_contexts[best_ref_idx] if best_ref_idx >= 0 else "",
-                        'retrieved_idx': i,
-                        'reference_idx': best_ref_idx,
-                        'relevance_score': max_similarity
-                    })
-                else:
-                    irrelevant_chunks.append({
-                        'retrieved_chunk': retrieved_chunk,
-                        'retrieved_idx': i,
-                        'max_relevance': max_similarity
-                    })
-            
-            # 分析未召回分块
-            # 未召回分块 = reference_contexts中存在的分块，而retrieved_contexts中不存在的分块
-            matched_references = set()
-            for chunk in relevant_chunks:
-                if 'reference_idx' in chunk:
-                    matched_references.add(chunk['reference_idx'])
-            
-            for j, ref_chunk in enumerate(reference_contexts):
-                if j not in matched_references:
-                    # 找到该参考分块与所有检索分块的最大相似度
-                    max_similarity = 0
-                    best_retrieved_idx = -1
-                    for i, retrieved_chunk in enumerate(retrieved_contexts):
-                        similarity = calculate_text_similarity(retrieved_chunk, ref_chunk)
-                        if similarity > max_similarity:
-                            max_similarity = similarity
-                            best_retrieved_idx = i
-                    
-                    # 如果相似度低于阈值，认为是未召回的分块
-                    if max_similarity < similarity_threshold:
-                        missed_chunks.append({
-                            'reference_chunk': ref_chunk,
-                            'reference_idx': j,
-                            'best_retrieved_idx': best_retrieved_idx,
-                            'max_relevance': max_similarity
-                        })
-            
-            details.append({
-                'sample_id': len(details) + 1,
-                'row_index': idx + 1,
-                'user_input': user_input,
-                'relevant_chunks': relevant_chunks,
-                'irrelevant_chunks': irrelevant_chunks,
-                'missed_chunks': missed_chunks
-            })
+            user_input = str(user_input) if pd.notna(user_input) else ""
+            samples.append((idx, user_input, retrieved_contexts, reference_contexts))
+        
+        # 分析每个样本的分块情况：按块批量计算各样本的检索分块 × 参考分块相似度矩阵
+        # （块内所有分块一次性预处理，词/字符交集通过一次按样本分组的稀疏矩阵乘法得到，
+        # 与逐对调用calculate_text_similarity结果一致），分块处理限制峰值内存
+        details = []
+        for block_start in range(0, len(samples), _DETAIL_BLOCK_SIZE):
+            block = samples[block_start:block_start + _DETAIL_BLOCK_SIZE]
+            similarity_matrices = calculate_text_similarity_matrices(
+                [(list(retrieved), list(reference)) for _, _, retrieved, reference in block],
+                SEMANTIC_CONTAINMENT_THRESHOLD
+            )
+            for (idx, user_input, retrieved_contexts, reference_contexts), similarity_matrix in zip(block, similarity_matrices):
+                relevant_chunks, irrelevant_chunks, missed_chunks = _classify_sample_chunks(
+                    retrieved_contexts, reference_contexts, similarity_matrix, similarity_threshold
+                )
+                details.append({
+                    'sample_id': len(details) + 1,
+                    'row_index': idx + 1,
+                    'user_input': user_input,
+                    'relevant_chunks': relevant_chunks,
+                    'irrelevant_chunks': irrelevant_chunks,
+                    'missed_chunks': missed_chunks
+                })
         
         # 生成样本汇总分析
         sample_summary = generate_sample_summary(details, ragas_results)
@@ -1052,7 +1263,7 @@ async def get_ragas_details():
             data={
                 'details': details,
                 'sample_summary': sample_summary,
-                'ragas_raw_results': ragas_results.get('raw_results', None)
+                'ragas_raw_results': _ragas_raw_results_payload(ragas_results)
             }
         )
         
@@ -1118,6 +1329,7 @@ async def save_evaluation(request: SaveEvaluationRequest):
         
         # 获取对应的评估结果
         if request.evaluation_type == "BM25":
+            bm25_results = _get_results("bm25")
             if not bm25_results:
                 return SaveEvaluationResponse(
                     success=False,
@@ -1133,6 +1345,7 @@ async def save_evaluation(request: SaveEvaluationRequest):
                 results.setdefault('map', 0)
                 results.setdefault('ndcg', 0)
         else:  # RAGAS
+            ragas_results = _get_results("ragas")
             if not ragas_results:
                 return SaveEvaluationResponse(
                     success=False,
@@ -1189,7 +1402,7 @@ async def get_evaluation_history():
 @app.get("/api/ragas-status")
 async def get_ragas_status():
     """获取Ragas评估状态"""
-    global ragas_results
+    ragas_results = _get_results("ragas")
     
     try:
         if not ragas_results:
@@ -1433,6 +1646,11 @@ async def clear_cache():
     """清空所有缓存"""
     try:
         cleared_counts = clear_all_caches()
+        # 文本相似度的预处理缓存（进程内LRU缓存）
+        cleared_counts['similarity_cache'] = clear_similarity_cache()
+        # 已解析的数据集Excel文件
+        cleared_counts['dataset_cache'] = clear_dataset_cache()
+        cleared_counts['total'] += cleared_counts['similarity_cache'] + cleared_counts['dataset_cache']
         return EvaluationResponse(
             success=True,
             message=f"缓存已清空，共清除 {cleared_counts['total']} 项",
@@ -1584,6 +1802,8 @@ async def upload_document_api(file: UploadFile = File(...)):
             result = upload_document(temp_file_path, original_filename=file.filename)
             
             if result["success"]:
+                # 数据集已更新，清空评估结果缓存
+                get_eval_cache().clear()
                 return EvaluationResponse(
                     success=True,
                     message=result["message"],
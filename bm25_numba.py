@@ -0,0 +1,40 @@
+"""
+BM25评分的Numba加速内核
+可选依赖：未安装numba时NUMBA_AVAILABLE为False，BM25回退到NumPy实现
+
+功能：
+1. 在CSR词频矩阵的非零元素上单次遍历计算BM25分数
+2. 按文档并行（prange），不产生中间数组
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def score_csr(indptr, indices, data, query_weights, norm_inv, out):
+        """
+        计算查询对所有文档的BM25分数
+        每个词项的贡献按 weight - weight / (1 + tf * norm_inv) 计算，循环内只有一次除法
+        
+        Args:
+            indptr: CSR词频矩阵的行指针
+            indices: CSR词频矩阵的列索引（词表索引）
+            data: CSR词频矩阵的词频
+            query_weights: 词表长度的词项权重（查询中出现次数 * idf * (k1 + 1)，不在查询中的词为0）
+            norm_inv: 每个文档的长度归一化倒数 1 / (k1 * (1 - b + b * doc_len / avgdl))
+            out: 输出数组，长度为文档数
+        """
+        for d in prange(len(out)):
+            doc_norm_inv = norm_inv[d]
+            score = 0.0
+            for p in range(indptr[d], indptr[d + 1]):
+                weight = query_weights[indices[p]]
+                if weight != 0.0:
+                    score += weight - weight / (1.0 + data[p] * doc_norm_inv)
+            out[d] = score
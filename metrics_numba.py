@@ -0,0 +1,202 @@
+"""
+评估指标的Numba加速内核
+可选依赖：未安装numba时NUMBA_AVAILABLE为False，内核以纯Python方式执行（结果一致）
+
+功能：
+1. 批量计算多个查询的平均精度(AP)，按查询并行
+2. 为固定的检索分块数生成循环展开的AP内核（常见于固定top-k检索的数据集）
+3. 在相关性矩阵中查找最后一个相关的检索分块（MRR）
+4. 批量计算多个查询的DCG和IDCG（NDCG），按查询并行
+5. 查找两个文本的最长公共子串（子字符串匹配度）
+"""
+
+import numpy as np
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+def _average_precision_batch(max_relevance, offsets, threshold, ap_out):
+    """
+    批量计算平均精度(AP)，相关性判断与AP累加在同一次遍历中完成，不产生逐位置的中间数组
+    第q个查询的检索分块最大相关性为 max_relevance[offsets[q]:offsets[q + 1]]，位置按倒序计算（位置 = 分块数 - 下标）
+    
+    Args:
+        max_relevance: 所有查询的检索分块最大相关性（按查询拼接的一维数组）
+        offsets: 每个查询在max_relevance中的起始位置，长度为查询数 + 1
+        threshold: 相关性阈值（大于阈值视为相关）
+        ap_out: 输出，每个查询的平均精度
+    """
+    for q in prange(len(ap_out)):
+        start = offsets[q]
+        n = offsets[q + 1] - start
+        relevant_count = 0
+        precision_sum = 0.0
+        for i in range(n):
+            if max_relevance[start + i] > threshold:
+                relevant_count += 1
+                precision_sum += relevant_count / (n - i)
+        ap_out[q] = precision_sum / relevant_count if relevant_count > 0 else 0.0
+
+def _last_relevant_row(relevance_matrix, threshold):
+    """
+    从最后一行向前查找第一个存在相关性大于阈值的行（行内找到即停止）
+    
+    Args:
+        relevance_matrix: 相关性矩阵（检索分块 × 相关分块）
+        threshold: 相关性阈值
+        
+    Returns:
+        int: 行下标，没有相关行时为-1
+    """
+    for i in range(relevance_matrix.shape[0] - 1, -1, -1):
+        for j in range(relevance_matrix.shape[1]):
+            if relevance_matrix[i, j] > threshold:
+                return i
+    return -1
+
+def _dcg_batch(gains, discounts, ideal_discounts, offsets, contributions_out, dcg_out, idcg_out):
+    """
+    批量计算DCG贡献、DCG和IDCG，第q个查询的数据为 [offsets[q], offsets[q + 1]) 区间
+    按位置顺序逐项累加（与np.cumsum的顺序一致，结果相同）；未使用fastmath，保证与NumPy逐样本计算的结果完全一致
+    
+    Args:
+        gains: 所有查询的增益（按查询拼接的一维数组）
+        discounts: 与gains对应的折损（倒序位置）
+        ideal_discounts: 理想排序的折损表，ideal_discounts[k]为位置k + 1的折损
+        offsets: 每个查询的起始位置，长度为查询数 + 1
+        contributions_out: 输出，每个位置的DCG贡献
+        dcg_out: 输出，每个查询的DCG
+        idcg_out: 输出，每个查询的IDCG
+    """
+    for q in prange(len(dcg_out)):
+        start = offsets[q]
+        end = offsets[q + 1]
+        dcg = 0.0
+        has_gain = False
+        for i in range(start, end):
+            contribution = gains[i] / discounts[i]
+            contributions_out[i] = contribution
+            dcg += contribution
+            if gains[i] != 0.0:
+                has_gain = True
+        dcg_out[q] = dcg
+        
+        # 没有相关分块（增益全为0）时IDCG为0，跳过排序
+        if not has_gain:
+            idcg_out[q] = 0.0
+            continue
+        
+        # 理想排序：增益降序排列
+        ideal_gains = np.sort(gains[start:end])
+        n = end - start
+        idcg = 0.0
+        for i in range(n):
+            idcg += ideal_gains[n - 1 - i] / ideal_discounts[i]
+        idcg_out[q] = idcg
+
+def _longest_common_substring(shorter, longer_order, sorted_longer, last_start):
+    """
+    查找较短文本中起点不晚于last_start、且出现在较长文本中的最长子串长度
+    文本以Unicode码点数组表示；较长文本预先排序，逐个字符二分查找其在较长文本中的出现位置，
+    按对角线（较长文本位置 - 较短文本位置）累计连续匹配长度，只遍历实际匹配的字符对
+    
+    Args:
+        shorter: 较短文本的码点数组
+        longer_order: 较长文本码点的稳定排序下标（argsort结果）
+        sorted_longer: 排序后的较长文本码点数组
+        last_start: 允许的最晚子串起点
+        
+    Returns:
+        int: 最长匹配子串的长度
+    """
+    n = len(shorter)
+    m = len(sorted_longer)
+    # 每条对角线上的当前连续匹配长度，以及最近一次匹配所在的较短文本位置
+    run = np.zeros(n + m, dtype=np.int64)
+    last_row = np.full(n + m, -2, dtype=np.int64)
+    best = 0
+    for i in range(n):
+        c = shorter[i]
+        k = np.searchsorted(sorted_longer, c)
+        while k < m and sorted_longer[k] == c:
+            d = longer_order[k] - i + n - 1
+            if last_row[d] == i - 1:
+                run[d] += 1
+            else:
+                run[d] = 1
+            last_row[d] = i
+            # 匹配起点为 i + 1 - run[d]，起点越早匹配越长，因此只需检查以当前位置结尾的最长匹配
+            if run[d] > best and i + 1 - run[d] <= last_start:
+                best = run[d]
+            k += 1
+    return best
+
+if NUMBA_AVAILABLE:
+    average_precision_batch = njit(parallel=True, cache=True)(_average_precision_batch)
+    last_relevant_row = njit(cache=True)(_last_relevant_row)
+    dcg_batch = njit(parallel=True, cache=True)(_dcg_batch)
+    longest_common_substring = njit(cache=True)(_longest_common_substring)
+else:
+    average_precision_batch = _average_precision_batch
+    last_relevant_row = _last_relevant_row
+    dcg_batch = _dcg_batch
+    longest_common_substring = _longest_common_substring
+
+# 循环展开的最大检索分块数，超过时展开后的代码过长，使用通用内核
+MAX_UNROLLED_LENGTH = 64
+
+# 已生成的固定长度内核：检索分块数 -> 内核
+_fixed_length_kernels = {}
+
+def _make_fixed_length_source(k):
+    """
+    生成检索分块数固定为k时的AP内核源码（逐位置展开，位置 = k - 下标为常量）
+    
+    Args:
+        k: 每个查询的检索分块数
+        
+    Returns:
+        str: 内核函数源码
+    """
+    lines = [
+        "def _average_precision_fixed(max_relevance, threshold, ap_out):",
+        "    for q in prange(len(ap_out)):",
+        f"        start = q * {k}",
+        "        relevant_count = 0",
+        "        precision_sum = 0.0",
+    ]
+    for i in range(k):
+        lines += [
+            f"        if max_relevance[start + {i}] > threshold:",
+            "            relevant_count += 1",
+            f"            precision_sum += relevant_count / {k - i}",
+        ]
+    lines.append("        ap_out[q] = precision_sum / relevant_count if relevant_count > 0 else 0.0")
+    return "\n".join(lines) + "\n"
+
+def get_fixed_length_kernel(k):
+    """
+    获取检索分块数固定为k时的AP内核（首次使用时生成并编译，之后复用）
+    内核参数为 (max_relevance, threshold, ap_out)，第q个查询的最大相关性为 max_relevance[q * k:(q + 1) * k]，
+    计算顺序与_average_precision_batch一致，结果相同
+    
+    Args:
+        k: 每个查询的检索分块数（1 ~ MAX_UNROLLED_LENGTH）
+        
+    Returns:
+        Callable: AP内核
+    """
+    kernel = _fixed_length_kernels.get(k)
+    if kernel is None:
+        namespace = {'prange': prange}
+        exec(_make_fixed_length_source(k), namespace)
+        kernel = namespace['_average_precision_fixed']
+        if NUMBA_AVAILABLE:
+            # exec生成的函数没有源文件，不能使用cache=True
+            kernel = njit(parallel=True)(kernel)
+        _fixed_length_kernels[k] = kernel
+    return kernel
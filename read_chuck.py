@@ -15,6 +15,13 @@ import re
 from typing import Dict, List, Optional, Any, Tuple
 from config import debug_print, verbose_print, info_print, error_print, QUIET_MODE
 from dataclasses import dataclass
+from functools import lru_cache
+
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
 
 @dataclass
 class EvaluationConfig:
@@ -40,6 +47,9 @@ class EvaluationConfig:
     # 性能优化参数
     max_workers: int = 16  # 最大并发工作线程数，提升评估速度
     batch_size: int = 10  # 批处理大小，减少 API 调用次数
+    parallel: bool = True  # 本地指标（BM25/MAP/MRR/NDCG）按样本多进程并行计算，调试时可设为False走串行路径
+    collect_details: bool = False  # 是否在MAP详细结果中保存每个检索分块的相关性数组（chunk_relevance_scores），生产运行时关闭以节省内存
+    score_cache_path: str = None  # 持久化评分缓存（SQLite）文件路径，跨运行复用MAP的相关性计算结果；为空时不启用
     
     # 文件配置
     excel_file_path: str = None
@@ -56,6 +66,52 @@ class EvaluationConfig:
             ]
         if self.excel_file_path is None:
             self.excel_file_path = os.getenv("EXCEL_FILE_PATH", "standardDataset/standardDataset.xlsx")
+        if self.score_cache_path is None:
+            self.score_cache_path = os.getenv("SCORE_CACHE_PATH", "")
+
+@lru_cache(maxsize=16)
+def _read_excel_cached(path: str, mtime_ns: int, size: int, columns: Tuple[str, ...]) -> pd.DataFrame:
+    """
+    读取Excel文件（按路径、修改时间和文件大小缓存，文件被修改后自动重新读取）
+    
+    Args:
+        path: 文件绝对路径
+        mtime_ns: 文件修改时间（纳秒）
+        size: 文件大小
+        columns: 读取的列
+        
+    Returns:
+        pd.DataFrame: 读取的数据（缓存对象，调用方需复制后使用）
+    """
+    # python-calamine（Rust实现）解析速度远快于openpyxl，未安装时使用pandas默认引擎
+    engine = 'calamine' if CALAMINE_AVAILABLE else None
+    return pd.read_excel(path, usecols=list(columns), engine=engine)
+
+def load_dataset_cached(path: str, columns: List[str]) -> pd.DataFrame:
+    """
+    读取数据集Excel文件，同一文件在进程内只解析一次（各评估接口共享）
+    
+    Args:
+        path: 文件路径
+        columns: 读取的列
+        
+    Returns:
+        pd.DataFrame: 数据副本，调用方可以自由修改
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return _read_excel_cached(path, stat.st_mtime_ns, stat.st_size, tuple(columns)).copy()
+
+def clear_dataset_cache() -> int:
+    """
+    清空数据集读取缓存
+    
+    Returns:
+        int: 清除的缓存项数
+    """
+    count = _read_excel_cached.cache_info().currsize
+    _read_excel_cached.cache_clear()
+    return count
 
 class DataLoader:
     """数据加载和解析模块"""
@@ -77,11 +133,8 @@ class DataLoader:
             return None
         
         try:
-            # 只读取指定的列
-            df = pd.read_excel(
-                self.config.excel_file_path, 
-                usecols=self.config.required_columns
-            )
+            # 只读取指定的列（同一文件未修改时复用已解析的数据）
+            df = load_dataset_cached(self.config.excel_file_path, self.config.required_columns)
             info_print(f"✅ 成功读取 {len(df)} 行数据")
             info_print(f"📋 列名: {list(df.columns)}")
             return df
@@ -0,0 +1,144 @@
+"""
+持久化评分缓存模块
+用于在多次评估运行之间复用相关性计算结果（如调整阈值、反复调试同一数据集）
+
+功能：
+1. 基于SQLite保存评分结果，进程退出后仍然有效
+2. 键为输入内容的哈希，内容变化自动失效；命名空间区分评分方式和参数
+3. 值以二进制保存NumPy数组，读取结果与重新计算完全一致
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Tuple
+import numpy as np
+from config import info_print
+
+class ScoreCache:
+    """基于SQLite的持久化评分缓存"""
+    
+    def __init__(self, db_path: str, namespace: str):
+        """
+        初始化缓存（数据库文件及所在目录不存在时自动创建）
+        
+        Args:
+            db_path: SQLite数据库文件路径
+            namespace: 命名空间（包含评分方式和影响结果的参数，参数变化时使用新的命名空间）
+        """
+        self.db_path = db_path
+        self.namespace = namespace
+        self.hit_count = 0
+        self.miss_count = 0
+        self._lock = threading.Lock()
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "namespace TEXT NOT NULL, key BLOB NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        info_print(f"💾 评分缓存: {db_path} ({namespace})")
+    
+    @staticmethod
+    def make_key(*parts: str) -> bytes:
+        """
+        根据输入内容生成缓存键
+        
+        Args:
+            *parts: 参与计算的文本
+        
+        Returns:
+            bytes: 16字节的BLAKE2b摘要
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        for part in parts:
+            data = part.encode('utf-8')
+            # 写入长度前缀，避免不同的切分方式拼出相同的字节串
+            digest.update(len(data).to_bytes(8, 'little'))
+            digest.update(data)
+        return digest.digest()
+    
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, bytes]:
+        """
+        批量读取缓存
+        
+        Args:
+            keys: 缓存键列表
+        
+        Returns:
+            Dict[bytes, bytes]: 命中的缓存键 -> 值
+        """
+        found = {}
+        with self._lock:
+            # SQLite单条语句的参数个数有限，分批查询
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, value FROM scores WHERE namespace = ? AND key IN ({placeholders})",
+                    [self.namespace, *batch]
+                ).fetchall()
+                found.update(rows)
+        
+        self.hit_count += len(found)
+        self.miss_count += len(keys) - len(found)
+        return found
+    
+    def put_many(self, items: List[Tuple[bytes, bytes]]) -> None:
+        """
+        批量写入缓存（单个事务）
+        
+        Args:
+            items: (缓存键, 值) 列表
+        """
+        if not items:
+            return
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO scores (namespace, key, value) VALUES (?, ?, ?)",
+                [(self.namespace, key, value) for key, value in items]
+            )
+            self._conn.commit()
+    
+    def close(self) -> None:
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+def pack_arrays(*arrays: np.ndarray) -> bytes:
+    """
+    将多个一维数组打包为二进制（int64或float64，读取时按打包顺序给出dtype）
+    
+    Args:
+        *arrays: 一维数组
+    
+    Returns:
+        bytes: 二进制数据（先写入各数组长度，再依次写入数组内容）
+    """
+    lengths = np.array([len(array) for array in arrays], dtype=np.int64)
+    return lengths.tobytes() + b"".join(np.ascontiguousarray(array).tobytes() for array in arrays)
+
+def unpack_arrays(data: bytes, dtypes: List[type]) -> List[np.ndarray]:
+    """
+    解包pack_arrays生成的二进制数据
+    
+    Args:
+        data: 二进制数据
+        dtypes: 每个数组的dtype（与打包时一致）
+    
+    Returns:
+        List[np.ndarray]: 数组列表
+    """
+    lengths = np.frombuffer(data, dtype=np.int64, count=len(dtypes))
+    offset = lengths.nbytes
+    arrays = []
+    for length, dtype in zip(lengths.tolist(), dtypes):
+        array = np.frombuffer(data, dtype=dtype, count=length, offset=offset).copy()
+        offset += array.nbytes
+        arrays.append(array)
+    return arrays
@@ -2,12 +2,96 @@
 文本相似度计算模块
 """
 
-import re
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import numpy as np
+from scipy import sparse
+
+from metrics_numba import NUMBA_AVAILABLE, longest_common_substring
+
+class _CleanTable(dict):
+    """
+    文本清理的字符转换表（供str.translate使用）：与正则 [^\w\s\u4e00-\u9fff] 相同，
+    保留字母、数字、下划线、空白和中文，其余字符替换为空格；按码点首次出现时计算并缓存
+    """
+    
+    def __missing__(self, codepoint: int) -> int:
+        char = chr(codepoint)
+        keep = char.isalnum() or char == '_' or char.isspace() or 0x4E00 <= codepoint <= 0x9FFF
+        value = codepoint if keep else 0x20
+        self[codepoint] = value
+        return value
+
+_CLEAN_TABLE = _CleanTable()
+
+def clean_text(text: str) -> str:
+    """
+    清理文本：移除标点符号和特殊字符（保留中文、英文、数字），合并多余空格并转换为小写
+    使用str.translate逐码点查表替换，比正则引擎快
+    
+    Args:
+        text: 输入文本
+    
+    Returns:
+        str: 清理后的文本
+    """
+    # split()按任意空白分割并去掉首尾空白，join后等价于合并多余空格再strip
+    return ' '.join(text.translate(_CLEAN_TABLE).split()).lower()
+
+@lru_cache(maxsize=100_000)
+def _codepoints(clean_text: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    将已清理文本转换为Unicode码点数组，并预先排序（供最长公共子串内核使用）
+    
+    Args:
+        clean_text: 已清理文本
+    
+    Returns:
+        Tuple[np.ndarray, np.ndarray, np.ndarray]: (码点数组, 稳定排序下标, 排序后的码点数组)
+    """
+    codes = np.frombuffer(clean_text.encode('utf-32-le'), dtype=np.uint32)
+    order = np.argsort(codes, kind='stable')
+    return codes, order, codes[order]
+
+def calculate_substring_similarity(clean_text1: str, clean_text2: str) -> float:
+    """
+    计算两个已清理文本的子字符串匹配度
+    部分匹配取较短文本中（起点不晚于倒数第6个字符的）长度至少为5、且出现在较长文本中的最长子串
+    
+    Args:
+        clean_text1: 第一个已清理文本
+        clean_text2: 第二个已清理文本
+    
+    Returns:
+        float: 子字符串匹配度 (0-1)
+    """
+    if len(clean_text1) <= 10 or len(clean_text2) <= 10:
+        return 0.0
+    
+    # 检查较短的文本是否包含在较长的文本中
+    shorter, longer = (clean_text1, clean_text2) if len(clean_text1) < len(clean_text2) else (clean_text2, clean_text1)
+    if shorter in longer:
+        return len(shorter) / len(longer)
+    
+    if NUMBA_AVAILABLE:
+        # Numba内核只遍历两个文本中字符相同的位置对（码点数组按文本缓存）
+        longer_codes = _codepoints(longer)
+        best = longest_common_substring(_codepoints(shorter)[0], longer_codes[1], longer_codes[2], len(shorter) - 6)
+    else:
+        # 检查部分匹配：某个起点的子串出现在较长文本中时，它的所有前缀也都出现，
+        # 因此每个起点只需检查能否比当前最长匹配再长1个字符，总共只做O(n)次子串查找
+        best = 4  # 至少5个字符的匹配
+        for i in range(len(shorter) - 5):
+            while i + best < len(shorter) and shorter[i:i + best + 1] in longer:
+                best += 1
+    max_match = best if best >= 5 else 0
+    return max_match / len(longer) if longer else 0.0
 
 def calculate_text_similarity(text1: str, text2: str) -> float:
     """
     计算两个文本的相似度
-    使用Jaccard相似度和字符重叠度
+    使用Jaccard相似度和字符重叠度（文本的清理与分词结果按文本缓存，见prepare_text）
     
     Args:
         text1: 第一个文本
@@ -16,76 +100,454 @@ def calculate_text_similarity(text1: str, text2: str) -> float:
     Returns:
         float: 相似度分数 (0-1)
     """
-    if not text1 or not text2:
-        return 0.0
+    return calculate_text_similarity_from_prepared(prepare_text(text1), prepare_text(text2))
+
+@lru_cache(maxsize=100_000)
+def prepare_text(text: str) -> Tuple[str, frozenset, frozenset]:
+    """
+    清理单个文本并提取词集合与字符集合（按文本缓存，同一分块在各行、各矩阵间只处理一次）
     
-    # 清理文本：移除标点符号，转换为小写
-    def clean_text(text):
-        # 移除标点符号和特殊字符，保留中文、英文、数字
-        cleaned = re.sub(r'[^\w\s\u4e00-\u9fff]', ' ', text)
-        # 移除多余空格
-        cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-        return cleaned.lower()
+    Args:
+        text: 输入文本
     
-    clean_text1 = clean_text(text1)
-    clean_text2 = clean_text(text2)
+    Returns:
+        Tuple[str, frozenset, frozenset]: (清理后文本, 词集合, 字符集合)
+    """
+    if text:
+        cleaned = clean_text(text)
+    else:
+        cleaned = ""
+    return cleaned, frozenset(cleaned.split()), frozenset(cleaned)
+
+def clear_similarity_cache() -> int:
+    """
+    清空文本相似度的预处理缓存（清理后文本与词/字符集合、子串匹配用的码点数组）
     
-    # 1. Jaccard相似度（基于词）
-    words1 = set(clean_text1.split())
-    words2 = set(clean_text2.split())
+    Returns:
+        int: 清除的缓存项数
+    """
+    count = prepare_text.cache_info().currsize + _codepoints.cache_info().currsize
+    prepare_text.cache_clear()
+    _codepoints.cache_clear()
+    return count
+
+def get_word_set(text: str) -> frozenset:
+    """
+    获取文本清理后的词集合
+    
+    Args:
+        text: 输入文本
+    
+    Returns:
+        frozenset: 词集合
+    """
+    return prepare_text(text)[1]
+
+def calculate_text_similarity_from_prepared(prepared1: Tuple[str, frozenset, frozenset],
+                                            prepared2: Tuple[str, frozenset, frozenset],
+                                            semantic_containment_threshold: Optional[float] = None) -> float:
+    """
+    基于prepare_text的预处理结果计算两个文本的相似度（不再重复清理和分词）
+    结果与calculate_text_similarity一致；传入semantic_containment_threshold时
+    额外应用语义包含度奖励（与app.py中的calculate_text_similarity一致）
+    
+    Args:
+        prepared1: 第一个文本的预处理结果
+        prepared2: 第二个文本的预处理结果
+        semantic_containment_threshold: 语义包含阈值，None表示不启用语义包含度奖励
+    
+    Returns:
+        float: 相似度分数 (0-1)
+    """
+    clean_text1, words1, chars1 = prepared1
+    clean_text2, words2, chars2 = prepared2
     
     if not words1 or not words2:
         return 0.0
     
-    intersection = len(words1.intersection(words2))
-    union = len(words1.union(words2))
-    jaccard_similarity = intersection / union if union > 0 else 0.0
+    if clean_text1 == clean_text2:
+        # 清理后文本相同：Jaccard相似度与字符重叠度均为1，子字符串匹配度为1（长度超过10时），
+        # 语义包含度为1；无需集合运算和子串搜索，结果与下面的一般计算一致
+        final_similarity = 0.4 + 0.3 + (0.3 if len(clean_text1) > 10 else 0.0)
+        if semantic_containment_threshold is None:
+            return final_similarity
+        if 1.0 >= semantic_containment_threshold:
+            final_similarity = max(final_similarity, 0.95)
+        return min(final_similarity, 1.0)
+    
+    # 1. Jaccard相似度（基于词）
+    intersection = len(words1 & words2)
+    jaccard_similarity = intersection / len(words1 | words2)
     
     # 2. 字符重叠度（基于字符）
-    chars1 = set(clean_text1)
-    chars2 = set(clean_text2)
-    char_intersection = len(chars1.intersection(chars2))
-    char_union = len(chars1.union(chars2))
-    char_similarity = char_intersection / char_union if char_union > 0 else 0.0
+    char_union = len(chars1 | chars2)
+    char_similarity = len(chars1 & chars2) / char_union if char_union > 0 else 0.0
     
     # 3. 子字符串匹配度
-    substring_similarity = 0.0
-    if len(clean_text1) > 10 and len(clean_text2) > 10:
-        # 检查较短的文本是否包含在较长的文本中
-        shorter, longer = (clean_text1, clean_text2) if len(clean_text1) < len(clean_text2) else (clean_text2, clean_text1)
-        if shorter in longer:
-            substring_similarity = len(shorter) / len(longer)
-        else:
-            # 检查部分匹配
-            max_match = 0
-            for i in range(len(shorter) - 5):  # 至少5个字符的匹配
-                for j in range(i + 5, len(shorter) + 1):
-                    substring = shorter[i:j]
-                    if substring in longer:
-                        max_match = max(max_match, len(substring))
-            substring_similarity = max_match / len(longer) if longer else 0.0
+    substring_similarity = calculate_substring_similarity(clean_text1, clean_text2)
     
     # 综合相似度：加权平均
-    final_similarity = (
-        jaccard_similarity * 0.4 +      # 词级别相似度权重40%
-        char_similarity * 0.3 +         # 字符级别相似度权重30%
-        substring_similarity * 0.3      # 子字符串匹配度权重30%
-    )
+    final_similarity = jaccard_similarity * 0.4 + char_similarity * 0.3 + substring_similarity * 0.3
     
-    # 优化：如果短文本完全包含在长文本中，给予更高的相似度
-    # 这是为了处理"检索分块包含标准答案分块"的场景
+    # 短文本完全包含在长文本中，给予0.8的相似度
     if len(clean_text1) > len(clean_text2):
-        # text1是长文本，text2是短文本
         if clean_text2 in clean_text1:
-            # 短文本完全包含在长文本中，给予包含度奖励
-            # 使用更高的相似度分数，确保能通过阈值
-            containment_similarity = 0.8  # 固定给予0.8的相似度
-            final_similarity = max(final_similarity, containment_similarity)
+            final_similarity = max(final_similarity, 0.8)
     elif len(clean_text2) > len(clean_text1):
-        # text2是长文本，text1是短文本
         if clean_text1 in clean_text2:
-            # 短文本完全包含在长文本中，给予包含度奖励
-            containment_similarity = 0.8  # 固定给予0.8的相似度
-            final_similarity = max(final_similarity, containment_similarity)
+            final_similarity = max(final_similarity, 0.8)
+    
+    if semantic_containment_threshold is None:
+        return final_similarity
+    
+    # 语义包含度超过阈值，给予高相似度分数（最高0.95）
+    semantic_containment = intersection / min(len(words1), len(words2))
+    if semantic_containment >= semantic_containment_threshold:
+        final_similarity = max(final_similarity, min(semantic_containment, 0.95))
+    
+    return min(final_similarity, 1.0)
+
+def _prepare_texts(texts: List[str]) -> Tuple[List[str], List[frozenset], List[frozenset]]:
+    """
+    批量清理文本并提取词集合与字符集合（每个文本只处理一次）
+    
+    Args:
+        texts: 文本列表
+    
+    Returns:
+        Tuple[List[str], List[frozenset], List[frozenset]]: (清理后文本, 词集合, 字符集合)
+    """
+    prepared = [prepare_text(text) for text in texts]
+    cleaned_texts = [item[0] for item in prepared]
+    word_sets = [item[1] for item in prepared]
+    char_sets = [item[2] for item in prepared]
+    return cleaned_texts, word_sets, char_sets
+
+def _overlap_counts(sets1: List[frozenset], sets2: List[frozenset], groups1: Optional[List[int]] = None,
+                    groups2: Optional[List[int]] = None) -> Tuple[sparse.csr_matrix, np.ndarray, np.ndarray]:
+    """
+    使用稀疏指示矩阵计算两组集合的两两交集大小
+    
+    Args:
+        sets1: 第一组token集合
+        sets2: 第二组token集合
+        groups1: 第一组每个集合所属的分组编号（可选）
+        groups2: 第二组每个集合所属的分组编号（可选，给定时词表按(分组, token)编号，只有同组集合的交集非零）
+    
+    Returns:
+        Tuple[sparse.csr_matrix, np.ndarray, np.ndarray]: (交集大小稀疏矩阵, 第一组集合大小, 第二组集合大小)
+    """
+    vocab = {}
+    if groups1 is None or groups2 is None:
+        rows1 = [[vocab.setdefault(token, len(vocab)) for token in token_set] for token_set in sets1]
+        rows2 = [[vocab.setdefault(token, len(vocab)) for token in token_set] for token_set in sets2]
+    else:
+        rows1 = [[vocab.setdefault((group, token), len(vocab)) for token in token_set] for token_set, group in zip(sets1, groups1)]
+        rows2 = [[vocab.setdefault((group, token), len(vocab)) for token in token_set] for token_set, group in zip(sets2, groups2)]
+    
+    def indicator_matrix(rows):
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(row) for row in rows])
+        indices = np.fromiter((idx for row in rows for idx in row), dtype=np.int64, count=int(indptr[-1]))
+        # 指示矩阵只含0/1，交集大小是整数计数，float32在2^24以内精确表示，比float64少一半内存带宽
+        data = np.ones(len(indices), dtype=np.float32)
+        return sparse.csr_matrix((data, indices, indptr), shape=(len(rows), max(len(vocab), 1)))
+    
+    matrix1 = indicator_matrix(rows1)
+    matrix2 = indicator_matrix(rows2)
+    intersection = (matrix1 @ matrix2.T).tocsr()
+    # 集合大小即每行非零元素个数
+    sizes1 = np.diff(matrix1.indptr).astype(np.float64)
+    sizes2 = np.diff(matrix2.indptr).astype(np.float64)
+    return intersection, sizes1, sizes2
+
+def calculate_text_similarity_matrix(texts1: List[str], texts2: List[str],
+                                     semantic_containment_threshold: Optional[float] = None) -> np.ndarray:
+    """
+    批量计算两组文本的两两相似度矩阵
+    结果与逐对调用calculate_text_similarity一致；传入semantic_containment_threshold时
+    额外应用语义包含度奖励（与app.py中的calculate_text_similarity一致）
+    
+    Args:
+        texts1: 第一组文本（矩阵的行）
+        texts2: 第二组文本（矩阵的列）
+        semantic_containment_threshold: 语义包含阈值，None表示不启用语义包含度奖励
+    
+    Returns:
+        np.ndarray: 形状为(len(texts1), len(texts2))的相似度矩阵
+    """
+    if not texts1 or not texts2:
+        return np.zeros((len(texts1), len(texts2)), dtype=np.float64)
+    
+    clean_texts1, words1, chars1 = _prepare_texts(texts1)
+    clean_texts2, words2, chars2 = _prepare_texts(texts2)
+    
+    word_intersection, word_sizes1, word_sizes2 = _overlap_counts(words1, words2)
+    char_intersection, char_sizes1, char_sizes2 = _overlap_counts(chars1, chars2)
+    
+    return _similarity_from_overlaps(
+        clean_texts1, clean_texts2,
+        word_intersection.toarray(), word_sizes1, word_sizes2,
+        char_intersection.toarray(), char_sizes1, char_sizes2,
+        semantic_containment_threshold
+    )
+
+def calculate_text_similarity_matrices(text_pairs: List[Tuple[List[str], List[str]]],
+                                       semantic_containment_threshold: Optional[float] = None) -> List[np.ndarray]:
+    """
+    批量计算多组文本对的相似度矩阵（如数据集中每个样本的检索分块 × 参考分块）
+    所有样本的文本一次性预处理，词/字符交集通过一次按样本分组的稀疏矩阵乘法得到，
+    结果与对每组分别调用calculate_text_similarity_matrix一致
+    
+    Args:
+        text_pairs: (第一组文本, 第二组文本) 列表
+        semantic_containment_threshold: 语义包含阈值，None表示不启用语义包含度奖励
+    
+    Returns:
+        List[np.ndarray]: 每组文本对的相似度矩阵
+    """
+    return _map_blocks(text_pairs, semantic_containment_threshold, _similarity_from_overlaps,
+                       lambda rows, cols: np.zeros((rows, cols), dtype=np.float64))
+
+def calculate_text_similarity_row_maxima(text_pairs: List[Tuple[List[str], List[str]]],
+                                         semantic_containment_threshold: Optional[float] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """
+    批量计算多组文本对中第一组每个文本的最大相似度及最相似文本的下标
+    只需要每行最大值时使用，子串搜索经MaxScore剪枝，结果与相似度矩阵的max(axis=1)/argmax(axis=1)一致
+    
+    Args:
+        text_pairs: (第一组文本, 第二组文本) 列表
+        semantic_containment_threshold: 语义包含阈值，None表示不启用语义包含度奖励
+    
+    Returns:
+        List[Tuple[np.ndarray, np.ndarray]]: 每组文本对的(每行最大相似度, 最大值所在的列下标)；第二组为空时两者均为空数组
+    """
+    return _map_blocks(text_pairs, semantic_containment_threshold, _row_maxima_from_overlaps,
+                       lambda rows, cols: (np.zeros(0, dtype=np.float64), np.zeros(0, dtype=np.int64)))
+
+def _map_blocks(text_pairs: List[Tuple[List[str], List[str]]], semantic_containment_threshold: Optional[float],
+                block_fn, empty_fn) -> list:
+    """
+    对多组文本对按样本分组计算词/字符交集（一次稀疏矩阵乘法），再对每组调用block_fn
+    
+    Args:
+        text_pairs: (第一组文本, 第二组文本) 列表
+        semantic_containment_threshold: 语义包含阈值
+        block_fn: 参数同_similarity_from_overlaps的分组计算函数
+        empty_fn: 任一组为空时的结果，参数为(第一组文本数, 第二组文本数)
+    
+    Returns:
+        list: 每组文本对的计算结果
+    """
+    texts1 = [text for texts, _ in text_pairs for text in texts]
+    texts2 = [text for _, texts in text_pairs for text in texts]
+    groups1 = [group for group, (texts, _) in enumerate(text_pairs) for _ in texts]
+    groups2 = [group for group, (_, texts) in enumerate(text_pairs) for _ in texts]
+    
+    clean_texts1, words1, chars1 = _prepare_texts(texts1)
+    clean_texts2, words2, chars2 = _prepare_texts(texts2)
+    
+    word_intersection, word_sizes1, word_sizes2 = _overlap_counts(words1, words2, groups1, groups2)
+    char_intersection, char_sizes1, char_sizes2 = _overlap_counts(chars1, chars2, groups1, groups2)
+    
+    results = []
+    row_start = col_start = 0
+    for pair_texts1, pair_texts2 in text_pairs:
+        row_end = row_start + len(pair_texts1)
+        col_end = col_start + len(pair_texts2)
+        if pair_texts1 and pair_texts2:
+            rows, cols = slice(row_start, row_end), slice(col_start, col_end)
+            results.append(block_fn(
+                clean_texts1[rows], clean_texts2[cols],
+                word_intersection[rows, cols].toarray(), word_sizes1[rows], word_sizes2[cols],
+                char_intersection[rows, cols].toarray(), char_sizes1[rows], char_sizes2[cols],
+                semantic_containment_threshold
+            ))
+        else:
+            results.append(empty_fn(len(pair_texts1), len(pair_texts2)))
+        row_start, col_start = row_end, col_end
+    return results
+
+def _similarity_components(clean_texts1: List[str], clean_texts2: List[str],
+                           word_intersection: np.ndarray, word_sizes1: np.ndarray, word_sizes2: np.ndarray,
+                           char_intersection: np.ndarray, char_sizes1: np.ndarray, char_sizes2: np.ndarray,
+                           semantic_containment_threshold: Optional[float]) -> Tuple[np.ndarray, ...]:
+    """
+    根据词/字符交集大小计算相似度的各组成部分（子串匹配度只给出上界，不做子串搜索）
+    
+    Args:
+        clean_texts1: 第一组清理后文本
+        clean_texts2: 第二组清理后文本
+        word_intersection: 词集合交集大小矩阵
+        word_sizes1: 第一组词集合大小
+        word_sizes2: 第二组词集合大小
+        char_intersection: 字符集合交集大小矩阵
+        char_sizes1: 第一组字符集合大小
+        char_sizes2: 第二组字符集合大小
+        semantic_containment_threshold: 语义包含阈值，None表示不启用语义包含度奖励
+    
+    Returns:
+        Tuple[np.ndarray, ...]: (基础分数, 奖励下限, 子串匹配度上界, 需要子串搜索的位置, 两侧都有词的位置)
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # 1. Jaccard相似度（基于词）
+        word_union = word_sizes1[:, None] + word_sizes2[None, :] - word_intersection
+        jaccard_similarity = np.where(word_union > 0, word_intersection / word_union, 0.0)
+        
+        # 2. 字符重叠度（基于字符）
+        char_union = char_sizes1[:, None] + char_sizes2[None, :] - char_intersection
+        char_similarity = np.where(char_union > 0, char_intersection / char_union, 0.0)
+        
+        # 语义包含度：较短词集合在较长词集合中的包含比例
+        semantic_containment = word_intersection / np.minimum(word_sizes1[:, None], word_sizes2[None, :])
+    
+    lengths1 = np.array([len(text) for text in clean_texts1], dtype=np.float64)
+    lengths2 = np.array([len(text) for text in clean_texts2], dtype=np.float64)
+    
+    # 完全包含检测：较短文本是较长文本的子串，则其字符集合必是较长文本字符集合的子集
+    # （字符交集大小等于较短文本的字符集合大小），先用交集矩阵向量化筛选，只对候选做字符串查找
+    first_longer = lengths1[:, None] > lengths2[None, :]
+    second_longer = lengths2[None, :] > lengths1[:, None]
+    may_contain = (
+        (first_longer & (char_intersection == char_sizes2[None, :])) |
+        (second_longer & (char_intersection == char_sizes1[:, None]))
+    )
+    is_contained = np.zeros(word_intersection.shape, dtype=bool)
+    for i, j in zip(*np.nonzero(may_contain)):
+        if first_longer[i, j]:
+            is_contained[i, j] = clean_texts2[j] in clean_texts1[i]
+        else:
+            is_contained[i, j] = clean_texts1[i] in clean_texts2[j]
+    
+    # 奖励分数下限：短文本完全包含在长文本中给予0.8；语义包含度超过阈值给予包含度（最高0.95）
+    bonus_floor = np.where(is_contained, 0.8, 0.0)
+    if semantic_containment_threshold is not None:
+        bonus_floor = np.where(
+            semantic_containment >= semantic_containment_threshold,
+            np.maximum(bonus_floor, np.minimum(semantic_containment, 0.95)),
+            bonus_floor
+        )
+    
+    # 3. 子字符串匹配度上界：不超过 较短文本长度/较长文本长度；若按该上界计算的加权分数仍不超过奖励下限，
+    # 最终结果必然由奖励下限决定，无需子串搜索（MaxScore式剪枝，结果不变）
+    with np.errstate(divide='ignore', invalid='ignore'):
+        substring_upper_bound = np.where(
+            (lengths1[:, None] > 10) & (lengths2[None, :] > 10),
+            np.minimum(lengths1[:, None], lengths2[None, :]) / np.maximum(lengths1[:, None], lengths2[None, :]),
+            0.0
+        )
+    base_similarity = jaccard_similarity * 0.4 + char_similarity * 0.3
+    has_words = (word_sizes1 > 0)[:, None] & (word_sizes2 > 0)[None, :]
+    needs_substring = has_words & (substring_upper_bound > 0) & (base_similarity + substring_upper_bound * 0.3 > bonus_floor)
+    return base_similarity, bonus_floor, substring_upper_bound, needs_substring, has_words
+
+def _combine_similarity(base_similarity: np.ndarray, substring_similarity: np.ndarray, bonus_floor: np.ndarray,
+                        has_words: np.ndarray, semantic_containment_threshold: Optional[float]) -> np.ndarray:
+    """
+    合成综合相似度：加权平均，再应用奖励下限（对子串匹配度单调不减）
+    
+    Args:
+        base_similarity: 基础分数（Jaccard * 0.4 + 字符重叠度 * 0.3）
+        substring_similarity: 子串匹配度
+        bonus_floor: 奖励下限
+        has_words: 两侧都有词的位置
+        semantic_containment_threshold: 语义包含阈值，None表示不启用语义包含度奖励
+    
+    Returns:
+        np.ndarray: 相似度
+    """
+    similarity = np.maximum(base_similarity + substring_similarity * 0.3, bonus_floor)
+    if semantic_containment_threshold is not None:
+        similarity = np.minimum(similarity, 1.0)
+    
+    # 任一文本清理后没有词，相似度为0
+    return np.where(has_words, similarity, 0.0)
+
+def _similarity_from_overlaps(clean_texts1: List[str], clean_texts2: List[str],
+                              word_intersection: np.ndarray, word_sizes1: np.ndarray, word_sizes2: np.ndarray,
+                              char_intersection: np.ndarray, char_sizes1: np.ndarray, char_sizes2: np.ndarray,
+                              semantic_containment_threshold: Optional[float]) -> np.ndarray:
+    """
+    根据词/字符交集大小计算相似度矩阵（参数见_similarity_components）
+    
+    Returns:
+        np.ndarray: 相似度矩阵
+    """
+    base_similarity, bonus_floor, _, needs_substring, has_words = _similarity_components(
+        clean_texts1, clean_texts2, word_intersection, word_sizes1, word_sizes2,
+        char_intersection, char_sizes1, char_sizes2, semantic_containment_threshold
+    )
+    
+    # 子字符串匹配度（逐对计算，开销最大）
+    substring_similarity = np.zeros(word_intersection.shape, dtype=np.float64)
+    for i, j in zip(*np.nonzero(needs_substring)):
+        substring_similarity[i, j] = calculate_substring_similarity(clean_texts1[i], clean_texts2[j])
+    
+    return _combine_similarity(base_similarity, substring_similarity, bonus_floor, has_words, semantic_containment_threshold)
+
+def _row_maxima_from_overlaps(clean_texts1: List[str], clean_texts2: List[str],
+                              word_intersection: np.ndarray, word_sizes1: np.ndarray, word_sizes2: np.ndarray,
+                              char_intersection: np.ndarray, char_sizes1: np.ndarray, char_sizes2: np.ndarray,
+                              semantic_containment_threshold: Optional[float]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    根据词/字符交集大小计算每行的最大相似度及其下标（参数见_similarity_components）
+    MaxScore剪枝：每行按分数上界从高到低做子串搜索，剩余候选的上界低于当前最大值时提前结束，
+    结果与相似度矩阵的max(axis=1)/argmax(axis=1)一致
+    
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: (每行最大相似度, 最大值所在的列下标)
+    """
+    base_similarity, bonus_floor, substring_upper_bound, needs_substring, has_words = _similarity_components(
+        clean_texts1, clean_texts2, word_intersection, word_sizes1, word_sizes2,
+        char_intersection, char_sizes1, char_sizes2, semantic_containment_threshold
+    )
+    
+    # 不做子串搜索时的分数（下界）与按子串匹配度上界计算的分数（上界）
+    similarity = _combine_similarity(base_similarity, np.zeros_like(base_similarity), bonus_floor, has_words,
+                                     semantic_containment_threshold)
+    upper_bound = _combine_similarity(base_similarity, substring_upper_bound, bonus_floor, has_words,
+                                      semantic_containment_threshold)
+    
+    for i in np.nonzero(needs_substring.any(axis=1))[0]:
+        row = similarity[i]
+        candidates = np.nonzero(needs_substring[i])[0]
+        for j in candidates[np.argsort(-upper_bound[i, candidates], kind='stable')]:
+            best = row.max()
+            # 剩余候选的上界都不超过当前最大值，不可能改变最大值
+            if upper_bound[i, j] < best:
+                break
+            # 上界与当前最大值相同且位于其后，即使取到上界也不会改变argmax（首次出现）
+            if upper_bound[i, j] == best and j > row.argmax():
+                continue
+            substring_similarity = np.array([calculate_substring_similarity(clean_texts1[i], clean_texts2[j])])
+            row[j] = _combine_similarity(
+                base_similarity[i, j:j + 1], substring_similarity, bonus_floor[i, j:j + 1], has_words[i, j:j + 1],
+                semantic_containment_threshold
+            )[0]
+    
+    return similarity.max(axis=1), similarity.argmax(axis=1)
+
+def calculate_semantic_containment_matrix(texts1: List[str], texts2: List[str]) -> np.ndarray:
+    """
+    批量计算两组文本的两两语义包含度矩阵（较短词集合在较长词集合中的包含比例）
+    
+    Args:
+        texts1: 第一组文本（矩阵的行）
+        texts2: 第二组文本（矩阵的列）
+    
+    Returns:
+        np.ndarray: 形状为(len(texts1), len(texts2))的语义包含度矩阵
+    """
+    if not texts1 or not texts2:
+        return np.zeros((len(texts1), len(texts2)), dtype=np.float64)
+    
+    _, words1, _ = _prepare_texts(texts1)
+    _, words2, _ = _prepare_texts(texts2)
+    word_intersection, word_sizes1, word_sizes2 = _overlap_counts(words1, words2)
+    word_intersection = word_intersection.toarray()
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        semantic_containment = word_intersection / np.minimum(word_sizes1[:, None], word_sizes2[None, :])
     
-    return final_similarity
+    has_words = (word_sizes1 > 0)[:, None] & (word_sizes2 > 0)[None, :]
+    return np.where(has_words, semantic_containment, 0.0)